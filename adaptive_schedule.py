@@ -0,0 +1,138 @@
+"""
+Adapts how often each node is probed to how often it changes.
+
+Most nodes report the same memory, ports, boot time and SSH peers sweep after
+sweep. Each time a node is found unchanged, the interval before it is next due
+doubles, up to its maximum. Any change, or failure, returns it to its minimum.
+Sweeps then only probe the nodes which are due, so their cost follows the
+rate of change in the inventory rather than its size.
+
+Both bounds may be given, in seconds, per node in the nodes file, as
+"min_interval" and "max_interval".
+"""
+from __future__ import annotations
+
+import json
+import math
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from check_result import CheckResult
+from indie_gen_funcs import ErrorHandler, RESULTS_DIR, DATE_MON_FMT, \
+    load_results_by_ip, result_timestamp
+
+STATE_FILE = "{}/adaptive_state.json".format(RESULTS_DIR)
+
+
+def signature(result: CheckResult) -> List[Optional[str]]:
+    """The fields expected to stay the same on a stable node."""
+    return [result.mem_avail, result.ports, result.last_boot, result.ssh_peers]
+
+
+def has_failed(result: Optional[CheckResult]) -> bool:
+    return result is None or result.ave_ping_rtt_ms is None
+
+
+class AdaptiveScheduler:
+    """
+    Keeps, for each node IP, the interval it is probed at, when it is next
+    due and its last signature.
+    """
+    DEFAULT_MIN_S = 0.0
+    DEFAULT_MAX_S = 24 * 3600.0
+    # The shortest interval a stable node doubles from:
+    STEP_S = 900.0
+
+    def __init__(self, state: Dict[str, dict], state_file: str = STATE_FILE):
+        self.state = state
+        self.state_file = state_file
+
+    @classmethod
+    def load(cls, check_result: CheckResult, state_file: str = STATE_FILE) \
+            -> AdaptiveScheduler:
+        try:
+            with open(state_file, encoding="utf8") as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            state = {}
+        scheduler = cls(state, state_file)
+        scheduler.seed_from_history(check_result)
+        return scheduler
+
+    def save(self):
+        Path(self.state_file).parent.mkdir(parents=True, exist_ok=True)
+        with open(self.state_file, "w", encoding="utf8") as f:
+            json.dump(self.state, f, indent=2)
+
+    @classmethod
+    def bounds(cls, rmt_pc: dict):
+        min_s = float(rmt_pc.get("min_interval", cls.DEFAULT_MIN_S))
+        max_s = float(rmt_pc.get("max_interval", cls.DEFAULT_MAX_S))
+        return min_s, max(min_s, max_s)
+
+    def seed_from_history(self, check_result: CheckResult):
+        """
+        Nodes without state are given some, from this month's results, so
+        that nodes long known to be stable needn't work their way up to it.
+        """
+        yymm = datetime.utcnow().strftime(DATE_MON_FMT)
+        for ipv4, results in load_results_by_ip(yymm, check_result).items():
+            if ipv4 in self.state:
+                continue
+            last = results[-1]
+            stable_run = 0
+            for result in reversed(results):
+                if has_failed(result) or signature(result) != signature(last):
+                    break
+                stable_run += 1
+            interval = 0.0
+            if stable_run > 1:
+                # A long enough run would otherwise double past any float:
+                doublings = min(stable_run - 1, math.ceil(
+                    math.log2(self.DEFAULT_MAX_S / self.STEP_S)))
+                interval = min(self.DEFAULT_MAX_S, self.STEP_S * 2 ** doublings)
+            self.state[ipv4] = {
+                "interval": interval,
+                "due": result_timestamp(yymm, last) + interval,
+                "signature": signature(last),
+            }
+
+    def due(self, servers: List[dict], now: Optional[float] = None) -> List[dict]:
+        """:return: those servers due a probe, in inventory order."""
+        now = time.time() if now is None else now
+        due_servers = []
+        for rmt_pc in servers:
+            node_state = self.state.get(rmt_pc["ip"])
+            if node_state is None:
+                due_servers.append(rmt_pc)
+                continue
+            # The node's bounds may have been edited since it was scheduled:
+            max_s = self.bounds(rmt_pc)[1]
+            probed = node_state["due"] - node_state["interval"]
+            if now >= min(node_state["due"], probed + max_s):
+                due_servers.append(rmt_pc)
+        return due_servers
+
+    def record(self, servers: List[dict], results: List[CheckResult],
+               err_handler: ErrorHandler, now: Optional[float] = None):
+        """Reschedules the servers just probed, according to their results."""
+        now = time.time() if now is None else now
+        results_by_ip = {result.ipv4: result for result in results}
+        for rmt_pc in servers:
+            ipv4 = rmt_pc["ip"]
+            result = results_by_ip.get(ipv4)
+            min_s, max_s = self.bounds(rmt_pc)
+            node_state = self.state.get(ipv4, {})
+            if has_failed(result) or ipv4 in err_handler.errors or \
+                    signature(result) != node_state.get("signature"):
+                interval = min_s
+            else:
+                interval = min(max_s, 2 * max(
+                    min_s, node_state.get("interval", 0.0), self.STEP_S))
+            self.state[ipv4] = {
+                "interval": interval,
+                "due": now + interval,
+                "signature": None if result is None else signature(result),
+            }
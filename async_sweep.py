@@ -0,0 +1,155 @@
+"""
+An asyncio engine for sweeping the inventory.
+
+The whole inventory is pinged in one batch before any node is probed. Each
+node answering then passes through up to two stages, HTTP and SSH, and each
+stage has its own concurrency limit. Both use blocking libraries, so are
+offloaded to executors no larger than their stage's limit. Thousands of nodes
+can then be queued without thousands of threads, and a saturated SSH stage no
+longer holds back the HTTP requests of the nodes queued behind it.
+"""
+from __future__ import annotations
+
+import asyncio
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Awaitable, List, Optional, Tuple
+
+from check_result import CheckResult
+from indie_gen_funcs import ErrorHandler, ResultHolder, DAY_TIME_FMT
+from interrog_routines import IInterrogator, STAGED_ROUTINES
+from ping_functions import LatenciesByIp, PingStats
+from time_budget import TimeBudget
+
+
+@dataclass(frozen=True)
+class StageLimits:
+    """How many nodes may be in each stage at once."""
+    http: int = 50
+    ssh: int = 10
+
+    @classmethod
+    def from_csv(cls, limits_csv: str) -> StageLimits:
+        """Reads "http,ssh", eg "50,10", as given on the command line."""
+        return cls(*map(int, limits_csv.split(",")))
+
+
+class AsyncSweeper:
+    """
+    Runs a whole sweep on its own event loop. A routine named in
+    STAGED_ROUTINES has its HTTP stage limited separately from its SSH stage,
+    any other runs whole within the SSH stage.
+
+    A node's time budget starts once it is let into its first stage, and
+    includes any wait for a place in the SSH stage after HTTP.
+    """
+
+    def __init__(self, check_result: CheckResult,
+                 interrog_routine: IInterrogator, limits: StageLimits,
+                 pings: LatenciesByIp,
+                 budget: Optional[TimeBudget] = None):
+        self.check_result = check_result
+        self.http_stage, self.ssh_stage = STAGED_ROUTINES.get(
+            interrog_routine, (None, interrog_routine))
+        self.limits = limits
+        self.budget = budget
+        self.pings = pings
+
+    def sweep(self, servers: List[dict], result_holder: ResultHolder,
+              err_handler: ErrorHandler):
+        """
+        Probes all servers, merging the results and errors of each into those
+        given, in inventory order.
+        """
+        node_outcomes = asyncio.run(self.sweep_all(servers, result_holder.time))
+        for node_errors, node_results in node_outcomes:
+            err_handler.merge(node_errors)
+            result_holder.extend(node_results.results)
+
+    async def sweep_all(self, servers: List[dict], sweep_time) \
+            -> List[Tuple[ErrorHandler, ResultHolder]]:
+        # Semaphores must be made within the loop they are to serve.
+        self.http_slots = asyncio.Semaphore(self.limits.http)
+        self.ssh_slots = asyncio.Semaphore(self.limits.ssh)
+        self.http_pool = ThreadPoolExecutor(self.limits.http)
+        self.ssh_pool = ThreadPoolExecutor(self.limits.ssh)
+        try:
+            return await asyncio.gather(*(
+                self.sweep_node(rmt_pc, sweep_time) for rmt_pc in servers))
+        finally:
+            # Not waiting on probes given up on once their budget was spent,
+            # which the SSH timeouts we passed on should soon end.
+            for pool in (self.http_pool, self.ssh_pool):
+                pool.shutdown(wait=False, cancel_futures=True)
+
+    async def sweep_node(self, rmt_pc: dict, sweep_time) \
+            -> Tuple[ErrorHandler, ResultHolder]:
+        node_errors = ErrorHandler()
+        node_results = ResultHolder(sweep_time)
+        ipv4 = rmt_pc["ip"]
+        try:
+            await self.probe_node(rmt_pc, node_errors, node_results)
+        except asyncio.TimeoutError:
+            node_errors.current_ip = ipv4
+            node_errors.append(TimeBudget.OVERRUN.format(ipv4))
+            if not node_results.results:
+                node_results.append(node_results.partial(ipv4) or
+                                    self.check_result.from_fields(
+                                        [sweep_time.strftime(DAY_TIME_FMT), ipv4]))
+        return node_errors, node_results
+
+    async def probe_node(self, rmt_pc: dict, node_errors: ErrorHandler,
+                         node_results: ResultHolder):
+        """
+        :raises asyncio.TimeoutError: when the node's budget has been spent.
+        """
+        ipv4 = rmt_pc["ip"]
+        node_errors.current_ip = ipv4
+        latencies = self.pings[ipv4]
+        if len(latencies) == 0:
+            ping_stats = PingStats.of(latencies)
+            node_results.append(self.check_result(
+                node_results.time.strftime(DAY_TIME_FMT), ipv4,
+                ping_loss_pct=ping_stats.loss_cell(), ping_method=ping_stats.method))
+            return
+        loop = asyncio.get_running_loop()
+        interrogate = self.ssh_stage
+        if self.http_stage is None:
+            await self.ssh_slots.acquire()
+            deadline, rmt_pc = self.start_budget(rmt_pc)
+        else:
+            async with self.http_slots:
+                deadline, rmt_pc = self.start_budget(rmt_pc)
+                http_outcome = await self.before(deadline, loop.run_in_executor(
+                    self.http_pool, self.http_stage, node_errors, rmt_pc))
+            if http_outcome is None:
+                return
+            interrogate = functools.partial(
+                self.ssh_stage, http_outcome=http_outcome)
+            await self.before(deadline, self.ssh_slots.acquire())
+        try:
+            await self.before(deadline, loop.run_in_executor(
+                self.ssh_pool, interrogate, node_errors, rmt_pc, node_results,
+                ipv4, latencies))
+        finally:
+            self.ssh_slots.release()
+
+    def start_budget(self, rmt_pc: dict) -> Tuple[Optional[float], dict]:
+        """
+        :return: the node's deadline, if any, and its entry, its SSH timeout
+            bounded by the deadline.
+        """
+        if self.budget is None:
+            return None, rmt_pc
+        deadline = self.budget.node_deadline(time.monotonic())
+        return deadline, {"ssh_timeout": deadline - time.monotonic(), **rmt_pc}
+
+    @staticmethod
+    async def before(deadline: Optional[float], awaitable: Awaitable):
+        """Awaits, but only until the deadline, if any."""
+        if deadline is None:
+            return await awaitable
+        return await asyncio.wait_for(
+            awaitable, max(0.0, deadline - time.monotonic()))
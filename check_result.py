@@ -1,5 +1,5 @@
 from __future__ import annotations
-from dataclasses import dataclass
+from dataclasses import dataclass, fields
 from typing import List, Optional
 
 
@@ -46,22 +46,45 @@ class CheckResult:
     disk_avail: Optional[str] = None
     last_boot: Optional[str] = None
     ports: Optional[str] = None
+    # Why the node wasn't probed, eg "skipped", or None if it was.
+    status: Optional[str] = None
+    # Percentage of the ping burst lost, and the spread of the rest, as
+    # "min_p50_p95_max_mdev" ms.
+    ping_loss_pct: Optional[str] = None
+    ping_spread_ms: Optional[str] = None
+    # How the ping columns were measured, eg "icmp", or "tcp" handshakes.
+    ping_method: Optional[str] = None
+    # Whether http_rtt_ms was over a new connection, "cold", or a kept one, "warm".
+    http_conn: Optional[str] = None
+    # The ms http_rtt_ms and the body took, as "dns_connect_tls_ttfb_transfer".
+    http_phases: Optional[str] = None
+    # Of the home page, to tell when it changes, for nodes with hash_body.
+    body_hash: Optional[str] = None
+    # Days until the home page's certificate expires, who issued it, and how
+    # many certificates its chain had.
+    cert_days: Optional[str] = None
+    cert_issuer: Optional[str] = None
+    cert_chain: Optional[str] = None
     # Ensure this is last. It is most volatile, as attackers come (and go).
     ssh_peers: Optional[str] = None
 
     @staticmethod
     def get_header() -> str:
-        return "{},{},{},{},{},{},{},{},{},{},{},{}\n".format(
+        return "{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{}\n".format(
             "time", "ipv4", "ping", "ping_max",
             "http_ms", "http_code", "mem_avail", "swap_free",
-            "disk_avail", "last_boot", "ports", "ssh_peers")
+            "disk_avail", "last_boot", "ports", "status", "ping_loss",
+            "ping_spread", "ping_method", "http_conn", "http_phases",
+            "body_hash", "cert_days", "cert_issuer", "cert_chain", "ssh_peers")
 
     def to_csv(self) -> str:
-        return "{},{},{},{},{},{},{},{},{},{},{},{}\n".format(
+        return "{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{}\n".format(
             self.local_time, format_ipv4(self.ipv4), self.ave_ping_rtt_ms,
             self.ping_max_ms, self.http_rtt_ms, self.http_code, self.mem_avail,
             self.swap_free, self.disk_avail, self.last_boot, self.ports,
-            self.ssh_peers)
+            self.status, self.ping_loss_pct, self.ping_spread_ms,
+            self.ping_method, self.http_conn, self.http_phases, self.body_hash,
+            self.cert_days, self.cert_issuer, self.cert_chain, self.ssh_peers)
 
     @classmethod
     def get_unit_name(cls) -> str:
@@ -70,6 +93,10 @@ class CheckResult:
     @classmethod
     def result_from_csv(cls, line: str) -> CheckResult:
         cells = deserialise_simple_csv(line)
+        # Rows written before newer columns were added lack them, but still
+        # end with ssh_peers:
+        while len(cells) < len(fields(cls)):
+            cells.insert(-1, None)
         return cls(*cells)
 
     @classmethod
@@ -0,0 +1,139 @@
+"""
+Stops fully probing nodes which keep failing.
+
+A down node costs a sweep the whole of a 4 packet ping timing out, and an
+unresponsive SSH server can cost it every credential being tried in turn.
+Once a node has failed enough sweeps running, its circuit opens: it is then
+only given a single, quickly abandoned, ping, and that only when its backoff
+has elapsed. Each unanswered ping doubles the backoff. Once the node answers
+it is probed fully again, and its circuit closes if that succeeds.
+
+Nodes skipped meanwhile still get a row, with a status of "skipped".
+"""
+from __future__ import annotations
+
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from check_result import CheckResult
+from indie_gen_funcs import ErrorHandler, RESULTS_DIR
+from ping_functions import is_reachable
+
+STATE_FILE = "{}/circuit_state.json".format(RESULTS_DIR)
+
+
+def is_down(ipv4: str, result: Optional[CheckResult],
+            err_handler: ErrorHandler) -> bool:
+    """
+    A node is down if it didn't answer pings, or if it raised errors without
+    our getting anything over SSH.
+    """
+    if result is None or result.ave_ping_rtt_ms is None:
+        return True
+    return ipv4 in err_handler.errors and result.mem_avail is None
+
+
+def answers_ping(rmt_pc: dict) -> bool:
+    return is_reachable(rmt_pc["ip"])
+
+
+class CircuitBreaker:
+    """
+    Keeps, for each node IP failing lately, how many sweeps it has failed
+    and, once its circuit is open, its backoff and when it is next retried.
+
+    :param trip_after: consecutive failed sweeps which open a node's circuit.
+    """
+    BASE_BACKOFF_S = 900.0
+    MAX_BACKOFF_S = 24 * 3600.0
+    SKIPPED = "skipped"
+    TRIPPED = "{} has failed {} sweeps running, so will only be pinged, " \
+              "ever less often, until it answers."
+
+    def __init__(self, state: Dict[str, dict], trip_after: int,
+                 state_file: str = STATE_FILE):
+        self.state = state
+        self.trip_after = trip_after
+        self.state_file = state_file
+
+    @classmethod
+    def load(cls, trip_after: int, state_file: str = STATE_FILE) \
+            -> CircuitBreaker:
+        try:
+            with open(state_file, encoding="utf8") as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            state = {}
+        return cls(state, trip_after, state_file)
+
+    def save(self):
+        Path(self.state_file).parent.mkdir(parents=True, exist_ok=True)
+        with open(self.state_file, "w", encoding="utf8") as f:
+            json.dump(self.state, f, indent=2)
+
+    def is_open(self, ipv4: str) -> bool:
+        return self.state.get(ipv4, {}).get("failures", 0) >= self.trip_after
+
+    def triage(self, servers: List[dict], workers: int = 1,
+               now: Optional[float] = None,
+               reachable: Callable[[dict], bool] = answers_ping) \
+            -> Tuple[List[dict], List[dict]]:
+        """
+        Pings those nodes with open circuits whose backoff has elapsed, up to
+        `workers` at once.
+
+        :param reachable: checks a node answers, in place of a single ping.
+        :return: the servers to probe fully, and those to skip, each in
+            inventory order.
+        """
+        now = time.time() if now is None else now
+        retries = [rmt_pc for rmt_pc in servers if self.is_open(rmt_pc["ip"])
+                   and now >= self.state[rmt_pc["ip"]]["retry"]]
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            answered = list(executor.map(reachable, retries))
+        recovering = set()
+        for rmt_pc, reachable in zip(retries, answered):
+            if reachable:
+                recovering.add(rmt_pc["ip"])
+            else:
+                self.back_off(rmt_pc["ip"], now)
+        to_probe, to_skip = [], []
+        for rmt_pc in servers:
+            if self.is_open(rmt_pc["ip"]) and rmt_pc["ip"] not in recovering:
+                to_skip.append(rmt_pc)
+            else:
+                to_probe.append(rmt_pc)
+        return to_probe, to_skip
+
+    def back_off(self, ipv4: str, now: float):
+        node_state = self.state[ipv4]
+        node_state["backoff"] = min(self.MAX_BACKOFF_S, 2 * node_state["backoff"])
+        node_state["retry"] = now + node_state["backoff"]
+
+    def record(self, servers: List[dict], results: List[CheckResult],
+               err_handler: ErrorHandler, now: Optional[float] = None):
+        """
+        Counts the failures of the servers just probed, opening the circuits
+        of any failing once too often, and closing those of any succeeding.
+        """
+        now = time.time() if now is None else now
+        results_by_ip = {result.ipv4: result for result in results}
+        for rmt_pc in servers:
+            ipv4 = rmt_pc["ip"]
+            if not is_down(ipv4, results_by_ip.get(ipv4), err_handler):
+                self.state.pop(ipv4, None)
+                continue
+            was_open = self.is_open(ipv4)
+            node_state = self.state.setdefault(ipv4, {"failures": 0})
+            node_state["failures"] += 1
+            if was_open:
+                # It answered a ping, but no more than that:
+                self.back_off(ipv4, now)
+            elif self.is_open(ipv4):
+                node_state["backoff"] = self.BASE_BACKOFF_S
+                node_state["retry"] = now + self.BASE_BACKOFF_S
+                err_handler.current_ip = ipv4
+                err_handler.append(self.TRIPPED.format(ipv4, node_state["failures"]))
@@ -41,9 +41,9 @@ class RangeFinder:
     Underscores are used to separate related fields that don't warrant having
     separate columns.
 
-    Negative values are not supported.
+    Values may be negative, as is the cert_days of an expired certificate.
     """
-    expression = re.compile(r'^([0-9]*\.?[0-9]+)(Ti|T|TB|Gi|G|GB|Mi|M|MB|Ki|K|KB)?$')
+    expression = re.compile(r'^(-?[0-9]*\.?[0-9]+)(Ti|T|TB|Gi|G|GB|Mi|M|MB|Ki|K|KB)?$')
     powers = "KMGT"
 
     @staticmethod
@@ -242,15 +242,18 @@ def display_statistics(header: List[str], numeric_cols: Dict[int, List[List[Scal
         return ""
     content = "\n<h3>Statistics:</h3>\n<ul>"
     for item in numeric_cols.items():
-        if len(item[1][0]) == 1:
-            stats = RangeFinder.summarise_numbers([x[0] for x in item[1]])
+        # A lone "None", as of an unreachable node, stands for each sub-value:
+        width = max(map(len, item[1]))
+        rows = [row + [None] * (width - len(row)) for row in item[1]]
+        if width == 1:
+            stats = RangeFinder.summarise_numbers([x[0] for x in rows])
             # content += "\n<li><em>{}</em>: <pre>{}</pre></li>\n".format(header[item[0]], json.dumps(stats, indent=2))
             content += "\n<li><em>{}:</em>\n<ul>\n".format(header[item[0]])
             for k, v in stats.items():
                 content += "<li><em>{}:</em> {}</li>\n".format(k, v)
             content += "</ul></li>\n"
         else:
-            cols = RangeFinder.unzip(item[1])
+            cols = RangeFinder.unzip(rows)
             content += "\n<li><em>{}:</em>\n<ul>\n".format(header[item[0]])
             for i, col in enumerate(cols):
                 stats = RangeFinder.summarise_numbers(col)
@@ -0,0 +1,388 @@
+"""
+Keeps the connections to home pages open between probes.
+
+A single requests.Session serves every probe in the process, so a node's
+connection, and its TLS session, outlive the request that opened them. The
+next request to the node that verifies the same way, in a later sweep of a
+resident monitor, say, can then skip the handshakes, as long as the node has
+kept its end open. Connections are pooled by how they verify, so a retry
+without verification gets a new one, as does a request whose verification
+failed, since its connection is dropped rather than kept.
+
+Whether a response was over a new connection, "cold", or one kept from an
+earlier request, "warm", is told by its socket, since urllib3 reconnects a
+dropped connection within the same connection object.
+
+The connections are urllib3's own, but timed as they go: resolving the host,
+connecting to it, the TLS handshake, and the wait for the first byte of each
+response. Those phases are kept on the connection, for the probe to read off
+its response.
+
+New connections over TLS resume the session last had with the host, where it
+allows, sparing a round trip and the key exchange. A resumed connection is
+"resumed", rather than "cold". That needs the session to be set up by the same
+SSLContext, so there is one per way of verifying, rather than one per
+connection, as urllib3 would have it.
+"""
+from __future__ import annotations
+
+import hashlib
+import math
+import os
+import socket
+import ssl
+import threading
+import time
+import weakref
+from dataclasses import dataclass
+from http.cookiejar import DefaultCookiePolicy
+from typing import Dict, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ConnectTimeoutError
+from urllib3.util.connection import allowed_gai_family
+
+from indie_gen_funcs import kept_connections_limit
+
+COLD = "cold"
+WARM = "warm"
+RESUMED = "resumed"
+# Hosts whose connections are kept, which should cover the inventory, unless
+# the limit on open files allows fewer. The least recently used go first.
+POOL_HOSTS = 1024
+# Connections kept per host. More may be opened, but are closed once used.
+POOL_PER_HOST = 2
+# The most of a body read, by default. Only its status and timing are kept.
+BODY_CAP = 64 * 1024
+CHUNK_BYTES = 16 * 1024
+
+_lock = threading.Lock()
+_session = None
+_session_pid = None
+# The sockets responses have already been read from:
+_used_socks: weakref.WeakSet = weakref.WeakSet()
+# Under the cert_reqs, ca_certs and ca_cert_dir they verify with:
+_contexts: Dict[Tuple[str, Optional[str], Optional[str]], ResumingContext] = {}
+
+
+@dataclass(frozen=True)
+class HttpPhases:
+    """The ms each phase of a request took. Those of a warm one's connection are 0."""
+    dns_ms: float = 0.0
+    connect_ms: float = 0.0
+    tls_ms: float = 0.0
+    ttfb_ms: float = 0.0
+    transfer_ms: float = 0.0
+
+    def cell(self) -> str:
+        """:return: "dns_connect_tls_ttfb_transfer", in ms."""
+        return "_".join("{:.1f}".format(ms) for ms in (
+            self.dns_ms, self.connect_ms, self.tls_ms, self.ttfb_ms,
+            self.transfer_ms))
+
+
+def since_ms(started: float) -> float:
+    return 1000 * (time.perf_counter() - started)
+
+
+class TimedConnection:
+    """
+    Mixed into urllib3's connections. Host resolution, normally part of
+    connecting, is done first so as to be timed apart. Each address is then
+    tried in turn, as urllib3 would, eg falling back to IPv4 from a broken
+    IPv6 route, and connect_ms covers every attempt.
+    """
+    # Of the last connect, and the last response, of this connection:
+    dns_ms = 0.0
+    connect_ms = 0.0
+    tls_ms = 0.0
+    ttfb_ms = 0.0
+
+    def _new_conn(self) -> socket.socket:
+        started = time.perf_counter()
+        self.dns_ms = self.connect_ms = self.tls_ms = 0.0
+        host = self._dns_host
+        try:
+            addresses = [info[4][0] for info in socket.getaddrinfo(
+                host, self.port, allowed_gai_family(), socket.SOCK_STREAM)]
+        except OSError:
+            addresses = []
+        if not addresses:
+            # For urllib3 to fail on, in its own terms.
+            return super()._new_conn()
+        self.dns_ms = since_ms(started)
+        resolved = time.perf_counter()
+        try:
+            for i, address in enumerate(addresses):
+                self._dns_host = address
+                try:
+                    sock = super()._new_conn()
+                    break
+                except ConnectTimeoutError:
+                    # Which NewConnectionError is too:
+                    if i == len(addresses) - 1:
+                        raise
+        finally:
+            self._dns_host = host
+        self.connect_ms = since_ms(resolved)
+        self.connected = time.perf_counter()
+        return sock
+
+    def getresponse(self, *args, **kwargs):
+        # The request has been sent, and this waits for the response headers.
+        started = time.perf_counter()
+        response = super().getresponse(*args, **kwargs)
+        self.ttfb_ms = since_ms(started)
+        return response
+
+
+class TimedHTTPConnection(TimedConnection, HTTPConnection):
+    pass
+
+
+@dataclass(frozen=True)
+class CertSummary:
+    """
+    Of the certificates a host sent in its handshake.
+
+    :param not_after: when the host's certificate expires, in epoch seconds.
+    :param issuer: its issuer's organisation, or failing that, common name.
+    :param chain_length: how many certificates were sent, or None if that
+        can't be told, as before Python 3.10.
+    """
+    not_after: float
+    issuer: Optional[str]
+    chain_length: Optional[int]
+
+    @classmethod
+    def of(cls, ssl_sock: ssl.SSLSocket) -> Optional[CertSummary]:
+        """:return: the summary, or None if the certificates can't be read."""
+        # Private before Python 3.13, which returns DER from its public one.
+        get_chain = getattr(ssl_sock._sslobj, "get_unverified_chain", None)
+        if get_chain is not None:
+            chain = [cert.get_info() for cert in get_chain() or []]
+        else:
+            # Which is only parsed once verified:
+            chain = [ssl_sock.getpeercert()]
+        if not chain or not chain[0]:
+            return None
+        issuer = dict(attr for rdn in chain[0]["issuer"] for attr in rdn)
+        return cls(ssl.cert_time_to_seconds(chain[0]["notAfter"]),
+                   issuer.get("organizationName", issuer.get("commonName")),
+                   None if get_chain is None else len(chain))
+
+    def days_left(self, now: Optional[float] = None) -> int:
+        now = time.time() if now is None else now
+        return math.floor((self.not_after - now) / (24 * 3600))
+
+    def cells(self, now: Optional[float] = None) -> List[Optional[str]]:
+        """:return: the days left, issuer and chain length, for csv."""
+        return [str(self.days_left(now)),
+                None if self.issuer is None else self.issuer.replace(",", " "),
+                None if self.chain_length is None else str(self.chain_length)]
+
+
+class TimedHTTPSConnection(TimedConnection, HTTPSConnection):
+    resumed = False
+    # The SHA-256 of the host's certificate, as hex:
+    fingerprint = None
+    cert: Optional[CertSummary] = None
+
+    def connect(self):
+        super().connect()
+        self.tls_ms = since_ms(self.connected)
+        self.resumed = self.sock.session_reused
+        self.fingerprint = hashlib.sha256(
+            self.sock.getpeercert(binary_form=True)).hexdigest()
+        self.cert = CertSummary.of(self.sock)
+        if self.cert is None and self.resumed and \
+                isinstance(self.sock.context, ResumingContext):
+            # A resumed session's certificates aren't sent again.
+            self.cert = self.sock.context.recall_cert(self.sock)
+
+    def getresponse(self, *args, **kwargs):
+        response = super().getresponse(*args, **kwargs)
+        # TLS 1.3 sends session tickets after the handshake, so by now.
+        if isinstance(self.sock.context, ResumingContext):
+            self.sock.context.remember(self.sock, self.cert)
+        return response
+
+
+class ResumingContext(ssl.SSLContext):
+    """Resumes the last session had with each host."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__()
+        # With the certificates summarised when each was set up:
+        self.sessions: Dict[Tuple[Optional[str], tuple],
+                            Tuple[ssl.SSLSession, Optional[CertSummary]]] = {}
+
+    @staticmethod
+    def session_key(sock: socket.socket, server_hostname: Optional[str]):
+        return server_hostname, sock.getpeername()
+
+    def wrap_socket(self, sock, *args, server_hostname=None, session=None, **kwargs):
+        if session is None:
+            session, _ = self.sessions.get(
+                self.session_key(sock, server_hostname), (None, None))
+        return super().wrap_socket(
+            sock, *args, server_hostname=server_hostname, session=session, **kwargs)
+
+    def remember(self, ssl_sock: ssl.SSLSocket, cert: Optional[CertSummary]):
+        if ssl_sock.session is not None:
+            self.sessions[self.session_key(ssl_sock, ssl_sock.server_hostname)] = \
+                ssl_sock.session, cert
+
+    def recall_cert(self, ssl_sock: ssl.SSLSocket) -> Optional[CertSummary]:
+        return self.sessions.get(self.session_key(
+            ssl_sock, ssl_sock.server_hostname), (None, None))[1]
+
+
+def resuming_context(cert_reqs: str, ca_certs: Optional[str],
+                     ca_cert_dir: Optional[str]) -> ResumingContext:
+    """:return: the context for verifying so, made on first use."""
+    key = (cert_reqs, ca_certs, ca_cert_dir)
+    with _lock:
+        if key not in _contexts:
+            context = ResumingContext(ssl.PROTOCOL_TLS_CLIENT)
+            if cert_reqs == "CERT_NONE":
+                context.check_hostname = False
+                context.verify_mode = ssl.CERT_NONE
+            elif ca_certs or ca_cert_dir:
+                context.load_verify_locations(ca_certs, ca_cert_dir)
+            else:
+                context.load_default_certs()
+            _contexts[key] = context
+        return _contexts[key]
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+def shared_session() -> requests.Session:
+    """
+    :return: the process's session, made on first use. A forked child makes
+        its own, rather than share its parent's sockets.
+    """
+    global _session, _session_pid
+    with _lock:
+        if _session is None or _session_pid != os.getpid():
+            _session = make_session()
+            _session_pid = os.getpid()
+        return _session
+
+
+class TimedAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": TimedHTTPConnectionPool, "https": TimedHTTPSConnectionPool}
+
+    # Called by requests 2.32 on, as requirements.txt pins.
+    def build_connection_pool_key_attributes(self, request, verify, cert=None):
+        host_params, pool_kwargs = super().build_connection_pool_key_attributes(
+            request, verify, cert)
+        if host_params["scheme"] == "https":
+            # Verifying by the context, rather than each connection.
+            pool_kwargs["ssl_context"] = resuming_context(
+                pool_kwargs["cert_reqs"], pool_kwargs.pop("ca_certs", None),
+                pool_kwargs.pop("ca_cert_dir", None))
+        return host_params, pool_kwargs
+
+
+def make_session() -> requests.Session:
+    session = requests.Session()
+    pool_hosts = min(POOL_HOSTS, max(1, kept_connections_limit() // POOL_PER_HOST))
+    adapter = TimedAdapter(pool_connections=pool_hosts, pool_maxsize=POOL_PER_HOST)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    # Each probe should see its home page as a new visitor would.
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    return session
+
+
+def connection_state(resp) -> str:
+    """
+    :param resp: a response requested with stream=True, so that its
+        connection is yet to be returned to the pool.
+    :return: COLD, WARM or, if cold but for resuming its TLS session, RESUMED.
+    """
+    connection = getattr(resp.raw, "connection", None)
+    sock = getattr(connection, "sock", None)
+    if sock is None:
+        return COLD
+    with _lock:
+        if sock in _used_socks:
+            return WARM
+        _used_socks.add(sock)
+    return RESUMED if getattr(connection, "resumed", False) is True else COLD
+
+
+def request_phases(conn, connection: str, transfer_ms: float) -> Optional[HttpPhases]:
+    """
+    :param conn: the connection a response came over.
+    :param connection: its state, per connection_state.
+    :param transfer_ms: how long the response's body took to read.
+    :return: the phases of the request, or None if its connection wasn't timed.
+    """
+    if not isinstance(conn, TimedConnection):
+        return None
+    if connection == WARM:
+        return HttpPhases(ttfb_ms=conn.ttfb_ms, transfer_ms=transfer_ms)
+    return HttpPhases(conn.dns_ms, conn.connect_ms, conn.tls_ms, conn.ttfb_ms,
+                      transfer_ms)
+
+
+@dataclass(frozen=True)
+class HomePage:
+    """
+    A home page response, its body read, up to a cap, and let go.
+
+    :param connection: the state of the connection it came over.
+    :param body_hash: of the body, or of as much as was read, if asked for
+        and there was one.
+    :param fingerprint: of the host's certificate, if over TLS.
+    :param cert: a summary of the certificates it sent, if over TLS.
+    """
+    resp: requests.Response
+    connection: str
+    phases: Optional[HttpPhases]
+    body_hash: Optional[str] = None
+    fingerprint: Optional[str] = None
+    cert: Optional[CertSummary] = None
+
+
+def get_home_page(url: str, verify, method: str = "GET",
+                  body_cap: int = BODY_CAP, hash_body: bool = False) -> HomePage:
+    """
+    Streams the body, reading no more than body_cap bytes of it. A body read
+    in full returns its connection to the pool, for next time. A longer one's
+    is closed, once bytes past the cap arrive, rather than read to its end.
+    """
+    resp = shared_session().request(
+        method, url, timeout=5, verify=verify, stream=True)
+    conn = getattr(resp.raw, "connection", None)
+    connection = connection_state(resp)
+    started = time.perf_counter()
+    hasher = hashlib.blake2b(digest_size=8) if hash_body else None
+    read = 0
+    for chunk in resp.iter_content(CHUNK_BYTES):
+        if hasher is not None:
+            hasher.update(chunk[:max(body_cap - read, 0)])
+        read += len(chunk)
+        if read > body_cap:
+            break
+    resp.close()
+    fingerprint = cert = None
+    if isinstance(conn, TimedHTTPSConnection):
+        fingerprint, cert = conn.fingerprint, conn.cert
+    return HomePage(resp, connection, request_phases(conn, connection, since_ms(started)),
+                    None if hasher is None or read == 0 else hasher.hexdigest(), fingerprint, cert)
@@ -3,15 +3,14 @@ from __future__ import annotations
 import argparse
 import os
 import smtplib
+import sys
 import traceback
-from datetime import datetime
+from datetime import datetime, timezone
 from email.message import EmailMessage
 from pathlib import Path
 from typing import Any, Callable
 from typing import Dict, List, Union, Optional
 
-import requests
-
 from check_result import CheckResult
 from html_tabulating import tabulate_csv_as_html
 
@@ -20,6 +19,12 @@ PUBLIC_IP = "where we test from. Can be read from json config."
 RESULTS_DIR = "results"
 DATE_MON_FMT = "%y%m"
 DAY_TIME_FMT = "%d %H:%M:%S"
+# Of the files a process may have open, the share that the connections kept
+# between sweeps may take, over HTTP and over SSH each. The other half is left
+# to the sweep itself, as tcp_probe.MAX_OPEN takes.
+KEPT_SHARE = 4
+# Where there's no limit to read, as on Windows, a typical one:
+TYPICAL_OPEN_FILES = 1024
 
 
 def send_email(msg: EmailMessage, email_from_addy: str, password: str):
@@ -55,6 +60,9 @@ def send_email(msg: EmailMessage, email_from_addy: str, password: str):
 
 
 def get_public_ip() -> str:
+    # Deferred, with paramiko's, so that emailing the month's results alone
+    # needn't pay to import either:
+    import requests
     res = requests.get("http://ipinfo.io")
     jres = res.json()
     return jres["ip"]
@@ -136,14 +144,33 @@ class ResultHolder:
     A class to hold check results in a list until they are ready for persisting.
     """
 
-    def __init__(self):
+    def __init__(self, time: Optional[datetime] = None):
+        """
+        :param time: when the sweep began. Workers' holders are given their
+            parent's, so that every row, and the month file, agree.
+        """
         self.results: List[CheckResult] = []
-        # Ideally all net operations should be done from a thread pool at once:
-        self.time = datetime.utcnow()
+        self.time = time if time is not None else datetime.utcnow()
+        # For nodes still being interrogated, should they run out of time:
+        self.in_progress: Dict[str, Callable[[], CheckResult]] = {}
 
     def append(self, result: CheckResult):
         self.results.append(result)
 
+    def extend(self, results: List[CheckResult]):
+        self.results.extend(results)
+
+    def track(self, ipv4: str, snapshot: Callable[[], CheckResult]):
+        """
+        :param snapshot: builds a result from whatever has been gathered on
+            the node so far.
+        """
+        self.in_progress[ipv4] = snapshot
+
+    def partial(self, ipv4: str) -> Optional[CheckResult]:
+        snapshot = self.in_progress.get(ipv4)
+        return snapshot() if snapshot else None
+
     def save(self, unit_name: str):
         Path(RESULTS_DIR).mkdir(parents=True, exist_ok=True)
         file_name = "{}/{}_{}.csv".format(
@@ -185,6 +212,40 @@ def compose_email(
     return msg
 
 
+def kept_connections_limit() -> int:
+    """
+    :return: how many connections may be kept open between sweeps over HTTP,
+        and again over SSH, so that together they leave the sweep enough of
+        the files this process may have open.
+    """
+    try:
+        import resource
+    except ImportError:
+        return TYPICAL_OPEN_FILES // KEPT_SHARE
+    soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft == resource.RLIM_INFINITY:
+        return sys.maxsize
+    return max(1, soft // KEPT_SHARE)
+
+
+def positive_int(value: str) -> int:
+    """For arguments counting things of which there must be at least one."""
+    count = int(value)
+    if count < 1:
+        raise argparse.ArgumentTypeError("must be at least 1, not {}".format(value))
+    return count
+
+
+def stage_limits_csv(value: str) -> str:
+    """For --stage_limits, which must be "http,ssh", each at least 1."""
+    limits = value.split(",")
+    if len(limits) != 2:
+        raise argparse.ArgumentTypeError("must be http,ssh, eg 50,10, not {}".format(value))
+    for limit in limits:
+        positive_int(limit)
+    return value
+
+
 def parse_args_for_monitoring(
         args_list: List[str], unit_name: str) -> argparse.Namespace:
     """
@@ -242,7 +303,75 @@ nodes_file is a list of servers with these fields:
         "-n", "--nodes_file",
         help="Name of json file describing the nodes to monitor.",
         default="monitored_{}s.json".format(unit_name))
+    parser.add_argument(
+        "-w", "--workers", type=positive_int, default=1,
+        help="Number of nodes to probe concurrently. 1 probes them serially.")
+    parser.add_argument(
+        "-a", "--stage_limits", type=stage_limits_csv,
+        help="Sweep using asyncio, with at most this many nodes being "
+             "requested over HTTP and SSHed into, at once, eg 50,10.")
+    parser.add_argument(
+        "-p", "--shards", type=positive_int, default=1,
+        help="Number of processes to divide the nodes between, each using "
+             "--workers threads. Not with --stage_limits.")
+    parser.add_argument(
+        "-b", "--node_budget", type=float,
+        help="Seconds each node may take before its partial results are "
+             "recorded and the sweep moves on.")
+    parser.add_argument(
+        "-d", "--sweep_deadline", type=float,
+        help="Seconds the whole sweep may take. Nodes not probed by then are "
+             "recorded as such.")
+    parser.add_argument(
+        "--adaptive", action="store_true",
+        help="Only probe nodes which are due, probing stable nodes less "
+             "often, between their min_interval and max_interval.")
+    parser.add_argument(
+        "-k", "--trip_after", type=positive_int,
+        help="Failed sweeps running after which a node is only pinged, ever "
+             "less often, until it answers, and otherwise recorded as skipped.")
+    parser.add_argument(
+        "-o", "--priority_wave", type=positive_int,
+        help="Probe the nodes most in need of attention first, emailing any "
+             "errors among this many of them before probing the rest.")
+    parser.add_argument(
+        "-c", "--ping_count", type=positive_int, default=4,
+        help="Echoes to send each node per sweep. Longer bursts tell loss and "
+             "jitter better.")
+    parser.add_argument(
+        "-i", "--ping_interval", type=float, default=1.0,
+        help="Seconds between the echoes sent each node, which may be less "
+             "than one.")
+    parser.add_argument(
+        "-r", "--reach_first", action="store_true",
+        help="Only wait for each node's first reply before probing it, "
+             "sampling the latency of those that answered meanwhile.")
+    parser.add_argument(
+        "--sample_every", type=positive_int, default=1,
+        help="Sample latency only every this many sweeps, in --daemon mode "
+             "with --reach_first.")
+    parser.add_argument(
+        "-t", "--tcp_probe", choices=["fallback", "primary"],
+        help="Time TCP handshakes, in place of pings, for nodes not answering "
+             "pings (fallback), or for all (primary).")
+    parser.add_argument(
+        "--tcp_ports", default="22,443",
+        help="Ports to time handshakes with, whichever answers first, unless "
+             "a node gives its own tcp_ports.")
+    parser.add_argument(
+        "--daemon", action="store_true",
+        help="Stay running, sweeping every --interval seconds, plus up to "
+             "--jitter seconds.")
+    parser.add_argument(
+        "--interval", type=float, default=7200.0,
+        help="Seconds between the starts of sweeps, in --daemon mode.")
+    parser.add_argument(
+        "--jitter", type=float, default=2400.0,
+        help="Most seconds by which to randomly delay each sweep, in --daemon mode.")
     args = parser.parse_args(args_list)
+    if args.stage_limits and args.shards > 1:
+        # The asyncio engine sweeps within the one process.
+        parser.error("--shards can't be combined with --stage_limits")
     return args
 
 
@@ -267,6 +396,28 @@ def load_results(
     return results
 
 
+def load_results_by_ip(yymm: str, check_result: CheckResult) -> Dict[str, List]:
+    """
+    :return: the month's results, oldest first, under the IP of each node.
+        Empty if the month has none yet.
+    """
+    try:
+        results = load_results(
+            yymm, check_result.result_from_csv, check_result.get_unit_name())
+    except FileNotFoundError:
+        return {}
+    results_by_ip = {}
+    for result in results:
+        results_by_ip.setdefault(result.ipv4, []).append(result)
+    return results_by_ip
+
+
+def result_timestamp(yymm: str, result: CheckResult) -> float:
+    """:return: when, in the month of a results file, a row was swept."""
+    swept = datetime.strptime(yymm + result.local_time, DATE_MON_FMT + DAY_TIME_FMT)
+    return swept.replace(tzinfo=timezone.utc).timestamp()
+
+
 def email_wout_further_checks(
         email_to: str, sender_addy: str, sender_pw: str,
         check_result: CheckResult):
@@ -281,6 +432,14 @@ def email_wout_further_checks(
 
 
 
+def format_error(error: Union[Exception, str]) -> str:
+    """Exceptions are given with their traceback."""
+    if isinstance(error, Exception):
+        return ''.join(traceback.format_exception(
+            type(error), value=error, tb=error.__traceback__))
+    return error
+
+
 class ErrorHandler:
     """
     Collects errors and indexes them as lists under the failing server's
@@ -301,6 +460,27 @@ class ErrorHandler:
             self.first_ip = self.current_ip
         self.errors.setdefault(self.current_ip, []).append(error)
 
+    def merge(self, other: ErrorHandler):
+        """
+        Adopts the errors collected by another handler, eg one dedicated to a
+        single node by a worker thread, after any already held.
+        """
+        if self.first_error is None and other.first_error is not None:
+            self.first_error = other.first_error
+            self.first_ip = other.first_ip
+        for ip, errors in other.errors.items():
+            self.errors.setdefault(ip, []).extend(errors)
+
+    def flatten_tracebacks(self):
+        """
+        Replaces exceptions with their formatted tracebacks, since traceback
+        objects can't be pickled, eg back from a worker process.
+        """
+        if isinstance(self.first_error, Exception):
+            self.first_error = str(self.first_error)
+        for errors in self.errors.values():
+            errors[:] = [format_error(error) for error in errors]
+
     def set_subject(self, unit_name: str):
         """
         This is not expected to be called when there are no errors to send.
@@ -324,12 +504,7 @@ class ErrorHandler:
         for ip in self.errors.keys():
             message += "================\n{}\n".format(ip)
             for error in self.errors[ip]:
-                if isinstance(error, Exception):
-                    message += ''.join(traceback.format_exception(
-                        type(error), value=error, tb=error.__traceback__))
-                    message += '\n\n'
-                else:
-                    message += f"{error}\n\n"
+                message += format_error(error) + "\n\n"
             message += "================\n\n"
         self.msg.set_content(message)
 
@@ -1,42 +1,146 @@
 from __future__ import annotations
 
-from typing import List
-
-import requests
-from requests.exceptions import SSLError
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
 
 from check_result import CheckResult
 from indie_gen_funcs import ErrorHandler, ResultHolder, DAY_TIME_FMT
-from paramiko_client import SSHInterrogator
+from ping_functions import PingStats, format_ms
+import ssh_pool
 
+IInterrogator = Callable[
+    [ErrorHandler, dict, ResultHolder, str, List[float]], None]
+# Certificates expiring sooner are reported, every sweep:
+CERT_WARN_DAYS = 14
+CERT_EXPIRING = "TLS certificate of {} expires in {} days"
 
-def interrog_routine(err_handler: ErrorHandler, rmt_pc: dict,
-                     result_holder: ResultHolder,
-                     ipv4: str, latencies: List[str]):
-    ave_latency_ms = str(int(round(sum(map(float, latencies)) / len(latencies))))
-    max_latency_ms = str(int(round(max(map(float, latencies)))))
-    response_ms = None
-    status_code = None
-    if "home_page" in rmt_pc:
-        try:
-            resp = requests.get(rmt_pc["home_page"], timeout=5, verify=rmt_pc.get("verify", True))
-        except SSLError as ssl_e:
+
+@dataclass(frozen=True)
+class HttpOutcome:
+    """Of a home_page request, all None for nodes without a home_page."""
+    response_ms: Optional[str] = None
+    status_code: Optional[int] = None
+    # Whether the response came over a new connection, "cold", or a kept one.
+    connection: Optional[str] = None
+    # As "dns_connect_tls_ttfb_transfer" ms.
+    phases: Optional[str] = None
+    # Of the body, or its first body_cap bytes, for nodes with hash_body.
+    body_hash: Optional[str] = None
+    # Of the host's certificate, and the rest of the chain it sent:
+    cert_days: Optional[str] = None
+    cert_issuer: Optional[str] = None
+    cert_chain: Optional[str] = None
+
+
+def probe_home_page(err_handler: ErrorHandler, rmt_pc: dict) -> Optional[HttpOutcome]:
+    """
+    :return: the outcome, which is all None for nodes without a home_page,
+        or None itself if the node didn't respond.
+    """
+    import requests
+    from requests.exceptions import SSLError
+    from http_pool import get_home_page, BODY_CAP
+    from tls_cache import shared_cache, tls_host
+    if "home_page" not in rmt_pc:
+        return HttpOutcome()
+    url = rmt_pc["home_page"]
+    options = dict(method=rmt_pc.get("http_method", "GET"),
+                   body_cap=rmt_pc.get("body_cap", BODY_CAP),
+                   hash_body=rmt_pc.get("hash_body", False))
+    verify = rmt_pc.get("verify", True)
+    host = tls_host(url)
+    tls_cache = None if host is None else shared_cache()
+    if tls_cache is not None and tls_cache.skips_verifying(host):
+        verify = False
+    verified = None
+    try:
+        home_page = get_home_page(url, verify, **options)
+        if verify is not False:
+            verified = True
+    except SSLError as ssl_e:
+        # Hosts known not to verify are instead reported if their cert changes.
+        if tls_cache is None or not tls_cache.is_unverified(host):
             err_handler.append(ssl_e)
-            resp = requests.get(rmt_pc["home_page"], timeout=5, verify=False)
-        except requests.exceptions.ConnectionError as awol_e:
-            # We failed. Not merely on TLS but the whole HTTP(S) response.
-            err_handler.append(awol_e)
-            # That will send us a whole, overly long, stack trace, later.
-            return
-        status_code = resp.status_code
-        if resp.ok:
-            response_ms = str(int(round(1000 * resp.elapsed.total_seconds())))
-    ssh_interrogator = SSHInterrogator(err_handler)
+        home_page = get_home_page(url, False, **options)
+        verified = False
+    except requests.exceptions.ConnectionError as awol_e:
+        # We failed. Not merely on TLS but the whole HTTP(S) response.
+        err_handler.append(awol_e)
+        # That will send us a whole, overly long, stack trace, later.
+        return None
+    if tls_cache is not None:
+        changed = tls_cache.record(host, home_page.fingerprint, verified)
+        if changed is not None:
+            err_handler.append(changed)
+    cert_cells = [None, None, None]
+    if home_page.cert is not None:
+        cert_cells = home_page.cert.cells()
+        if int(cert_cells[0]) < CERT_WARN_DAYS:
+            err_handler.append(CERT_EXPIRING.format(host, cert_cells[0]))
+    resp = home_page.resp
+    response_ms = None
+    if resp.ok:
+        response_ms = str(int(round(1000 * resp.elapsed.total_seconds())))
+    return HttpOutcome(
+        response_ms, resp.status_code, home_page.connection,
+        None if home_page.phases is None else home_page.phases.cell(),
+        home_page.body_hash, *cert_cells)
+
+
+def summarise_latencies(latencies: List[float]) -> Tuple[str, str]:
+    """:return: average and max latency, in ms, to the microsecond."""
+    ave_latency_ms = format_ms(sum(map(float, latencies)) / len(latencies))
+    max_latency_ms = format_ms(max(map(float, latencies)))
+    return ave_latency_ms, max_latency_ms
+
+
+def interrog_ssh(err_handler: ErrorHandler, rmt_pc: dict,
+                 result_holder: ResultHolder,
+                 ipv4: str, latencies: List[float],
+                 http_outcome: HttpOutcome = HttpOutcome()):
+    """Completes interrog_routine once its HTTP stage has an outcome."""
+    from paramiko_client import SSHInterrogator
+    ave_latency_ms, max_latency_ms = summarise_latencies(latencies)
+    ping_stats = PingStats.of(latencies)
+    ssh_interrogator = SSHInterrogator(
+        err_handler, timeout=rmt_pc.get("ssh_timeout"), pool=ssh_pool.installed())
+
+    def snapshot() -> CheckResult:
+        return CheckResult(
+            result_holder.time.strftime(DAY_TIME_FMT), ipv4, ave_latency_ms,
+            max_latency_ms, http_outcome.response_ms, str(http_outcome.status_code),
+            ssh_interrogator.mem_avail, ssh_interrogator.swap_free,
+            ssh_interrogator.disk_avail, ssh_interrogator.last_boot,
+            ssh_interrogator.ports, ping_loss_pct=ping_stats.loss_cell(),
+            ping_spread_ms=ping_stats.spread_cell(),
+            ping_method=ping_stats.method, http_conn=http_outcome.connection,
+            http_phases=http_outcome.phases, body_hash=http_outcome.body_hash,
+            cert_days=http_outcome.cert_days, cert_issuer=http_outcome.cert_issuer,
+            cert_chain=http_outcome.cert_chain,
+            ssh_peers=ssh_interrogator.ssh_peers
+        )
+    result_holder.track(ipv4, snapshot)
     ssh_interrogator.do_queries(rmt_pc)
-    result_holder.append(CheckResult(
+    result_holder.append(snapshot())
+
+
+def interrog_routine(err_handler: ErrorHandler, rmt_pc: dict,
+                     result_holder: ResultHolder,
+                     ipv4: str, latencies: List[float]):
+    ave_latency_ms, max_latency_ms = summarise_latencies(latencies)
+    ping_stats = PingStats.of(latencies)
+    result_holder.track(ipv4, lambda: CheckResult(
         result_holder.time.strftime(DAY_TIME_FMT), ipv4, ave_latency_ms,
-        max_latency_ms, response_ms, str(status_code),
-        ssh_interrogator.mem_avail, ssh_interrogator.swap_free,
-        ssh_interrogator.disk_avail, ssh_interrogator.last_boot,
-        ssh_interrogator.ports, ssh_interrogator.ssh_peers
-    ))
+        max_latency_ms, ping_loss_pct=ping_stats.loss_cell(),
+        ping_spread_ms=ping_stats.spread_cell(), ping_method=ping_stats.method))
+    http_outcome = probe_home_page(err_handler, rmt_pc)
+    if http_outcome is None:
+        return
+    interrog_ssh(err_handler, rmt_pc, result_holder, ipv4, latencies, http_outcome)
+
+
+# The HTTP and SSH stages making up each routine, for engines which limit
+# their concurrency separately. Routines not listed run as one, SSH, stage.
+STAGED_ROUTINES: Dict[IInterrogator, Tuple[Callable, Callable]] = {
+    interrog_routine: (probe_home_page, interrog_ssh),
+}
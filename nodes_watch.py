@@ -0,0 +1,65 @@
+"""
+Notices edits to the nodes file, so that a resident monitor can adopt them
+without being restarted, and so without losing what it holds on nodes that
+weren't edited.
+"""
+from __future__ import annotations
+
+import os
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+
+@dataclass(frozen=True)
+class NodesDiff:
+    """
+    :param added: servers new to the file.
+    :param removed: IPs of servers no longer in it.
+    :param changed: servers whose entries were edited, eg their creds.
+    """
+    added: List[dict]
+    removed: List[str]
+    changed: List[dict]
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed)
+
+
+def diff_nodes(old_servers: List[dict], new_servers: List[dict]) -> NodesDiff:
+    old_by_ip = {rmt_pc["ip"]: rmt_pc for rmt_pc in old_servers}
+    new_ips = {rmt_pc["ip"] for rmt_pc in new_servers}
+    return NodesDiff(
+        [rmt_pc for rmt_pc in new_servers if rmt_pc["ip"] not in old_by_ip],
+        [ipv4 for ipv4 in old_by_ip if ipv4 not in new_ips],
+        [rmt_pc for rmt_pc in new_servers
+         if rmt_pc["ip"] in old_by_ip and rmt_pc != old_by_ip[rmt_pc["ip"]]])
+
+
+class NodesFileWatcher:
+    """
+    Compares the file's inode, as well as its modification time and size, so
+    that editors which save by replacing the file are noticed too.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.stamp = self.current_stamp()
+
+    def current_stamp(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def has_changed(self) -> bool:
+        """:return: whether the file has changed since last asked."""
+        stamp = self.current_stamp()
+        if stamp == self.stamp:
+            return False
+        self.stamp = stamp
+        return True
+
+    def retry(self):
+        """Has the next call to has_changed report a change regardless."""
+        self.stamp = None
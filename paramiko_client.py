@@ -1,18 +1,39 @@
 import re
-from typing import Dict, Set, Tuple, List, Optional, Union
+import secrets
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+from typing import Callable, Dict, Set, Tuple, List, Optional, Union
 
 import paramiko
 from paramiko import SSHClient
-from paramiko.ssh_exception import AuthenticationException, BadHostKeyException
+from paramiko.ssh_exception import AuthenticationException, BadHostKeyException, SSHException
 
 from indie_gen_funcs import find_cells_under, \
     convert_date_to_human_readable
 from indie_gen_funcs import ErrorHandler
 import indie_gen_funcs
+from ssh_pool import SSHPool
+
+FREE = "free -h"
+BOOT_TIME = "who -b"
+DISK_FREE = "df -h --output=avail /"
+SSH_PEERS = "ss -tn sport = 22"
+PORTS = "ss -tuln"
+NVIDIA_SMI = "nvidia-smi"
+# A command, and what reads its output lines:
+Section = Tuple[str, Callable[[List[str]], None]]
 
 
 class SSHInterrogator:
-    def __init__(self, err_handler: ErrorHandler):
+    def __init__(self, err_handler: ErrorHandler, timeout: Optional[float] = None,
+                 pool: Optional[SSHPool] = None):
+        """
+        :param timeout: seconds allowed for each blocking network operation,
+            so that a stalled node can't hold our thread forever.
+        :param pool: to take any connection kept to the node from, and to give
+            the connection back to when done.
+        """
         self.mem_avail = None
         self.swap_free = None
         self.disk_avail = None
@@ -20,17 +41,51 @@ class SSHInterrogator:
         self.ssh_peers = None
         self.ports = None
         self.err_handler = err_handler
+        self.timeout = timeout
+        self.pool = pool
+        self.client: Optional[SSHClient] = None
+        self.rmt_pc: Dict[str, Union[List[dict], str]] = {}
+        # Whether the client was kept from an earlier sweep, and so may have died since:
+        self.reused = False
+        # Held by whichever of the channels' threads replaces a dead client:
+        self.reconnecting = threading.Lock()
 
     def do_queries(self, rmt_pc: Dict[str, Union[List[dict], str]]):
         # With paramiko/SSH, expect the unexpected, then recover and report the error.
         try:
-            con_err_str = self.initialise_connection(rmt_pc["ip"], rmt_pc["creds"])
+            con_err_str = self.connect(rmt_pc)
             if con_err_str:
                 self.err_handler.append(con_err_str)
             else:
                 self.remote_tentative_calls(rmt_pc)
         except Exception as e:
             self.err_handler.append(e)
+        finally:
+            self.release()
+
+    def connect(self, rmt_pc: Dict[str, Union[List[dict], str]]) -> Optional[str]:
+        """
+        Takes the connection kept to the node, if any, or else connects.
+
+        :return: error string, if "expected" error occurred.
+        """
+        self.rmt_pc = rmt_pc
+        if self.pool is not None:
+            self.client = self.pool.take(rmt_pc["ip"], rmt_pc["creds"])
+            if self.client is not None:
+                self.reused = True
+                return None
+        return self.initialise_connection(rmt_pc["ip"], rmt_pc["creds"])
+
+    def release(self):
+        """Gives the connection to the pool, if any, or else closes it."""
+        if self.client is None:
+            return
+        if self.pool is not None:
+            self.pool.give(self.rmt_pc["ip"], self.rmt_pc["creds"], self.client)
+        else:
+            self.client.close()
+        self.client = None
 
     def initialise_connection(self, ip_address: str, credentials: List[Dict[str,str]]) -> Optional[str]:
         """
@@ -47,7 +102,7 @@ class SSHInterrogator:
         for creds in credentials:
             try:
                 print(creds)
-                self.client.connect(ip_address, **creds)
+                self.client.connect(ip_address, **{**self.connect_timeouts(), **creds})
                 break
             except BadHostKeyException as bhk:
                 if f"'{ip_address}' does not match" in str(bhk):
@@ -57,18 +112,130 @@ class SSHInterrogator:
         else:
             return "No credentials were accepted by the remote host: {}".format(ip_address)
 
+    def connect_timeouts(self) -> Dict[str, float]:
+        if self.timeout is None:
+            return {}
+        return dict(timeout=self.timeout, banner_timeout=self.timeout,
+                    auth_timeout=self.timeout)
+
+    def exec_command(self, command: str):
+        """
+        SSHClient.exec_command, bounded by our timeout, if any. A kept
+        connection found dead by its first command is replaced, once, however
+        many channels found it so.
+        """
+        client, reused = self.client, self.reused
+        try:
+            result = self.exec_once(command)
+        except (SSHException, EOFError, OSError):
+            if not reused:
+                raise
+        else:
+            # Having worked, it isn't dead, so later failures are the node's:
+            self.reused = False
+            return result
+        with self.reconnecting:
+            if self.client is client:
+                self.reused = False
+                client.close()
+                con_err_str = self.initialise_connection(self.rmt_pc["ip"], self.rmt_pc["creds"])
+                if con_err_str:
+                    raise SSHException(con_err_str)
+        return self.exec_once(command)
+
+    def exec_once(self, command: str):
+        if self.timeout is None:
+            return self.client.exec_command(command)
+        return self.client.exec_command(command, timeout=self.timeout)
+
     def remote_tentative_calls(self, rmt_pc: Dict[str, Union[List[dict], str]]):
         """
         All of this should be wrapped in a try catch for when paramiko/network
         throws a googly.
+
+        Unless the node has "ssh_batch" false, the commands are run as one
+        script, costing one channel and round trip rather than one each.
+        Otherwise they each have a channel, all open at once.
         """
-        self.query_free()
-        self.query_boot_time()
-        self.query_disk_free()
+        if rmt_pc.get("ssh_batch", True):
+            self.query_batch(self.sections(rmt_pc))
+        else:
+            self.query_parallel(self.sections(rmt_pc))
+
+    def sections(self, rmt_pc: Dict[str, Union[List[dict], str]]) -> List[Section]:
         ssh_peers = self.parse_user_csv(rmt_pc.get("ssh_peers", ""))
         ssh_peers.add(indie_gen_funcs.PUBLIC_IP)
-        self.query_ssh_peers(ssh_peers)
-        self.query_ports(self.parse_user_csv(rmt_pc.get("known_ports", "")))
+        return [
+            (FREE, self.read_free),
+            (BOOT_TIME, self.read_boot_time),
+            (DISK_FREE, self.read_disk_free),
+            (SSH_PEERS, partial(self.read_ssh_peers, known_peers=ssh_peers)),
+            (PORTS, partial(self.read_ports,
+                            known_ports=self.parse_user_csv(rmt_pc.get("known_ports", "")))),
+        ]
+
+    def query_batch(self, sections: List[Section]):
+        """
+        Runs the sections' commands as one script, each followed by a line
+        marking its end, then has each section's lines read. A section
+        failing, to run or to be read, only loses its own fields.
+        """
+        marker = "server_mon-{}".format(secrets.token_hex(8))
+        script = "\n".join("{}; echo '{} {}'".format(command, marker, i)
+                           for i, (command, _) in enumerate(sections))
+        try:
+            stdin, stdout, stderr = self.exec_command(script)
+            outputs = self.split_sections(stdout.readlines(), marker)
+        except Exception as e:
+            self.err_handler.append(e)
+            return
+        for i, (command, read) in enumerate(sections):
+            try:
+                if i not in outputs:
+                    raise SSHException("No output from `{}`".format(command))
+                read(outputs[i])
+            except Exception as e:
+                self.err_handler.append(e)
+
+    def query_parallel(self, sections: List[Section]):
+        """
+        Runs each section's command over its own channel, multiplexed over
+        the one transport, so that the node takes as long as its slowest
+        command, rather than all of them. Sections are read, and their
+        errors collected, as they finish.
+        """
+        with ThreadPoolExecutor(max_workers=len(sections)) as executor:
+            futures = [executor.submit(self.query_section, command, read)
+                       for command, read in sections]
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    self.err_handler.append(e)
+
+    def query_section(self, command: str, read: Callable[[List[str]], None]):
+        stdin, stdout, stderr = self.exec_command(command)
+        read(stdout.readlines())
+
+    @staticmethod
+    def split_sections(lines: List[str], marker: str) -> Dict[int, List[str]]:
+        """
+        :return: the lines output before each marker line, under the number
+            it gives, for those reached.
+        """
+        outputs = {}
+        section_lines = []
+        for line in lines:
+            before, found, after = line.partition(marker)
+            if not found:
+                section_lines.append(line)
+                continue
+            # Output not ending in a newline shares its last line with the marker:
+            if before:
+                section_lines.append(before)
+            outputs[int(after)] = section_lines
+            section_lines = []
+        return outputs
 
     @staticmethod
     def parse_user_csv(user_csv: str) -> Set[str]:
@@ -77,29 +244,35 @@ class SSHInterrogator:
 
     def query_disk_free(self):
         try:
-            stdin, stdout, stderr = self.client.exec_command("df -h --output=avail /")
-            self.disk_avail = stdout.readlines()[-1].strip()
+            stdin, stdout, stderr = self.exec_command(DISK_FREE)
+            self.read_disk_free(stdout.readlines())
         except Exception as e:
             self.err_handler.append(e)
 
+    def read_disk_free(self, df_lines: List[str]):
+        self.disk_avail = df_lines[-1].strip()
+
     def query_boot_time(self):
         try:
-            stdin, stdout, stderr = self.client.exec_command("who -b")
-            # The result is numeric when run locally, but on some servers
-            # it will begin with the month as 3 letters, which by convention
-            try:
-                uptime_line = stdout.readlines()[0].strip()
-            except IndexError as ie:
-                self.query_boot_time_deb()
-            else:
-                up_since = uptime_line[len("system boot"):].strip()
-                if "0" <= up_since[0] <= "9":
-                    up_since = convert_date_to_human_readable(
-                        up_since, "%Y-%m-%d %H:%M")
-                self.last_boot = up_since
+            stdin, stdout, stderr = self.exec_command(BOOT_TIME)
+            self.read_boot_time(stdout.readlines())
         except Exception as e:
             self.err_handler.append(e)
 
+    def read_boot_time(self, who_lines: List[str]):
+        # The result is numeric when run locally, but on some servers
+        # it will begin with the month as 3 letters, which by convention
+        try:
+            uptime_line = who_lines[0].strip()
+        except IndexError as ie:
+            self.query_boot_time_deb()
+        else:
+            up_since = uptime_line[len("system boot"):].strip()
+            if "0" <= up_since[0] <= "9":
+                up_since = convert_date_to_human_readable(
+                    up_since, "%Y-%m-%d %H:%M")
+            self.last_boot = up_since
+
     def query_boot_time_deb(self):
         """
         `who -b` didn't work on my debian-slim docker container.
@@ -109,7 +282,7 @@ class SSHInterrogator:
         Reading my host's filesystem, and `docker inspect`, I suspect the true
         value is somewhere in between. `uptime` is harder to process.
         """
-        stdin, stdout, stderr = self.client.exec_command("last reboot")
+        stdin, stdout, stderr = self.exec_command("last reboot")
         uptime_line = stdout.readlines()[-1].strip()
         # eg: Sun Oct 30 06:10:57 2022 -> Oct 30 06:10:57 2022
         boot_tm_str = uptime_line[len("wtmp begins dow "):].strip()
@@ -122,63 +295,60 @@ class SSHInterrogator:
         :param known_ports: ports we accept being open.
         """
         try:
-            stdin, stdout, stderr = self.client.exec_command("ss -tuln")
-            ss_lines = stdout.readlines()
-            local_add_port = find_cells_under(ss_lines, "Local Address:Port")
-            # Checking the local address may provide more security.
-            ports = set([x.split(":")[-1].strip() for x in local_add_port])
-            unknown_ports = filter(lambda x: x not in known_ports, ports)
-            sorted_ports = map(str, sorted(map(int, unknown_ports)))
-            self.ports = "+".join(sorted_ports)
+            stdin, stdout, stderr = self.exec_command(PORTS)
+            self.read_ports(stdout.readlines(), known_ports)
         except Exception as e:
             self.err_handler.append(e)
 
+    def read_ports(self, ss_lines: List[str], known_ports: Set[str]):
+        local_add_port = find_cells_under(ss_lines, "Local Address:Port")
+        # Checking the local address may provide more security.
+        ports = set([x.split(":")[-1].strip() for x in local_add_port])
+        unknown_ports = filter(lambda x: x not in known_ports, ports)
+        sorted_ports = map(str, sorted(map(int, unknown_ports)))
+        self.ports = "+".join(sorted_ports)
+
     def query_ssh_peers(self, known_peers: Set[str]) -> None:
         """
         :param known_peers: known peer IP addresses we can safely ignore.
         """
         try:
-            stdin, stdout, stderr = self.client.exec_command("ss -tn sport = 22")
-            ss_lines = stdout.readlines()
-            peer_add_port = find_cells_under(ss_lines, "Peer Address:Port")
-            ssh_peers = set([x.split(":")[0].strip() for x in peer_add_port])
-            self.ssh_peers = "+".join([x for x in ssh_peers if x not in known_peers])
+            stdin, stdout, stderr = self.exec_command(SSH_PEERS)
+            self.read_ssh_peers(stdout.readlines(), known_peers)
         except Exception as e:
             self.err_handler.append(e)
 
+    def read_ssh_peers(self, ss_lines: List[str], known_peers: Set[str]):
+        peer_add_port = find_cells_under(ss_lines, "Peer Address:Port")
+        ssh_peers = set([x.split(":")[0].strip() for x in peer_add_port])
+        self.ssh_peers = "+".join([x for x in ssh_peers if x not in known_peers])
+
     def query_free(self):
         try:
-            stdin, stdout, stderr = self.client.exec_command("free -h")
-            free_lines = stdout.readlines()
-            self.mem_avail = [x for x in free_lines if x.startswith("Mem:")][0].split()[-1]
-            self.swap_free = [x for x in free_lines if x.startswith("Swap:")][0].split()[-1]
+            stdin, stdout, stderr = self.exec_command(FREE)
+            self.read_free(stdout.readlines())
         except Exception as e:
             self.err_handler.append(e)
 
+    def read_free(self, free_lines: List[str]):
+        self.mem_avail = [x for x in free_lines if x.startswith("Mem:")][0].split()[-1]
+        self.swap_free = [x for x in free_lines if x.startswith("Swap:")][0].split()[-1]
+
 
 def node_master_factory(err_handler):
     return MinerInterrogator(err_handler)
 
 
 class MinerInterrogator(SSHInterrogator):
-    def __init__(self, err_handler: ErrorHandler, gpu_cnt: int = 3):
-        super().__init__(err_handler)
+    def __init__(self, err_handler: ErrorHandler, gpu_cnt: int = 3,
+                 timeout: Optional[float] = None, pool: Optional[SSHPool] = None):
+        super().__init__(err_handler, timeout, pool)
         self.g_pwr: List[Optional[str]] = [None] * gpu_cnt  # in watts
         self.g_mem: List[Optional[str]] = [None] * gpu_cnt  # in MiB
         self.g_tmp: List[Optional[str]] = [None] * gpu_cnt  # in 'C
 
-    def do_queries(self, rmt_pc: Dict[str, Union[List[dict], str]]):
-        # With paramiko/SSH, expect the unexpected, then recover and report
-        # the error.
-        try:
-            con_err_str = self.initialise_connection(rmt_pc["ip"], rmt_pc["creds"])
-            if con_err_str:
-                self.err_handler.append(con_err_str)
-            else:
-                self.query_gpus()
-                self.remote_tentative_calls(rmt_pc)
-        except Exception as e:
-            self.err_handler.append(e)
+    def sections(self, rmt_pc: Dict[str, Union[List[dict], str]]) -> List[Section]:
+        return [(NVIDIA_SMI, self.read_gpus)] + super().sections(rmt_pc)
 
     @staticmethod
     def read_gpu(gpu_line: str) -> Optional[int]:
@@ -206,19 +376,21 @@ class MinerInterrogator(SSHInterrogator):
 
     def query_gpus(self):
         try:
-            stdin, stdout, stderr = self.client.exec_command("nvidia-smi")
-            stdout_lines = stdout.readlines()
-            i = 0
-            while i < len(stdout_lines):
-                if (re.match(r"\+-+\+-+\+-+\+\n", stdout_lines[i]) or re.match(r"\|=+\+=+\+=+\|\n", stdout_lines[i])) \
-                        and i + 2 < len(stdout_lines):
-                    gpu = self.read_gpu(stdout_lines[i + 1])
-                    if gpu is not None:
-                        temp, watts, mem_use = self.read_details(stdout_lines[i + 2])
-                        self.g_pwr[gpu] = watts
-                        self.g_mem[gpu] = mem_use
-                        self.g_tmp[gpu] = temp
-                        i += 2
-                i += 1
+            stdin, stdout, stderr = self.exec_command(NVIDIA_SMI)
+            self.read_gpus(stdout.readlines())
         except Exception as e:
             self.err_handler.append(e)
+
+    def read_gpus(self, stdout_lines: List[str]):
+        i = 0
+        while i < len(stdout_lines):
+            if (re.match(r"\+-+\+-+\+-+\+\n", stdout_lines[i]) or re.match(r"\|=+\+=+\+=+\|\n", stdout_lines[i])) \
+                    and i + 2 < len(stdout_lines):
+                gpu = self.read_gpu(stdout_lines[i + 1])
+                if gpu is not None:
+                    temp, watts, mem_use = self.read_details(stdout_lines[i + 2])
+                    self.g_pwr[gpu] = watts
+                    self.g_mem[gpu] = mem_use
+                    self.g_tmp[gpu] = temp
+                    i += 2
+            i += 1
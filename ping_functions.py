@@ -1,23 +1,452 @@
+"""
+Pinging, natively where the kernel lets us open ICMP sockets, otherwise by
+running the system's ping and reading its output.
+
+Unprivileged ICMP datagram sockets need the process's group to be within
+net.ipv4.ping_group_range. Failing that, raw sockets need root, or
+CAP_NET_RAW. Both spare us forking a process per host, and scraping its
+localised text, for every ping.
+"""
 from __future__ import annotations
 
+import itertools
+import math
 import platform
+import random
 import re
+import select
+import socket
+import statistics
+import struct
 import subprocess
-from typing import List
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
 
+ICMP_ECHO_REPLY = 0
+ICMP_ECHO_REQUEST = 8
+PAYLOAD = b"server_monitor".ljust(56, b".")
+DEFAULT_COUNT = 4
+DEFAULT_INTERVAL_S = 1.0
+DEFAULT_TIMEOUT_S = 2.0
+# Reachability checks give up sooner, and retry sooner, than full bursts:
+REACH_ATTEMPTS = 3
+REACH_INTERVAL_S = 0.25
+REACH_TIMEOUT_S = 1.0
+# Round trip times, in ms, of the echoes each host answered:
+LatenciesByIp = Dict[str, List[float]]
+# Identifies the echoes of each raw socket among all those it receives. The
+# kernel assigns datagram sockets their own.
+_echo_ids = itertools.count(random.randrange(0x10000))
+ICMP = "icmp"
+# Linux's, which the socket module doesn't name, and the struct timespec it
+# stamps each packet received with:
+SO_TIMESTAMPNS = 35
+TIMESPEC = struct.Struct("@ll")
 
-def ping(host: str) -> subprocess.CompletedProcess:
-    pkt_cnt_flag = "-n" if platform.system().lower() == "windows" else "-c"
-    command = ['ping', pkt_cnt_flag, '4', host]
 
-    return subprocess.run(command, capture_output=True)
+class Latencies(list):
+    """
+    Round trip times, in ms, of the echoes a host answered, which also
+    remembers how many were sent, so that the rest can be counted as lost,
+    and by what method, eg ICMP.
+    """
 
+    def __init__(self, rtts_ms: Iterable[float] = (), sent: Optional[int] = None,
+                 method: Optional[str] = ICMP):
+        super().__init__(rtts_ms)
+        self.sent = len(self) if sent is None else sent
+        self.method = method
 
-def get_ping_latencies(err_handler, ipv4: str) -> List[str]:
-    err_handler.current_ip = ipv4
-    result = ping(ipv4)
+
+def percentile(ordered: List[float], pct: float) -> float:
+    """Interpolates between the closest ranks of the sorted values."""
+    rank = (len(ordered) - 1) * pct / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+
+@dataclass(frozen=True)
+class PingStats:
+    """
+    A burst's packet loss, and the spread of its round trip times, much as
+    the system's ping summarises them. mdev is their standard deviation, as
+    ping's is. All but the loss, and method, are None when nothing answered.
+    """
+    loss_pct: float
+    min_ms: Optional[float] = None
+    p50_ms: Optional[float] = None
+    p95_ms: Optional[float] = None
+    max_ms: Optional[float] = None
+    mdev_ms: Optional[float] = None
+    method: Optional[str] = None
+
+    @classmethod
+    def of(cls, latencies: List[float]) -> PingStats:
+        """
+        :param latencies: ideally Latencies, otherwise none are taken to
+            have been lost, unless none answered, and their method is unknown.
+        """
+        method = getattr(latencies, "method", None)
+        if len(latencies) == 0:
+            return cls(100.0, method=method)
+        sent = max(len(latencies), getattr(latencies, "sent", 0))
+        ordered = sorted(map(float, latencies))
+        return cls(100.0 * (sent - len(ordered)) / sent, ordered[0],
+                   percentile(ordered, 50), percentile(ordered, 95),
+                   ordered[-1], statistics.pstdev(ordered), method)
+
+    def loss_cell(self) -> str:
+        return "{:g}".format(round(self.loss_pct, 1))
+
+    def spread_cell(self) -> Optional[str]:
+        """:return: "min_p50_p95_max_mdev", in ms, or None."""
+        if self.min_ms is None:
+            return None
+        return "_".join("{:.2f}".format(ms) for ms in (
+            self.min_ms, self.p50_ms, self.p95_ms, self.max_ms, self.mdev_ms))
+
+
+def ping_command(host: str, count: int = DEFAULT_COUNT,
+                 wait_s: Optional[int] = None,
+                 interval_s: float = DEFAULT_INTERVAL_S) -> List[str]:
+    """
+    :param wait_s: if given, how long to wait for each reply.
+    :param interval_s: between echoes. Windows' ping has no say in this.
+    """
+    windows = platform.system().lower() == "windows"
+    pkt_cnt_flag = "-n" if windows else "-c"
+    command = ['ping', pkt_cnt_flag, str(count)]
+    if wait_s is not None:
+        command += ['-w', str(wait_s * 1000)] if windows else ['-W', str(wait_s)]
+    if interval_s != DEFAULT_INTERVAL_S and not windows:
+        command += ['-i', "{:g}".format(interval_s)]
+    return command + [host]
+
+
+def ping(host: str, count: int = DEFAULT_COUNT,
+         wait_s: Optional[int] = None,
+         interval_s: float = DEFAULT_INTERVAL_S) -> subprocess.CompletedProcess:
+    return subprocess.run(ping_command(host, count, wait_s, interval_s),
+                          capture_output=True)
+
+
+def checksum(data: bytes) -> int:
+    """The internet checksum of RFC 1071."""
+    if len(data) % 2:
+        data += b"\0"
+    total = sum(struct.unpack("!{}H".format(len(data) // 2), data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+
+def echo_request(ident: int, seq: int) -> bytes:
+    header = struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, 0, ident, seq)
+    return struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0,
+                       checksum(header + PAYLOAD), ident, seq) + PAYLOAD
+
+
+def open_icmp_socket() -> Optional[Tuple[socket.socket, bool]]:
+    """
+    :return: a non-blocking ICMP socket and whether it is raw, or None if we
+        may open neither kind.
+    """
+    for sock_type in (socket.SOCK_DGRAM, socket.SOCK_RAW):
+        try:
+            sock = socket.socket(socket.AF_INET, sock_type, socket.IPPROTO_ICMP)
+        except OSError:
+            continue
+        sock.setblocking(False)
+        if platform.system() == "Linux":
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
+            except OSError:
+                pass
+        return sock, sock_type == socket.SOCK_RAW
+    return None
+
+
+def kernel_timestamp_ns(ancdata: List[Tuple[int, int, bytes]]) -> Optional[int]:
+    """:return: when the kernel received the packet, if it says."""
+    for level, kind, data in ancdata:
+        if level == socket.SOL_SOCKET and kind == SO_TIMESTAMPNS and \
+                len(data) >= TIMESPEC.size:
+            sec, nsec = TIMESPEC.unpack_from(data)
+            return sec * 10**9 + nsec
+    return None
+
+
+def format_ms(ms: float) -> str:
+    """To the microsecond, without trailing zeros, eg "0.183" or "16"."""
+    return "{:.3f}".format(ms).rstrip("0").rstrip(".")
+
+
+class EchoSession:
+    """
+    The echoes sent to a batch of hosts, over one socket, and which were
+    answered within the timeout.
+
+    Each round sends one echo to every host, numbered by the round, so that
+    a whole inventory is pinged in about one timeout, rather than one per
+    host. Replies are matched to their echo by source and sequence number.
+    A raw socket receives every ICMP packet reaching the host, behind its IP
+    header, so its replies are told apart by their identifier too. Linux
+    demultiplexes a datagram socket's replies itself, rewriting their
+    identifier to suit. Elsewhere, as on macOS and the BSDs, a datagram
+    socket's replies keep both the identifier we sent and their IP header,
+    so are handled as a raw socket's.
+
+    Where the kernel stamps the time each reply arrived, round trips are
+    timed from that, rather than from when we got round to reading the
+    reply, sparing them the scheduling delays of a busy host. Those stamps
+    are by the wall clock, so each echo's send is timed by it too, as well
+    as by the monotonic clock, which still governs timeouts and pacing.
+
+    :param until_first: stop sending to each host once it has answered, and
+        finish as soon as all have, which is enough to tell they're up.
+    """
+
+    def __init__(self, addresses: List[str], raw: bool, count: int,
+                 interval_s: float, timeout_s: float, until_first: bool = False):
+        self.addresses = list(dict.fromkeys(addresses))
+        self.raw = raw
+        self.match_ident = raw or platform.system() != "Linux"
+        self.ident = next(_echo_ids) & 0xFFFF
+        self.interval_s = interval_s
+        self.timeout_s = timeout_s
+        self.until_first = until_first
+        # In the order they are to be sent:
+        self.echoes = [(seq, address) for seq in range(count)
+                       for address in self.addresses]
+        self.next_echo = 0
+        self.sent: Dict[Tuple[str, int], float] = {}
+        self.sent_ns: Dict[Tuple[str, int], int] = {}
+        self.rtts_ms: Dict[Tuple[str, int], float] = {}
+        self.answered = set()
+        self.started = time.perf_counter()
+        self.blocked = False
+
+    def send_due(self, sock: socket.socket):
+        """Sends every echo whose round has begun, as the socket allows."""
+        now = time.perf_counter()
+        self.blocked = False
+        while self.next_echo < len(self.echoes):
+            seq, address = self.echoes[self.next_echo]
+            if self.until_first and address in self.answered:
+                self.next_echo += 1
+                continue
+            if now < self.started + seq * self.interval_s:
+                return
+            request = echo_request(self.ident, seq)
+            sent = time.perf_counter()
+            sent_ns = time.time_ns()
+            try:
+                sock.sendto(request, (address, 0))
+            except BlockingIOError:
+                # The send buffer is full. Let some replies in first.
+                self.blocked = True
+                return
+            except OSError:
+                # Eg no route to the host. That echo is simply lost.
+                pass
+            self.sent[(address, seq)] = sent
+            self.sent_ns[(address, seq)] = sent_ns
+            self.next_echo += 1
+
+    def receive(self, sock: socket.socket):
+        received = time.perf_counter()
+        try:
+            if hasattr(sock, "recvmsg"):
+                packet, ancdata, _, (source, _) = sock.recvmsg(
+                    2048, socket.CMSG_SPACE(TIMESPEC.size))
+            else:
+                # Windows
+                (packet, (source, _)), ancdata = sock.recvfrom(2048), []
+        except (BlockingIOError, InterruptedError):
+            return
+        # An ICMP type never has an IPv4 header's version in its top nibble:
+        if packet and packet[0] >> 4 == 4:
+            packet = packet[(packet[0] & 0x0F) * 4:]
+        if len(packet) < 8:
+            return
+        icmp_type, _, _, ident, seq = struct.unpack("!BBHHH", packet[:8])
+        if icmp_type != ICMP_ECHO_REPLY or (self.match_ident and ident != self.ident):
+            return
+        echo = (source, seq)
+        if echo in self.sent and echo not in self.rtts_ms and \
+                received - self.sent[echo] <= self.timeout_s:
+            rtt_ns = 10**9 * (received - self.sent[echo])
+            received_ns = kernel_timestamp_ns(ancdata)
+            # Unless the wall clock was stepped meanwhile, the kernel's stamp
+            # puts the reply sooner than we read it:
+            if received_ns is not None and \
+                    0 < received_ns - self.sent_ns[echo] <= rtt_ns:
+                rtt_ns = received_ns - self.sent_ns[echo]
+            self.rtts_ms[echo] = rtt_ns / 10**6
+            self.answered.add(source)
+
+    def wake_in(self) -> Optional[float]:
+        """:return: seconds until there is more to do, or None if done."""
+        now = time.perf_counter()
+        if self.until_first and len(self.answered) == len(self.addresses):
+            return None
+        if self.next_echo < len(self.echoes):
+            if self.blocked:
+                return 0.001
+            seq = self.echoes[self.next_echo][0]
+            return max(0.0, self.started + seq * self.interval_s - now)
+        if len(self.rtts_ms) == len(self.echoes):
+            return None
+        remaining = max(self.sent.values()) + self.timeout_s - now
+        return remaining if remaining > 0 else None
+
+    def latencies(self) -> Dict[str, Latencies]:
+        """
+        :return: round trip times, in ms, of the echoes each address
+            answered, in order.
+        """
+        latencies = {address: Latencies(sent=0) for address in self.addresses}
+        for address, _ in self.sent:
+            latencies[address].sent += 1
+        for address, seq in sorted(self.rtts_ms, key=lambda echo: echo[1]):
+            latencies[address].append(self.rtts_ms[(address, seq)])
+        return latencies
+
+
+def resolve(host: str) -> Optional[str]:
+    try:
+        return socket.gethostbyname(host)
+    except socket.gaierror:
+        return None
+
+
+def native_ping_many(hosts: List[str], count: int = DEFAULT_COUNT,
+                     interval_s: float = DEFAULT_INTERVAL_S,
+                     timeout_s: float = DEFAULT_TIMEOUT_S,
+                     until_first: bool = False) -> Optional[LatenciesByIp]:
+    """
+    Pings every host at once, fping style, over a single socket.
+
+    :param until_first: as for EchoSession.
+
+    :return: the round trip times, in ms, of those echoes answered within
+        timeout_s, under each host, or None if we may not open ICMP sockets.
+    """
+    opened = open_icmp_socket()
+    if opened is None:
+        return None
+    sock, raw = opened
+    addresses = {host: resolve(host) for host in hosts}
+    with sock:
+        session = EchoSession([address for address in addresses.values()
+                               if address is not None],
+                              raw, count, interval_s, timeout_s, until_first)
+        session.send_due(sock)
+        wake_in = session.wake_in()
+        while wake_in is not None:
+            readable, _, _ = select.select([sock], [], [], wake_in)
+            if readable:
+                session.receive(sock)
+            session.send_due(sock)
+            wake_in = session.wake_in()
+    latencies = session.latencies()
+    return {host: latencies.get(address, Latencies(sent=count))
+            for host, address in addresses.items()}
+
+
+def native_ping(host: str, count: int = DEFAULT_COUNT,
+                interval_s: float = DEFAULT_INTERVAL_S,
+                timeout_s: float = DEFAULT_TIMEOUT_S) -> Optional[List[float]]:
+    """
+    :return: the round trip times, in ms, of those echoes answered within
+        timeout_s, or None if we may not open ICMP sockets.
+    """
+    latencies = native_ping_many([host], count, interval_s, timeout_s)
+    return None if latencies is None else latencies[host]
+
+
+def parse_ping_latencies(result: subprocess.CompletedProcess,
+                         count: int = DEFAULT_COUNT) -> Latencies:
+    """:param count: echoes the ping was asked to send."""
     if result.returncode == 0:
         # An unreachable host can still return 0.
         output = result.stdout.decode()
-        return re.findall(r"time=([\d. ]+)ms", output)
-    return []
+        return Latencies(map(float, re.findall(r"time=([\d. ]+)ms", output)), count)
+    return Latencies(sent=count)
+
+
+def fallback_wait_s(timeout_s: Optional[float]) -> Optional[int]:
+    """The system's ping only waits whole seconds."""
+    return None if timeout_s is None else max(1, math.ceil(timeout_s))
+
+
+def ping_many(hosts: List[str], count: int = DEFAULT_COUNT,
+              interval_s: float = DEFAULT_INTERVAL_S,
+              timeout_s: Optional[float] = None,
+              workers: int = 16) -> LatenciesByIp:
+    """
+    As ping_latencies, for many hosts at once.
+
+    :param workers: how many of the system's pings may run at once, should
+        we be unable to ping natively.
+    :return: round trip times, in ms, of the echoes answered, under each host.
+    """
+    latencies = native_ping_many(hosts, count, interval_s,
+                                 DEFAULT_TIMEOUT_S if timeout_s is None else timeout_s)
+    if latencies is None:
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(hosts)))) as executor:
+            latencies = dict(zip(hosts, executor.map(
+                lambda host: parse_ping_latencies(ping(
+                    host, count, fallback_wait_s(timeout_s), interval_s),
+                    count), hosts)))
+    return latencies
+
+
+def reach_many(hosts: List[str], attempts: int = REACH_ATTEMPTS,
+               interval_s: float = REACH_INTERVAL_S,
+               timeout_s: float = REACH_TIMEOUT_S,
+               workers: int = 16) -> LatenciesByIp:
+    """
+    Tells which hosts are up, as cheaply as we can. Each is sent up to
+    `attempts` echoes, but no more once one is answered, and we return as
+    soon as every host has answered, so that a healthy inventory costs about
+    one round trip.
+
+    :return: under each host, the round trip time of its first answered
+        echo, if any.
+    """
+    latencies = native_ping_many(hosts, attempts, interval_s, timeout_s,
+                                 until_first=True)
+    if latencies is None:
+        latencies = ping_many(hosts, 1, timeout_s=timeout_s, workers=workers)
+    return latencies
+
+
+def ping_latencies(host: str, count: int = DEFAULT_COUNT,
+                   interval_s: float = DEFAULT_INTERVAL_S,
+                   timeout_s: Optional[float] = None) -> List[float]:
+    """
+    :param timeout_s: how long to wait for each reply. The system's ping
+        decides, by default, if we can't ping natively.
+    :return: round trip times, in ms, of the echoes answered.
+    """
+    latencies = native_ping(host, count, interval_s,
+                            DEFAULT_TIMEOUT_S if timeout_s is None else timeout_s)
+    if latencies is None:
+        latencies = parse_ping_latencies(ping(
+            host, count, fallback_wait_s(timeout_s), interval_s), count)
+    return latencies
+
+
+def is_reachable(host: str, wait_s: int = 1) -> bool:
+    """The cheapest check we have, a single ping, not waited on for long."""
+    return len(ping_latencies(host, 1, timeout_s=wait_s)) > 0
+
+
+def get_ping_latencies(err_handler, ipv4: str) -> List[float]:
+    err_handler.current_ip = ipv4
+    return ping_latencies(ipv4)
+
@@ -13,18 +13,92 @@ from __future__ import annotations
 
 import sys
 
+import argparse
+import dataclasses
+import functools
 import json
-from typing import List, Callable
+import multiprocessing
+import random
+import threading
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from itertools import repeat
+from typing import Callable, List, Optional, Tuple
 
 import indie_gen_funcs
+from adaptive_schedule import AdaptiveScheduler
+from async_sweep import AsyncSweeper, StageLimits
+from circuit_breaker import CircuitBreaker
 from check_result import CheckResult
 from indie_gen_funcs import ErrorHandler, ResultHolder, parse_args_for_monitoring, email_wout_further_checks, \
-    compose_email, send_email, monitor_runners_ipv4, DAY_TIME_FMT
-from interrog_routines import interrog_routine
-from ping_functions import get_ping_latencies
+    compose_email, send_email, monitor_runners_ipv4, load_results_by_ip, DAY_TIME_FMT, DATE_MON_FMT
+from interrog_routines import interrog_routine, IInterrogator, summarise_latencies
+from nodes_watch import NodesDiff, NodesFileWatcher, diff_nodes
+from ping_functions import get_ping_latencies, ping_many, reach_many, LatenciesByIp, \
+    PingStats, DEFAULT_COUNT, DEFAULT_INTERVAL_S, REACH_TIMEOUT_S
+from tcp_probe import tcp_ping_many, parse_ports, DEFAULT_PORTS
+import ssh_pool
+from sweep_priority import prioritise
+from time_budget import TimeBudget
 
-IInterrogator = Callable[
-    [ErrorHandler, dict, ResultHolder, str, List[str]], None]
+
+@dataclass(frozen=True)
+class SweepOptions:
+    """
+    How to divide the work of a sweep.
+
+    :param workers: how many nodes to probe at once (per shard). Results are
+        kept in inventory order regardless.
+    :param stage_limits: if given, sweep with the asyncio engine instead,
+        limiting the concurrency of each stage separately.
+    :param shards: how many processes to divide the inventory between.
+    :param node_budget: seconds each node may take.
+    :param sweep_deadline: seconds the whole sweep may take.
+    :param adaptive: only sweep nodes due a probe, per AdaptiveScheduler.
+    :param trip_after: if given, how many sweeps running a node may fail
+        before its CircuitBreaker opens.
+    :param priority_wave: if given, sweep the nodes most in need of attention
+        first, alerting to any errors among this many of them before sweeping
+        the rest.
+    :param ping_count: echoes to send each node.
+    :param ping_interval: seconds between each node's echoes.
+    :param reach_first: decide which nodes to probe by reach_many, sampling
+        the latency of those found up alongside their probes.
+    :param sample_every: sweeps, in --daemon mode, between those sampling
+        latency, when reach_first.
+    :param tcp_probe: if given, time TCP handshakes instead of pings, as the
+        "primary" method, or as the "fallback" for nodes not answering pings.
+    :param tcp_ports: those to race handshakes with, unless a node gives its
+        own "tcp_ports".
+    """
+    workers: int = 1
+    stage_limits: Optional[StageLimits] = None
+    shards: int = 1
+    node_budget: Optional[float] = None
+    sweep_deadline: Optional[float] = None
+    adaptive: bool = False
+    trip_after: Optional[int] = None
+    priority_wave: Optional[int] = None
+    ping_count: int = DEFAULT_COUNT
+    ping_interval: float = DEFAULT_INTERVAL_S
+    reach_first: bool = False
+    sample_every: int = 1
+    tcp_probe: Optional[str] = None
+    tcp_ports: Tuple[int, ...] = DEFAULT_PORTS
+
+    @classmethod
+    def from_args(cls, args: argparse.Namespace) -> SweepOptions:
+        stage_limits = None
+        if args.stage_limits:
+            stage_limits = StageLimits.from_csv(args.stage_limits)
+        return cls(args.workers, stage_limits, args.shards, args.node_budget,
+                   args.sweep_deadline, args.adaptive, args.trip_after,
+                   args.priority_wave, args.ping_count, args.ping_interval,
+                   args.reach_first, args.sample_every, args.tcp_probe,
+                   parse_ports(args.tcp_ports))
 
 
 def process_args(
@@ -42,9 +116,31 @@ def process_args(
         email_wout_further_checks(
             args.email_to, args.email_addy, args.password, check_result)
         return
+    if args.daemon:
+        MonitorDaemon(args, check_result).run()
+        return
     result_holder = ResultHolder()
     err_handler = iterate_rmt_servers(args.nodes_file, check_result,
-                        interrog_routine, result_holder)
+                        interrog_routine, result_holder,
+                        SweepOptions.from_args(args),
+                        functools.partial(alert_early, args, check_result))
+    report_sweep(args, check_result, result_holder, err_handler)
+
+
+def alert_early(args: argparse.Namespace, check_result: CheckResult,
+                wave_errors: ErrorHandler):
+    """
+    Emails the errors of a sweep's priority wave, as soon as it is done. They
+    are emailed again, with the rest, once the sweep is.
+    """
+    wave_errors.email_traces(args.email_addy, args.password,
+                             "priority " + check_result.get_unit_name())
+
+
+def report_sweep(
+        args: argparse.Namespace, check_result: CheckResult,
+        result_holder: ResultHolder, err_handler: ErrorHandler):
+    """Emails any errors, saves the results, and emails those if asked."""
     if err_handler.errors:
         err_handler.email_traces(args.email_addy, args.password,
                                  check_result.get_unit_name())
@@ -58,8 +154,9 @@ def process_args(
 
 def iterate_rmt_servers(
         nodes_file_name: str, check_result: CheckResult,
-        interrog_routine: IInterrogator, result_holder: ResultHolder)\
-        -> ErrorHandler:
+        interrog_routine: IInterrogator, result_holder: ResultHolder,
+        options: SweepOptions = SweepOptions(),
+        alert: Optional[Callable[[ErrorHandler], None]] = None) -> ErrorHandler:
     """
     Opens the server list file and iterates through connecting to and querying
     all servers.
@@ -72,26 +169,476 @@ def iterate_rmt_servers(
         on a pingable machine.
     :param result_holder: acts like err_handler by collecting a quantity before
         performing an operation like emailing them.
+    :param options: how to divide the work of the sweep.
+    :param alert: called with the errors of any priority wave, if there
+        were any, before the rest of the sweep.
     :return:
     """
+    config = load_nodes(nodes_file_name)
+    err_handler = ErrorHandler()
+    monitor_runners_ipv4()
+    scheduler = None
+    if options.adaptive:
+        scheduler = AdaptiveScheduler.load(check_result)
+    breaker = None
+    if options.trip_after is not None:
+        breaker = CircuitBreaker.load(options.trip_after)
+    sweep_inventory(config["servers"], check_result, interrog_routine,
+                    result_holder, err_handler, options, scheduler, breaker,
+                    alert)
+    return err_handler
+
+
+def load_nodes(nodes_file_name: str) -> dict:
     # Open nodes files from outside source control (don't commit credentials):
     with open(nodes_file_name, encoding="utf8") as f:
         config = json.load(f)
     indie_gen_funcs._MONITOR_EMAIL = config.get("email_dest", indie_gen_funcs._MONITOR_EMAIL)
-    err_handler = ErrorHandler()
-    monitor_runners_ipv4()
+    return config
 
-    for rmt_pc in config["servers"]:
-        ipv4 = rmt_pc["ip"]
-        latencies = get_ping_latencies(err_handler, ipv4)
-        if len(latencies) == 0:
-            result_holder.append(
-                check_result.from_fields(
-                    [result_holder.time.strftime(DAY_TIME_FMT), ipv4]))
+
+def sweep_inventory(
+        servers: List[dict], check_result: CheckResult,
+        interrog_routine: IInterrogator, result_holder: ResultHolder,
+        err_handler: ErrorHandler, options: SweepOptions,
+        scheduler: Optional[AdaptiveScheduler] = None,
+        breaker: Optional[CircuitBreaker] = None,
+        alert: Optional[Callable[[ErrorHandler], None]] = None,
+        sample: bool = True):
+    """
+    Sweeps the servers using whichever engine the options call for.
+
+    :param scheduler: if given, only the servers it has due are swept, then
+        rescheduled according to their results.
+    :param breaker: if given, servers with open circuits are skipped, their
+        rows following those of the servers swept.
+    :param alert: called with the errors of the priority wave, if any.
+    :param sample: whether, when options.reach_first gates the sweep, to
+        sample the latency of the nodes found up too.
+    """
+    if scheduler is not None:
+        servers = scheduler.due(servers)
+    skipped = []
+    if breaker is not None:
+        if options.tcp_probe is None:
+            servers, skipped = breaker.triage(servers, options.workers)
         else:
-            interrog_routine(
-                err_handler, rmt_pc, result_holder, ipv4, latencies)
-    return err_handler
+            servers, skipped = breaker.triage(
+                servers, options.workers,
+                reachable=functools.partial(is_node_reachable, options))
+    budget = TimeBudget.starting_now(options.node_budget, options.sweep_deadline)
+    if options.reach_first:
+        pings = ping_inventory(servers, options, reach=True)
+        reached = [rmt_pc for rmt_pc in servers if len(pings[rmt_pc["ip"]]) > 0]
+        # Only the nodes found up are sampled, while they're being probed:
+        with ThreadPoolExecutor(max_workers=1) as sampler:
+            sampling = None
+            if sample and reached:
+                sampling = sampler.submit(ping_inventory, reached, options)
+            sweep_waves(servers, check_result, interrog_routine, result_holder,
+                        err_handler, options, budget, pings, alert)
+            samples = None if sampling is None else sampling.result()
+        record_samples(result_holder, [rmt_pc["ip"] for rmt_pc in reached], samples)
+    else:
+        pings = ping_inventory(servers, options)
+        sweep_waves(servers, check_result, interrog_routine, result_holder,
+                    err_handler, options, budget, pings, alert)
+    if scheduler is not None:
+        scheduler.record(servers, result_holder.results, err_handler)
+        scheduler.save()
+    if breaker is not None:
+        breaker.record(servers, result_holder.results, err_handler)
+        breaker.save()
+        for rmt_pc in skipped:
+            result_holder.append(check_result(
+                result_holder.time.strftime(DAY_TIME_FMT), rmt_pc["ip"],
+                status=CircuitBreaker.SKIPPED))
+
+
+def ping_inventory(servers: List[dict], options: SweepOptions,
+                   reach: bool = False) -> LatenciesByIp:
+    """
+    Pings every server at once, which takes about as long as pinging one.
+    Per options.tcp_probe, TCP handshakes are timed instead, either for all
+    servers or for those which didn't answer the pings.
+
+    :param reach: only find which servers are up, as reach_many does.
+    """
+    pings = {}
+    if options.tcp_probe != "primary":
+        ips = [rmt_pc["ip"] for rmt_pc in servers]
+        if reach:
+            pings = reach_many(ips)
+        else:
+            pings = ping_many(ips, options.ping_count, options.ping_interval)
+    targets = {}
+    if options.tcp_probe is not None:
+        targets = {rmt_pc["ip"]: rmt_pc.get("tcp_ports", options.tcp_ports)
+                   for rmt_pc in servers if len(pings.get(rmt_pc["ip"], [])) == 0}
+    if targets and reach:
+        # The kernel retransmits an unanswered SYN itself, so once will do:
+        pings.update(tcp_ping_many(targets, 1, timeout_s=REACH_TIMEOUT_S))
+    elif targets:
+        pings.update(tcp_ping_many(targets, options.ping_count,
+                                   options.ping_interval))
+    return pings
+
+
+def is_node_reachable(options: SweepOptions, rmt_pc: dict) -> bool:
+    return len(ping_inventory([rmt_pc], options, reach=True)[rmt_pc["ip"]]) > 0
+
+
+def sweep_waves(
+        servers: List[dict], check_result: CheckResult,
+        interrog_routine: IInterrogator, result_holder: ResultHolder,
+        err_handler: ErrorHandler, options: SweepOptions,
+        budget: Optional[TimeBudget], pings: LatenciesByIp,
+        alert: Optional[Callable[[ErrorHandler], None]] = None):
+    """Sweeps any priority wave, alerting to its errors, then the rest."""
+    remaining = servers
+    if options.priority_wave is not None:
+        yymm = result_holder.time.strftime(DATE_MON_FMT)
+        remaining = prioritise(servers, yymm, load_results_by_ip(yymm, check_result))
+        wave, remaining = remaining[:options.priority_wave], remaining[options.priority_wave:]
+        wave_errors = ErrorHandler()
+        sweep_with_engine(wave, check_result, interrog_routine,
+                          result_holder, wave_errors, options, budget, pings)
+        err_handler.merge(wave_errors)
+        if wave_errors.errors and alert is not None:
+            try:
+                alert(wave_errors)
+            except Exception as e:
+                # Reported with the rest, rather than losing the sweep:
+                err_handler.append(e)
+    sweep_with_engine(remaining, check_result, interrog_routine,
+                      result_holder, err_handler, options, budget, pings)
+
+
+def record_samples(result_holder: ResultHolder, reached: List[str],
+                   samples: Optional[LatenciesByIp]):
+    """
+    The rows of nodes gated by reach_many hold the one reply each answered.
+    That is replaced by the burst sampled alongside the node's probe, or, on
+    sweeps not sampling, cleared of the loss and spread one reply can't tell.
+    """
+    reached = set(reached)
+    for i, result in enumerate(result_holder.results):
+        if result.ipv4 not in reached or result.ave_ping_rtt_ms is None:
+            continue
+        if samples is None:
+            result_holder.results[i] = dataclasses.replace(
+                result, ping_loss_pct=None, ping_spread_ms=None)
+            continue
+        latencies = samples[result.ipv4]
+        if len(latencies) > 0:
+            ave_latency_ms, max_latency_ms = summarise_latencies(latencies)
+            result = dataclasses.replace(
+                result, ave_ping_rtt_ms=ave_latency_ms, ping_max_ms=max_latency_ms)
+        ping_stats = PingStats.of(latencies)
+        result_holder.results[i] = dataclasses.replace(
+            result, ping_loss_pct=ping_stats.loss_cell(),
+            ping_spread_ms=ping_stats.spread_cell(), ping_method=ping_stats.method)
+
+
+def sweep_with_engine(
+        servers: List[dict], check_result: CheckResult,
+        interrog_routine: IInterrogator, result_holder: ResultHolder,
+        err_handler: ErrorHandler, options: SweepOptions,
+        budget: Optional[TimeBudget] = None,
+        pings: Optional[LatenciesByIp] = None):
+    """
+    :param pings: latencies already gathered for the servers. Each is pinged
+        as it is probed if not.
+    """
+    if not servers:
+        return
+    if options.stage_limits is not None:
+        AsyncSweeper(check_result, interrog_routine, options.stage_limits,
+                     pings, budget).sweep(servers, result_holder, err_handler)
+    elif options.shards > 1:
+        sweep_shards(servers, check_result, interrog_routine,
+                     result_holder, err_handler, options, budget, pings)
+    else:
+        sweep_servers(servers, check_result, interrog_routine,
+                      result_holder, err_handler, options.workers, budget,
+                      pings)
+
+
+def sweep_servers(
+        servers: List[dict], check_result: CheckResult,
+        interrog_routine: IInterrogator, result_holder: ResultHolder,
+        err_handler: ErrorHandler, workers: int,
+        budget: Optional[TimeBudget] = None,
+        pings: Optional[LatenciesByIp] = None):
+    if workers > 1:
+        sweep_concurrently(servers, check_result, interrog_routine,
+                           result_holder, err_handler, workers, budget, pings)
+    else:
+        for rmt_pc in servers:
+            probe_node_within(budget, err_handler, rmt_pc, check_result,
+                              interrog_routine, result_holder, pings)
+
+
+def probe_node(
+        err_handler: ErrorHandler, rmt_pc: dict, check_result: CheckResult,
+        interrog_routine: IInterrogator, result_holder: ResultHolder,
+        pings: Optional[LatenciesByIp] = None):
+    """
+    Pings a node, unless given its pings, and, if it answered, hands it over
+    for interrogation. An unpingable node still gets a (mostly empty) row.
+    """
+    ipv4 = rmt_pc["ip"]
+    if pings is None:
+        latencies = get_ping_latencies(err_handler, ipv4)
+    else:
+        err_handler.current_ip = ipv4
+        latencies = pings[ipv4]
+    if len(latencies) == 0:
+        ping_stats = PingStats.of(latencies)
+        result_holder.append(check_result(
+            result_holder.time.strftime(DAY_TIME_FMT), ipv4,
+            ping_loss_pct=ping_stats.loss_cell(), ping_method=ping_stats.method))
+    else:
+        interrog_routine(
+            err_handler, rmt_pc, result_holder, ipv4, latencies)
+
+
+def probe_node_within(
+        budget: Optional[TimeBudget], err_handler: ErrorHandler, rmt_pc: dict,
+        check_result: CheckResult, interrog_routine: IInterrogator,
+        result_holder: ResultHolder, pings: Optional[LatenciesByIp] = None):
+    """
+    As probe_node, but giving up on the node once its budget is spent, then
+    recording whatever it had gathered by then. The probe is left to its own
+    daemon thread, where the SSH timeouts we pass on should soon end it.
+    """
+    if budget is None:
+        probe_node(err_handler, rmt_pc, check_result, interrog_routine,
+                   result_holder, pings)
+        return
+    ipv4 = rmt_pc["ip"]
+    started = time.monotonic()
+    allowance = budget.node_deadline(started) - started
+    node_errors = ErrorHandler()
+    node_results = ResultHolder(result_holder.time)
+    raised = []
+
+    def probe():
+        try:
+            probe_node(node_errors, {"ssh_timeout": allowance, **rmt_pc},
+                       check_result, interrog_routine, node_results, pings)
+        except Exception as e:
+            raised.append(e)
+
+    prober = threading.Thread(target=probe, daemon=True)
+    if allowance > 0:
+        prober.start()
+        prober.join(allowance)
+    err_handler.merge(node_errors)
+    if raised:
+        raise raised[0]
+    if allowance <= 0 or prober.is_alive():
+        err_handler.current_ip = ipv4
+        err_handler.append(TimeBudget.OVERRUN.format(ipv4))
+        if not node_results.results:
+            node_results.append(node_results.partial(ipv4) or
+                                check_result.from_fields(
+                                    [result_holder.time.strftime(DAY_TIME_FMT), ipv4]))
+    result_holder.extend(node_results.results)
+
+
+def sweep_concurrently(
+        servers: List[dict], check_result: CheckResult,
+        interrog_routine: IInterrogator, result_holder: ResultHolder,
+        err_handler: ErrorHandler, workers: int,
+        budget: Optional[TimeBudget] = None,
+        pings: Optional[LatenciesByIp] = None):
+    """
+    Probes up to `workers` nodes at once.
+
+    ErrorHandler.current_ip is a single frame of reference, so sharing one
+    handler between threads would file errors under whichever IP was set
+    last. Each node instead gets its own handler and holder, which are merged
+    back in inventory order, making the output identical to a serial sweep.
+    """
+    def probe_isolated(rmt_pc: dict):
+        node_errors = ErrorHandler()
+        node_results = ResultHolder(result_holder.time)
+        probe_node_within(budget, node_errors, rmt_pc, check_result,
+                          interrog_routine, node_results, pings)
+        return node_errors, node_results
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for node_errors, node_results in executor.map(probe_isolated, servers):
+            err_handler.merge(node_errors)
+            result_holder.extend(node_results.results)
+
+
+def sweep_shards(
+        servers: List[dict], check_result: CheckResult,
+        interrog_routine: IInterrogator, result_holder: ResultHolder,
+        err_handler: ErrorHandler, options: SweepOptions,
+        budget: Optional[TimeBudget] = None,
+        pings: Optional[LatenciesByIp] = None):
+    """
+    Divides the inventory into contiguous shards, each swept by its own
+    process, so that paramiko's crypto and our own formatting aren't confined
+    to one core. Shards are merged back in order, into the single holder and
+    handler given, for one month file and one error email.
+
+    Workers are spawned rather than forked, since the sampler of
+    --reach_first may still be pinging from its own thread.
+    """
+    shard_size = -(-len(servers) // options.shards)
+    shards = [servers[i:i + shard_size]
+              for i in range(0, len(servers), shard_size)]
+    shard_pings = repeat(None)
+    if pings is not None:
+        shard_pings = [{rmt_pc["ip"]: pings[rmt_pc["ip"]] for rmt_pc in shard}
+                       for shard in shards]
+    with ProcessPoolExecutor(max_workers=len(shards),
+                             mp_context=multiprocessing.get_context("spawn")) as executor:
+        for shard_results, shard_errors in executor.map(
+                sweep_shard, shards, repeat(check_result),
+                repeat(interrog_routine), repeat(result_holder.time),
+                repeat(indie_gen_funcs.PUBLIC_IP),
+                repeat(indie_gen_funcs._MONITOR_EMAIL),
+                repeat(options.workers), repeat(budget), shard_pings):
+            result_holder.extend(shard_results)
+            err_handler.merge(shard_errors)
+
+
+def sweep_shard(
+        servers: List[dict], check_result: CheckResult,
+        interrog_routine: IInterrogator, sweep_time: datetime,
+        public_ip: str, monitor_email: str, workers: int,
+        budget: Optional[TimeBudget] = None,
+        pings: Optional[LatenciesByIp] = None)\
+        -> Tuple[List[CheckResult], ErrorHandler]:
+    """
+    Runs in a worker process. Module globals established by the parent are
+    passed explicitly, since spawned workers would not inherit them.
+
+    :return: results, and errors, fit to be pickled back to the parent.
+    """
+    indie_gen_funcs.PUBLIC_IP = public_ip
+    indie_gen_funcs._MONITOR_EMAIL = monitor_email
+    err_handler = ErrorHandler()
+    result_holder = ResultHolder(sweep_time)
+    sweep_servers(servers, check_result, interrog_routine, result_holder,
+                  err_handler, workers, budget, pings)
+    err_handler.flatten_tracebacks()
+    return result_holder.results, err_handler
+
+
+class MonitorDaemon:
+    """
+    Sweeps repeatedly, like the systemd timer would start us, but staying
+    resident so that nothing is re-imported, re-read or re-fetched without
+    cause between sweeps.
+
+    Each sweep gets a fresh ResultHolder, timed as it starts, so results land
+    in the month file of their own sweep.
+
+    Edits to the nodes file are adopted before the next sweep. Only the nodes
+    removed lose what is held on them, and those edited their connections.
+    """
+    # How long our own public IP is trusted before being fetched again:
+    PUBLIC_IP_TTL_S = 3600
+
+    def __init__(self, args: argparse.Namespace, check_result: CheckResult,
+                 interrog_routine: IInterrogator = interrog_routine):
+        self.args = args
+        self.check_result = check_result
+        self.interrog_routine = interrog_routine
+        self.options = SweepOptions.from_args(args)
+        self.nodes_watcher = NodesFileWatcher(args.nodes_file)
+        self.config = load_nodes(args.nodes_file)
+        self.scheduler = None
+        if self.options.adaptive:
+            self.scheduler = AdaptiveScheduler.load(check_result)
+        self.breaker = None
+        if self.options.trip_after is not None:
+            self.breaker = CircuitBreaker.load(self.options.trip_after)
+        self.public_ip_checked: Optional[float] = None
+        self.sweeps_done = 0
+        # Connections unused for a couple of sweeps are let go:
+        self.ssh_pool = ssh_pool.SSHPool(2 * (args.interval + args.jitter))
+
+    def run(self, sweeps: Optional[int] = None):
+        """
+        :param sweeps: how many to do before returning. Forever by default.
+        """
+        ssh_pool.install(self.ssh_pool)
+        try:
+            while sweeps is None or sweeps > 0:
+                started = time.monotonic()
+                try:
+                    self.sweep()
+                except Exception:
+                    # Live to sweep another day; journald keeps the trace.
+                    traceback.print_exc()
+                self.ssh_pool.evict_idle()
+                if sweeps is not None:
+                    sweeps -= 1
+                time.sleep(max(0.0, self.next_sweep_time(started) - time.monotonic()))
+        finally:
+            ssh_pool.install(None)
+            self.ssh_pool.close()
+
+    def next_sweep_time(self, last_started: float) -> float:
+        """Spreads sweeps out, as RandomizedDelaySec would."""
+        return last_started + self.args.interval + random.random() * self.args.jitter
+
+    def reload_nodes(self):
+        """Adopts the nodes file, if it has changed since it was last read."""
+        if not self.nodes_watcher.has_changed():
+            return
+        try:
+            config = load_nodes(self.args.nodes_file)
+            diff = diff_nodes(self.config["servers"], config["servers"])
+        except (OSError, ValueError, KeyError):
+            # Likely caught mid-save, or briefly missing, or missing its
+            # servers. Sweep the nodes we have, and try again.
+            traceback.print_exc()
+            self.nodes_watcher.retry()
+            return
+        self.config = config
+        self.apply(diff)
+
+    def apply(self, diff: NodesDiff):
+        """
+        Added nodes need nothing, being unknown until probed. Removed nodes
+        have their schedules and circuits forgotten, and their SSH connections
+        closed. An edit, eg to creds or ports, only closes the node's
+        connection, so leaves its backoff, and any tripped circuit, as it was.
+        """
+        if diff:
+            print("Nodes file changed: {} added, {} removed, {} edited.".format(
+                len(diff.added), len(diff.removed), len(diff.changed)))
+        for ipv4 in diff.removed:
+            if self.scheduler is not None:
+                self.scheduler.state.pop(ipv4, None)
+            if self.breaker is not None:
+                self.breaker.state.pop(ipv4, None)
+        for ipv4 in diff.removed + [rmt_pc["ip"] for rmt_pc in diff.changed]:
+            self.ssh_pool.discard(ipv4)
+
+    def sweep(self):
+        self.reload_nodes()
+        if self.public_ip_checked is None or \
+                time.monotonic() - self.public_ip_checked > self.PUBLIC_IP_TTL_S:
+            monitor_runners_ipv4()
+            self.public_ip_checked = time.monotonic()
+        result_holder = ResultHolder()
+        err_handler = ErrorHandler()
+        sweep_inventory(self.config["servers"], self.check_result,
+                        self.interrog_routine, result_holder, err_handler,
+                        self.options, self.scheduler, self.breaker,
+                        functools.partial(alert_early, self.args, self.check_result),
+                        self.sweeps_done % self.options.sample_every == 0)
+        self.sweeps_done += 1
+        report_sweep(self.args, self.check_result, result_holder, err_handler)
 
 
 def main(args_list: List[str]):
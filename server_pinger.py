@@ -16,7 +16,6 @@ separate timer, it sleeps and repeats. I haven't tested this with systemd.
 
 from datetime import datetime
 import random
-import re
 import time
 from dataclasses import dataclass
 from pathlib import Path
@@ -24,7 +23,7 @@ from typing import Optional, List, Tuple
 
 from indie_gen_funcs import RESULTS_DIR
 from check_result import format_ipv4
-from ping_functions import ping
+from ping_functions import ping_many, PingStats, format_ms
 
 DATE_TIME_FMT = "%y%m%d %H:%M:%S"
 DATE_FMT = "%y%m%d"
@@ -34,8 +33,43 @@ DATE_FMT = "%y%m%d"
 class PingResult:
     local_time: str
     ipv4: str
-    ave_latency_ms: Optional[int]
-    max_latency_ms: Optional[int]
+    ave_latency_ms: Optional[str]
+    max_latency_ms: Optional[str]
+    loss_pct: Optional[str] = None
+    spread_ms: Optional[str] = None
+
+
+class CycleClock:
+    """
+    Schedules cycles a random 30 to 90 minutes apart, counted from when each
+    was due, rather than from when it finished, so that the time spent
+    pinging doesn't drift the schedule.
+
+    A cycle that overruns the start of the next has the next start at once,
+    compressing the gap between them. Any further cycles it overran are
+    skipped, rather than fired back to back.
+    """
+    MIN_GAP_S = 30 * 60
+    MAX_GAP_S = 90 * 60
+
+    def __init__(self, due: Optional[float] = None):
+        self.due = time.time() if due is None else due
+
+    def gap(self) -> float:
+        return self.MIN_GAP_S + random.random() * (self.MAX_GAP_S - self.MIN_GAP_S)
+
+    def advance(self, now: Optional[float] = None) -> float:
+        """:return: when the next cycle is due, never before now."""
+        now = time.time() if now is None else now
+        self.due += self.gap()
+        if self.due < now:
+            print("Cycle overran by {:.0f}s, starting the next at once.".format(
+                now - self.due))
+            self.due = now
+        return self.due
+
+    def sleep_until_due(self):
+        time.sleep(max(0.0, self.due - time.time()))
 
 
 def main():
@@ -43,46 +77,57 @@ def main():
         inventory = f.readlines()
 
     Path(RESULTS_DIR).mkdir(parents=True, exist_ok=True)
+    clock = CycleClock()
     while True:
-        ping_all_day(inventory)
+        ping_all_day(inventory, clock)
 
 
-def ping_all_day(inventory: List[str]) -> None:
-    ping_list = []
+def ping_all_day(inventory: List[str], clock: Optional[CycleClock] = None) -> None:
+    """
+    Pings every target once per cycle, until the day is out. Each cycle's
+    results are appended to that day's file as soon as it is done, so that
+    a crash loses at most the cycle in progress.
+    """
+    clock = CycleClock() if clock is None else clock
+    targets = [ipv4.strip() for ipv4 in inventory]
     today = datetime.utcnow().strftime(DATE_FMT)
     while today == datetime.utcnow().strftime(DATE_FMT):
-        start_time = time.time()
-        # Place max window on this ping cycle of 30-90 minutes:
-        resume_time = start_time + (30 + random.random() * 60) * 60
-        for ipv4 in inventory:
-            local_time = datetime.utcnow()
-            ave_latency_ms, max_latency_ms = time_pings(ipv4)
-            ping_list.append(PingResult(
-                local_time.strftime(DATE_TIME_FMT), ipv4,
-                ave_latency_ms, max_latency_ms))
-        # Pinged everything, sleep before repeating:
-        time.sleep(resume_time - time.time())
-    save_days_pings(ping_list, today)
+        clock.sleep_until_due()
+        # Every target is pinged at once, so they share a time:
+        local_time = datetime.utcnow()
+        save_days_pings(ping_cycle(targets, local_time),
+                        local_time.strftime(DATE_FMT))
+        clock.advance()
+
+
+def ping_cycle(targets: List[str], local_time: datetime) -> List[PingResult]:
+    ping_list = []
+    latencies_by_ip = ping_many(targets)
+    for ipv4 in targets:
+        ave_latency_ms, max_latency_ms = summarise_pings(latencies_by_ip[ipv4])
+        ping_stats = PingStats.of(latencies_by_ip[ipv4])
+        ping_list.append(PingResult(
+            local_time.strftime(DATE_TIME_FMT), ipv4,
+            ave_latency_ms, max_latency_ms,
+            ping_stats.loss_cell(), ping_stats.spread_cell()))
+    return ping_list
 
 
 def save_days_pings(ping_list: List[PingResult], today: str) -> None:
     with open("{}/pings_{}.csv".format(RESULTS_DIR, today), "a+") as f:
         for ping_result in ping_list:
-            f.write("{},{},{},{}\n".format(
+            f.write("{},{},{},{},{},{}\n".format(
                 ping_result.local_time, format_ipv4(ping_result.ipv4),
-                ping_result.ave_latency_ms, ping_result.max_latency_ms))
-
-
-def time_pings(ipv4: str) -> Tuple[Optional[int], Optional[int]]:
-    """Returns average follwed by max latency. Or double None."""
-    result = ping(ipv4)
-    output = result.stdout.decode()
-    latencies = re.findall(r"time=([\d. ]+)ms", output)
-    if result.returncode != 0 or len(latencies) == 0:
-        ave_latency_ms = max_latency_ms = None
-    else:
-        ave_latency_ms = int(round(sum(map(float, latencies)) / len(latencies)))
-        max_latency_ms = int(round(max(map(float, latencies))))
+                ping_result.ave_latency_ms, ping_result.max_latency_ms,
+                ping_result.loss_pct, ping_result.spread_ms))
+
+
+def summarise_pings(latencies: List[float]) -> Tuple[Optional[str], Optional[str]]:
+    """:return: average and max latency, in ms, to the microsecond, or double None."""
+    if len(latencies) == 0:
+        return None, None
+    ave_latency_ms = format_ms(sum(latencies) / len(latencies))
+    max_latency_ms = format_ms(max(latencies))
     return ave_latency_ms, max_latency_ms
 
 
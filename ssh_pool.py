@@ -0,0 +1,115 @@
+"""
+Keeps nodes' SSH connections open between the sweeps of a resident monitor.
+
+Connecting costs several round trips of key exchange and authentication. A
+connection kept from the last sweep only needs a channel opening for each
+command. Kept connections send keepalives, so that NAT and firewalls along
+the way don't forget them. Those unused for too long are closed, as are the
+least recently used, should there be more than the limit on open files
+allows.
+
+A kept connection may still have died, eg with its node's reboot. It is
+checked before being handed out, and SSHInterrogator reconnects should its
+first command find it dead nonetheless.
+"""
+from __future__ import annotations
+
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from indie_gen_funcs import kept_connections_limit
+
+_installed: Optional[SSHPool] = None
+
+
+@dataclass
+class KeptClient:
+    client: object
+    # Which the client authenticated with, so an edit to them isn't ignored:
+    creds: List[dict]
+    last_used: float
+
+
+class SSHPool:
+    """Connected SSHClients, under their node's IP."""
+    KEEPALIVE_S = 60
+
+    def __init__(self, idle_s: float, max_kept: Optional[int] = None):
+        """
+        :param idle_s: how long a connection may go unused before it's closed.
+        :param max_kept: how many connections may be kept, by default as many
+            as the limit on open files allows.
+        """
+        self.idle_s = idle_s
+        self.max_kept = kept_connections_limit() if max_kept is None else max_kept
+        self.kept: Dict[str, KeptClient] = {}
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+
+    def take(self, ipv4: str, creds: List[dict]):
+        """
+        :return: the node's client, for the caller's sole use until it's
+            given back, or None if none is kept that is still active and
+            authenticated with those creds.
+        """
+        with self.lock:
+            kept = self.kept.pop(ipv4, None)
+        if kept is None:
+            return None
+        transport = kept.client.get_transport()
+        if kept.creds != creds or transport is None or not transport.is_active():
+            kept.client.close()
+            return None
+        return kept.client
+
+    def give(self, ipv4: str, creds: List[dict], client):
+        """Keeps the client, if still connected, or else closes it."""
+        transport = client.get_transport()
+        if transport is None or not transport.is_active():
+            client.close()
+            return
+        transport.set_keepalive(self.KEEPALIVE_S)
+        with self.lock:
+            replaced = [self.kept.pop(ipv4, None)]
+            self.kept[ipv4] = KeptClient(client, creds, time.monotonic())
+            # Given back most recently last, so the least recently used first:
+            while len(self.kept) > self.max_kept:
+                replaced.append(self.kept.pop(next(iter(self.kept))))
+        for kept in replaced:
+            if kept is not None:
+                kept.client.close()
+
+    def discard(self, ipv4: str):
+        """Closes the node's client, if any, eg as its entry has been edited."""
+        with self.lock:
+            kept = self.kept.pop(ipv4, None)
+        if kept is not None:
+            kept.client.close()
+
+    def evict_idle(self, now: Optional[float] = None):
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            idle = [ipv4 for ipv4, kept in self.kept.items()
+                    if now - kept.last_used > self.idle_s]
+        for ipv4 in idle:
+            self.discard(ipv4)
+
+    def close(self):
+        for ipv4 in list(self.kept):
+            self.discard(ipv4)
+
+
+def install(pool: Optional[SSHPool]):
+    """Has SSH interrogations in this process use the pool, or, given None, not."""
+    global _installed
+    _installed = pool
+
+
+def installed() -> Optional[SSHPool]:
+    """:return: the pool, unless this is a child process, forked after it was installed."""
+    if _installed is None or _installed.pid != os.getpid():
+        return None
+    return _installed
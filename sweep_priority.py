@@ -0,0 +1,55 @@
+"""
+Orders a sweep so that the nodes most likely to need attention are probed,
+and so reported, first.
+
+Each node is scored from its recent rows in this month's results: how often
+it failed, how erratic its latency was, and how long ago it was last probed.
+Nodes without any history are probed before all others.
+"""
+from __future__ import annotations
+
+import statistics
+import time
+from typing import Dict, List, Optional
+
+from check_result import CheckResult
+from indie_gen_funcs import result_timestamp
+
+# How many of each node's latest rows are scored:
+WINDOW = 12
+FAILURE_WEIGHT = 2.0
+VARIABILITY_WEIGHT = 1.0
+STALENESS_WEIGHT = 1.0
+# How long since its last probe before a node is considered fully stale:
+STALE_S = 24 * 3600.0
+
+
+def score(yymm: str, results: List[CheckResult], now: float) -> float:
+    """
+    :param results: the node's rows, oldest first.
+    :return: the node's need of attention, higher being greater.
+    """
+    if not results:
+        return float("inf")
+    recent = results[-WINDOW:]
+    latencies = [float(r.ave_ping_rtt_ms) for r in recent
+                 if r.ave_ping_rtt_ms is not None]
+    failure_rate = 1 - len(latencies) / len(recent)
+    variability = 0.0
+    if len(latencies) > 1 and statistics.mean(latencies) > 0:
+        # The coefficient of variation, so fast and slow links compare:
+        variability = min(1.0, statistics.pstdev(latencies) / statistics.mean(latencies))
+    staleness = min(1.0, max(0.0, now - result_timestamp(yymm, recent[-1])) / STALE_S)
+    return FAILURE_WEIGHT * failure_rate + VARIABILITY_WEIGHT * variability + \
+        STALENESS_WEIGHT * staleness
+
+
+def prioritise(servers: List[dict], yymm: str,
+               results_by_ip: Dict[str, List[CheckResult]],
+               now: Optional[float] = None) -> List[dict]:
+    """
+    :return: the servers, highest score first. Ties keep inventory order.
+    """
+    now = time.time() if now is None else now
+    return sorted(servers, key=lambda rmt_pc: -score(
+        yymm, results_by_ip.get(rmt_pc["ip"], []), now))
@@ -0,0 +1,181 @@
+"""
+Times TCP handshakes, for hosts whose providers drop ICMP.
+
+connect() completes once the host has answered our SYN, whether with a
+SYN-ACK or, from a closed port, a RST. Either takes one round trip, so either
+will do as a ping. Each probe races connections to each of a node's ports,
+and is timed by whichever is answered first, so a node needn't have every
+port open, or even any.
+
+As with ICMP, every node is probed at once, from a single thread.
+"""
+from __future__ import annotations
+
+import errno
+import selectors
+import socket
+import struct
+import time
+from typing import Dict, List, Optional, Tuple
+
+from ping_functions import Latencies, LatenciesByIp, resolve, DEFAULT_COUNT, \
+    DEFAULT_INTERVAL_S, DEFAULT_TIMEOUT_S
+
+TCP = "tcp"
+DEFAULT_PORTS = (22, 443)
+# Half a typical limit of open files per process:
+MAX_OPEN = 512
+# Errors on connecting which still mean the host answered:
+ANSWERED = {0, errno.ECONNREFUSED}
+
+
+def parse_ports(ports_csv: str) -> Tuple[int, ...]:
+    """Reads "22,443", as given on the command line."""
+    return tuple(map(int, ports_csv.split(",")))
+
+
+class ConnectSession:
+    """
+    The connections made to a batch of hosts, a round at a time, each round
+    timing one handshake with every host.
+
+    :param targets: the ports to race, under each host.
+    """
+
+    def __init__(self, targets: Dict[str, List[int]], count: int,
+                 interval_s: float, timeout_s: float,
+                 max_open: int = MAX_OPEN):
+        self.addresses = {host: resolve(host) for host in targets}
+        self.targets = targets
+        self.count = count
+        self.interval_s = interval_s
+        self.timeout_s = timeout_s
+        self.max_open = max_open
+        # In the order they are to be made:
+        self.probes = [(seq, host) for seq in range(count) for host in targets
+                       if self.addresses[host] is not None]
+        self.next_probe = 0
+        self.started: Dict[Tuple[str, int], float] = {}
+        self.rtts_ms: Dict[Tuple[str, int], float] = {}
+        # The sockets still connecting, under their probe:
+        self.connecting: Dict[Tuple[str, int], List[socket.socket]] = {}
+        self.selector = selectors.DefaultSelector()
+        self.began = time.perf_counter()
+
+    def open_count(self) -> int:
+        return sum(map(len, self.connecting.values()))
+
+    def start_due(self):
+        """Starts every probe whose round has begun, within max_open."""
+        now = time.perf_counter()
+        while self.next_probe < len(self.probes):
+            seq, host = self.probes[self.next_probe]
+            if now < self.began + seq * self.interval_s or \
+                    self.open_count() + len(self.targets[host]) > self.max_open:
+                return
+            self.next_probe += 1
+            probe = (host, seq)
+            self.started[probe] = now
+            self.connecting[probe] = []
+            for port in self.targets[host]:
+                self.connect(probe, port, now)
+
+    def connect(self, probe: Tuple[str, int], port: int, started: float):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        # Reset, rather than close, once answered, sparing TIME_WAITs:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+        err = sock.connect_ex((self.addresses[probe[0]], port))
+        if err == errno.EINPROGRESS:
+            self.connecting[probe].append(sock)
+            self.selector.register(sock, selectors.EVENT_WRITE, probe)
+            return
+        sock.close()
+        if err in ANSWERED:
+            self.answered(probe, started)
+
+    def complete(self, sock: socket.socket, probe: Tuple[str, int]):
+        """Handles a connection having succeeded, been refused, or failed."""
+        received = time.perf_counter()
+        if sock not in self.connecting.get(probe, []):
+            # Dropped since select returned, as another port won the race.
+            return
+        err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        self.close(sock, probe)
+        if err in ANSWERED:
+            self.answered(probe, received)
+
+    def answered(self, probe: Tuple[str, int], received: float):
+        if probe not in self.rtts_ms:
+            self.rtts_ms[probe] = 1000 * (received - self.started[probe])
+        # The race is won, so the other ports are dropped:
+        for sock in list(self.connecting.get(probe, [])):
+            self.close(sock, probe)
+
+    def close(self, sock: socket.socket, probe: Tuple[str, int]):
+        self.selector.unregister(sock)
+        sock.close()
+        self.connecting[probe].remove(sock)
+        if not self.connecting[probe]:
+            del self.connecting[probe]
+
+    def expire(self):
+        """Abandons the probes that have waited timeout_s."""
+        now = time.perf_counter()
+        for probe in list(self.connecting):
+            if now - self.started[probe] >= self.timeout_s:
+                for sock in list(self.connecting[probe]):
+                    self.close(sock, probe)
+
+    def wake_in(self) -> Optional[float]:
+        """:return: seconds until there is more to do, or None if done."""
+        now = time.perf_counter()
+        wakes = [self.started[probe] + self.timeout_s - now
+                 for probe in self.connecting]
+        if self.next_probe < len(self.probes):
+            seq, host = self.probes[self.next_probe]
+            if self.open_count() + len(self.targets[host]) <= self.max_open:
+                wakes.append(self.began + seq * self.interval_s - now)
+        if not wakes:
+            return None
+        return max(0.0, min(wakes))
+
+    def run(self):
+        try:
+            self.start_due()
+            wake_in = self.wake_in()
+            while wake_in is not None:
+                for key, _ in self.selector.select(wake_in):
+                    self.complete(key.fileobj, key.data)
+                self.expire()
+                self.start_due()
+                wake_in = self.wake_in()
+        finally:
+            for probe in list(self.connecting):
+                for sock in list(self.connecting[probe]):
+                    self.close(sock, probe)
+            self.selector.close()
+
+    def latencies(self) -> LatenciesByIp:
+        """
+        :return: the handshake times, in ms, of the probes each host
+            answered, in order.
+        """
+        latencies = {host: Latencies(sent=self.count, method=TCP)
+                     for host in self.targets}
+        for host, seq in sorted(self.rtts_ms, key=lambda probe: probe[1]):
+            latencies[host].append(self.rtts_ms[(host, seq)])
+        return latencies
+
+
+def tcp_ping_many(targets: Dict[str, List[int]], count: int = DEFAULT_COUNT,
+                  interval_s: float = DEFAULT_INTERVAL_S,
+                  timeout_s: float = DEFAULT_TIMEOUT_S) -> LatenciesByIp:
+    """
+    As ping_many, but timing TCP handshakes.
+
+    :param targets: the ports to race, under each host.
+    """
+    session = ConnectSession(targets, count, interval_s, timeout_s)
+    session.run()
+    return session.latencies()
@@ -1,5 +1,7 @@
 import pytest
 
+from check_result import CheckResult
+
 
 @pytest.fixture
 def sport22_lines():
@@ -91,3 +93,13 @@ def mock_rmt_pc_2():
             }
         ]
     }
+
+
+@pytest.fixture
+def mk_result():
+    """Makes a node's result, the same from sweep to sweep but for the fields given."""
+    def mk(ipv4, ping="10", mem="3.2Gi", ports="", boot="Oct  1 2021", peers=""):
+        return CheckResult("01 10:00:00", ipv4, ave_ping_rtt_ms=ping, ping_max_ms=ping, http_code="None",
+                           mem_avail=mem, swap_free="4Gi", disk_avail="124G", last_boot=boot, ports=ports,
+                           ssh_peers=peers)
+    return mk
@@ -0,0 +1,94 @@
+import json
+from unittest.mock import patch, mock_open
+
+from adaptive_schedule import AdaptiveScheduler, signature, STATE_FILE
+from check_result import CheckResult
+from indie_gen_funcs import ErrorHandler
+
+NOW = 1_000_000.0
+
+
+def test_unknown_nodes_are_due():
+    scheduler = AdaptiveScheduler({})
+    servers = [{"ip": "1.1.1.1"}, {"ip": "2.2.2.2"}]
+    assert scheduler.due(servers, NOW) == servers
+
+
+def test_stable_node_backs_off_to_max(mk_result):
+    rmt_pc = {"ip": "1.1.1.1", "max_interval": 7200}
+    scheduler = AdaptiveScheduler({})
+    intervals = []
+    for i in range(5):
+        scheduler.record([rmt_pc], [mk_result("1.1.1.1")], ErrorHandler(), NOW)
+        intervals.append(scheduler.state["1.1.1.1"]["interval"])
+    assert intervals == [0.0, 1800.0, 3600.0, 7200.0, 7200.0]
+    assert scheduler.due([rmt_pc], NOW + 7199) == []
+    assert scheduler.due([rmt_pc], NOW + 7200) == [rmt_pc]
+
+
+def test_changed_or_failing_node_returns_to_min(mk_result):
+    rmt_pc = {"ip": "1.1.1.1", "min_interval": 300}
+    scheduler = AdaptiveScheduler({"1.1.1.1": {
+        "interval": 14400.0, "due": NOW, "signature": signature(mk_result("1.1.1.1"))}})
+    scheduler.record([rmt_pc], [mk_result("1.1.1.1", ports="8080")], ErrorHandler(), NOW)
+    assert scheduler.state["1.1.1.1"] == {
+        "interval": 300.0, "due": NOW + 300, "signature": signature(mk_result("1.1.1.1", ports="8080"))}
+    scheduler.state["1.1.1.1"]["interval"] = 14400.0
+    err_handler = ErrorHandler()
+    err_handler.current_ip = "1.1.1.1"
+    err_handler.append("ssh failure")
+    scheduler.record([rmt_pc], [mk_result("1.1.1.1", ports="8080")], err_handler, NOW)
+    assert scheduler.state["1.1.1.1"]["interval"] == 300.0
+    scheduler.state["1.1.1.1"]["interval"] = 14400.0
+    scheduler.record([rmt_pc], [], ErrorHandler(), NOW)
+    assert scheduler.state["1.1.1.1"]["interval"] == 300.0
+    assert scheduler.state["1.1.1.1"]["signature"] is None
+
+
+def test_lowered_max_interval_brings_node_forward():
+    scheduler = AdaptiveScheduler({"1.1.1.1": {"interval": 14400.0, "due": NOW + 14400, "signature": None}})
+    rmt_pc = {"ip": "1.1.1.1", "max_interval": 3600}
+    assert scheduler.due([rmt_pc], NOW + 3599) == []
+    assert scheduler.due([rmt_pc], NOW + 3600) == [rmt_pc]
+
+
+@patch("adaptive_schedule.datetime")
+@patch("adaptive_schedule.load_results_by_ip", autospec=True)
+def test_load_seeds_from_history(mock_load_results_by_ip, mock_datetime, mk_result):
+    mock_datetime.utcnow.return_value.strftime.return_value = "2201"
+    mock_load_results_by_ip.return_value = {
+        "1.1.1.1": [mk_result("1.1.1.1", ports="22")] + [mk_result("1.1.1.1")] * 3,
+        "2.2.2.2": [mk_result("2.2.2.2")] * 3 + [mk_result("2.2.2.2", ping=None)],
+        "3.3.3.3": [mk_result("3.3.3.3")],
+    }
+    with patch("builtins.open", mock_open(read_data=json.dumps({"3.3.3.3": {"interval": 1.0}}))) as mocked_open:
+        scheduler = AdaptiveScheduler.load(CheckResult)
+    mocked_open.assert_called_once_with(STATE_FILE, encoding="utf8")
+    mock_load_results_by_ip.assert_called_once_with("2201", CheckResult)
+    # 2022-01-01 10:00:00 UTC
+    last_probed = 1641031200.0
+    assert scheduler.state["1.1.1.1"] == {
+        "interval": 3600.0, "due": last_probed + 3600, "signature": signature(mk_result("1.1.1.1"))}
+    assert scheduler.state["2.2.2.2"]["interval"] == 0.0
+    assert scheduler.state["3.3.3.3"] == {"interval": 1.0}
+
+
+@patch("adaptive_schedule.datetime")
+@patch("adaptive_schedule.load_results_by_ip", autospec=True)
+def test_load_seeds_long_stable_run(mock_load_results_by_ip, mock_datetime, mk_result):
+    mock_datetime.utcnow.return_value.strftime.return_value = "2201"
+    mock_load_results_by_ip.return_value = {"1.1.1.1": [mk_result("1.1.1.1")] * 2000}
+    with patch("builtins.open", side_effect=FileNotFoundError):
+        scheduler = AdaptiveScheduler.load(CheckResult)
+    assert scheduler.state["1.1.1.1"]["interval"] == AdaptiveScheduler.DEFAULT_MAX_S
+    assert scheduler.due([{"ip": "1.1.1.1"}], 1641031200.0 + AdaptiveScheduler.DEFAULT_MAX_S)
+
+
+@patch("adaptive_schedule.load_results_by_ip", autospec=True, return_value={})
+def test_load_and_save(mock_load_results_by_ip, tmp_path, mk_result):
+    state_file = str(tmp_path / "nested" / "state.json")
+    scheduler = AdaptiveScheduler.load(CheckResult, state_file)
+    assert scheduler.state == {}
+    scheduler.record([{"ip": "1.1.1.1"}], [mk_result("1.1.1.1")], ErrorHandler(), NOW)
+    scheduler.save()
+    assert AdaptiveScheduler.load(CheckResult, state_file).state == scheduler.state
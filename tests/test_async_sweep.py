@@ -0,0 +1,122 @@
+import threading
+import time
+from unittest.mock import patch, Mock
+
+from async_sweep import AsyncSweeper, StageLimits
+from check_result import CheckResult
+from indie_gen_funcs import ErrorHandler, ResultHolder
+from interrog_routines import interrog_routine, probe_home_page, interrog_ssh
+from time_budget import TimeBudget
+
+IPS = ["10.0.0.{}".format(i) for i in range(6)]
+# Node 5 is unpingable.
+PINGS = {ip: [] if ip.endswith("5") else ["10.0"] for ip in IPS}
+
+
+class StageRecorder:
+    """Records the peak number of threads within the stage it wraps."""
+    def __init__(self, stage):
+        self.stage = stage
+        self.lock = threading.Lock()
+        self.active = 0
+        self.peak = 0
+
+    def __call__(self, *args, **kwargs):
+        with self.lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        time.sleep(0.01)
+        try:
+            return self.stage(*args, **kwargs)
+        finally:
+            with self.lock:
+                self.active -= 1
+
+
+def fake_ssh(err_handler, rmt_pc, result_holder, ipv4, latencies, http_outcome=None):
+    err_handler.append("ssh error on " + ipv4)
+    result_holder.append(CheckResult.from_fields(["t", ipv4, latencies[0], None, *http_outcome]))
+
+
+def test_stage_limits_from_csv():
+    assert StageLimits.from_csv("5,1") == StageLimits(5, 1)
+    assert StageLimits() == StageLimits(50, 10)
+
+
+def test_async_sweep_staged():
+    http_stage = StageRecorder(lambda err_handler, rmt_pc: (None, 404) if rmt_pc["ip"].endswith("4") else None)
+    ssh_stage = StageRecorder(fake_ssh)
+    result_holder = ResultHolder()
+    err_handler = ErrorHandler()
+    with patch.dict("async_sweep.STAGED_ROUTINES", {interrog_routine: (http_stage, ssh_stage)}):
+        sweeper = AsyncSweeper(CheckResult, interrog_routine, StageLimits(3, 1), PINGS)
+    sweeper.sweep([{"ip": ip} for ip in IPS], result_holder, err_handler)
+    assert [r.ipv4 for r in result_holder.results] == ["10.0.0.4", "10.0.0.5"]
+    assert result_holder.results[0].http_code == 404
+    assert err_handler.errors == {"10.0.0.4": ["ssh error on 10.0.0.4"]}
+    assert http_stage.peak <= 3
+    assert ssh_stage.peak == 1
+
+
+def test_async_sweep_given_pings():
+    result_holder = ResultHolder()
+    err_handler = ErrorHandler()
+    with patch.dict("async_sweep.STAGED_ROUTINES", {interrog_routine: (lambda e, r: (None, 200), fake_ssh)}):
+        sweeper = AsyncSweeper(CheckResult, interrog_routine, StageLimits(), {"10.0.0.1": [], "10.0.0.2": [9.5]})
+    sweeper.sweep([{"ip": "10.0.0.1"}, {"ip": "10.0.0.2"}], result_holder, err_handler)
+    assert [(r.ipv4, r.ave_ping_rtt_ms) for r in result_holder.results] == [("10.0.0.1", None), ("10.0.0.2", 9.5)]
+    assert list(err_handler.errors) == ["10.0.0.2"]
+
+
+def test_async_sweep_unstaged_routine():
+    routine = StageRecorder(Mock())
+    result_holder = ResultHolder()
+    sweeper = AsyncSweeper(CheckResult, routine, StageLimits(3, 2), PINGS)
+    sweeper.sweep([{"ip": ip} for ip in IPS], result_holder, ErrorHandler())
+    assert routine.stage.call_count == len(IPS) - 1
+    assert 1 <= routine.peak <= 2
+    assert [r.ipv4 for r in result_holder.results] == ["10.0.0.5"]
+
+
+def test_staged_routines():
+    sweeper = AsyncSweeper(CheckResult, interrog_routine, StageLimits(), {})
+    assert sweeper.http_stage is probe_home_page
+    assert sweeper.ssh_stage is interrog_ssh
+
+
+def stalling_ssh(err_handler, rmt_pc, result_holder, ipv4, latencies, http_outcome=None):
+    result_holder.track(ipv4, lambda: CheckResult.from_fields(["partial", ipv4, rmt_pc["ssh_timeout"] > 0]))
+    time.sleep(0.2)
+
+
+def test_async_sweep_budget():
+    result_holder = ResultHolder()
+    err_handler = ErrorHandler()
+    with patch.dict("async_sweep.STAGED_ROUTINES", {interrog_routine: (lambda e, r: (None, 200), stalling_ssh)}):
+        sweeper = AsyncSweeper(CheckResult, interrog_routine, StageLimits(6, 6), PINGS, TimeBudget(0.1))
+    sweeper.sweep([{"ip": ip} for ip in IPS[:2]], result_holder, err_handler)
+    assert result_holder.results == [CheckResult.from_fields(["partial", ip, True]) for ip in IPS[:2]]
+    assert err_handler.errors == {ip: [TimeBudget.OVERRUN.format(ip)] for ip in IPS[:2]}
+
+
+def test_async_sweep_hung_routine():
+    hung = threading.Event()
+    result_holder = ResultHolder()
+    err_handler = ErrorHandler()
+    sweeper = AsyncSweeper(CheckResult, lambda *args: hung.wait(3), StageLimits(), PINGS, TimeBudget(0.5))
+    started = time.monotonic()
+    try:
+        sweeper.sweep([{"ip": IPS[0]}], result_holder, err_handler)
+        assert time.monotonic() - started < 1
+    finally:
+        hung.set()
+    assert err_handler.errors == {IPS[0]: [TimeBudget.OVERRUN.format(IPS[0])]}
+
+
+def test_async_sweep_after_deadline():
+    result_holder = ResultHolder()
+    err_handler = ErrorHandler()
+    sweeper = AsyncSweeper(CheckResult, Mock(), StageLimits(), PINGS, TimeBudget(None, time.monotonic() - 1))
+    sweeper.sweep([{"ip": IPS[0]}], result_holder, err_handler)
+    assert [(r.ipv4, r.ave_ping_rtt_ms) for r in result_holder.results] == [(IPS[0], None)]
+    assert err_handler.errors == {IPS[0]: [TimeBudget.OVERRUN.format(IPS[0])]}
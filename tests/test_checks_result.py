@@ -12,9 +12,31 @@ def test_deserialise_simple_csv():
 def test_check_result(mock_format_ipv4):
     res = CheckResult(sentinel.time, sentinel.ipv4, sentinel.ping, sentinel.ping_max,
                       sentinel.http_rtt, sentinel.http_code, sentinel.mem_avail, sentinel.swap_free,
-                      sentinel.disk_avail, sentinel.last_boot, sentinel.ports, sentinel.peers)
-    assert len(res.get_header().split(",")) == 12
+                      sentinel.disk_avail, sentinel.last_boot, sentinel.ports, sentinel.status,
+                      sentinel.loss, sentinel.spread, sentinel.method, sentinel.conn, sentinel.phases, sentinel.hash,
+                      sentinel.cert_days, sentinel.cert_issuer, sentinel.cert_chain, sentinel.peers)
+    assert len(res.get_header().split(",")) == 22
     mock_format_ipv4.assert_not_called()
-    assert len(res.to_csv().split(",")) == 12
+    assert len(res.to_csv().split(",")) == 22
     mock_format_ipv4.assert_called_once_with(sentinel.ipv4)
     assert res.get_unit_name() == "node"
+
+
+def test_result_from_csv_round_trip():
+    res = CheckResult("01 10:00:00", "1.2.3.4", "10", "12", status="skipped",
+                      ping_loss_pct="25", ping_spread_ms="9.80_10.10_11.88_12.00_0.85", ping_method="tcp",
+                      http_conn="warm", http_phases="0.0_0.0_0.0_1.2_0.1",
+                      body_hash="5ae1c6a1ad9bc69e", cert_days="61", cert_issuer="Let's Encrypt",
+                      cert_chain="2", ssh_peers="5.6.7.8")
+    assert CheckResult.result_from_csv(res.to_csv()) == res
+
+
+def test_result_from_csv_legacy_row():
+    legacy_row = "01 10:00:00,  1.  2.  3.  4,10,12,42,200,3.2Gi,0,124G,Oct  1 2021,8080,5.6.7.8\n"
+    res = CheckResult.result_from_csv(legacy_row)
+    assert res.ports == "8080"
+    assert res.status is None
+    assert res.ping_loss_pct is None
+    assert res.ping_method is None
+    assert res.http_conn is None
+    assert res.ssh_peers == "5.6.7.8"
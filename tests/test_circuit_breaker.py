@@ -0,0 +1,98 @@
+from unittest.mock import MagicMock, patch
+
+from circuit_breaker import CircuitBreaker, is_down
+from indie_gen_funcs import ErrorHandler
+
+NOW = 1_000_000.0
+SERVERS = [{"ip": "1.1.1.1"}, {"ip": "2.2.2.2"}, {"ip": "3.3.3.3"}]
+
+
+def mk_errors(ipv4):
+    err_handler = ErrorHandler()
+    err_handler.current_ip = ipv4
+    err_handler.append("ssh failure")
+    return err_handler
+
+
+def test_is_down(mk_result):
+    assert is_down("1.1.1.1", None, ErrorHandler())
+    assert is_down("1.1.1.1", mk_result("1.1.1.1", ping=None), ErrorHandler())
+    assert not is_down("1.1.1.1", mk_result("1.1.1.1", mem=None), ErrorHandler())
+    assert is_down("1.1.1.1", mk_result("1.1.1.1", mem=None), mk_errors("1.1.1.1"))
+    assert not is_down("1.1.1.1", mk_result("1.1.1.1"), mk_errors("1.1.1.1"))
+
+
+def test_trips_after_consecutive_failures():
+    breaker = CircuitBreaker({}, 3)
+    for i in range(2):
+        err_handler = ErrorHandler()
+        breaker.record(SERVERS[:1], [], err_handler, NOW)
+        assert not breaker.is_open("1.1.1.1")
+        assert not err_handler.errors
+    err_handler = ErrorHandler()
+    breaker.record(SERVERS[:1], [], err_handler, NOW)
+    assert breaker.is_open("1.1.1.1")
+    assert breaker.state["1.1.1.1"] == {"failures": 3, "backoff": 900.0, "retry": NOW + 900}
+    assert err_handler.errors["1.1.1.1"] == [CircuitBreaker.TRIPPED.format("1.1.1.1", 3)]
+
+
+def test_success_resets_failures(mk_result):
+    breaker = CircuitBreaker({"1.1.1.1": {"failures": 2}}, 3)
+    breaker.record(SERVERS[:1], [mk_result("1.1.1.1")], ErrorHandler(), NOW)
+    assert breaker.state == {}
+
+
+@patch("circuit_breaker.is_reachable", autospec=True, return_value=False)
+def test_triage_skips_open_circuits_until_due(mock_is_reachable):
+    breaker = CircuitBreaker({
+        "1.1.1.1": {"failures": 4, "backoff": 900.0, "retry": NOW + 1},
+        "2.2.2.2": {"failures": 1},
+        "3.3.3.3": {"failures": 3, "backoff": 900.0, "retry": NOW},
+    }, 3)
+    to_probe, to_skip = breaker.triage(SERVERS, now=NOW)
+    assert to_probe == [SERVERS[1]]
+    assert to_skip == [SERVERS[0], SERVERS[2]]
+    mock_is_reachable.assert_called_once_with("3.3.3.3")
+    assert breaker.state["3.3.3.3"] == {"failures": 3, "backoff": 1800.0, "retry": NOW + 1800}
+    assert breaker.state["1.1.1.1"]["retry"] == NOW + 1
+
+
+@patch("circuit_breaker.is_reachable", autospec=True)
+def test_triage_reachable_given(mock_is_reachable):
+    breaker = CircuitBreaker({"1.1.1.1": {"failures": 3, "backoff": 900.0, "retry": NOW}}, 3)
+    reachable = MagicMock(return_value=True)
+    to_probe, to_skip = breaker.triage(SERVERS[:1], now=NOW, reachable=reachable)
+    assert (to_probe, to_skip) == (SERVERS[:1], [])
+    reachable.assert_called_once_with(SERVERS[0])
+    mock_is_reachable.assert_not_called()
+
+
+@patch("circuit_breaker.is_reachable", autospec=True, return_value=False)
+def test_backoff_is_capped(mock_is_reachable):
+    breaker = CircuitBreaker({"1.1.1.1": {"failures": 3, "backoff": 80000.0, "retry": NOW}}, 3)
+    breaker.triage(SERVERS[:1], now=NOW)
+    assert breaker.state["1.1.1.1"]["backoff"] == CircuitBreaker.MAX_BACKOFF_S
+
+
+@patch("circuit_breaker.is_reachable", autospec=True, return_value=True)
+def test_answering_node_is_probed_fully(mock_is_reachable, mk_result):
+    breaker = CircuitBreaker({"1.1.1.1": {"failures": 5, "backoff": 3600.0, "retry": NOW}}, 3)
+    to_probe, to_skip = breaker.triage(SERVERS[:1], now=NOW)
+    assert to_probe == SERVERS[:1]
+    assert to_skip == []
+    # Pingable, but no more:
+    err_handler = mk_errors("1.1.1.1")
+    breaker.record(SERVERS[:1], [mk_result("1.1.1.1", mem=None)], err_handler, NOW)
+    assert breaker.state["1.1.1.1"] == {"failures": 6, "backoff": 7200.0, "retry": NOW + 7200}
+    assert err_handler.errors["1.1.1.1"] == ["ssh failure"]
+    breaker.record(SERVERS[:1], [mk_result("1.1.1.1")], ErrorHandler(), NOW)
+    assert not breaker.is_open("1.1.1.1")
+
+
+def test_load_and_save(tmp_path):
+    state_file = str(tmp_path / "nested" / "state.json")
+    breaker = CircuitBreaker.load(3, state_file)
+    assert breaker.state == {}
+    breaker.record(SERVERS, [], ErrorHandler(), NOW)
+    breaker.save()
+    assert CircuitBreaker.load(3, state_file).state == breaker.state
@@ -117,6 +117,10 @@ def test_is_considered_rangeable():
     assert RangeFinder.is_considered_rangeable("None")
     assert RangeFinder.is_considered_rangeable("None_None")
     assert RangeFinder.is_considered_rangeable("None_64")
+    # As the cert_days of an expired certificate:
+    assert RangeFinder.is_considered_rangeable("-1")
+    assert not RangeFinder.is_considered_rangeable("1-")
+    assert not RangeFinder.is_considered_rangeable("--1")
     assert not RangeFinder.is_considered_rangeable("1.3Megs")
     assert not RangeFinder.is_considered_rangeable("Megs")
     assert not RangeFinder.is_considered_rangeable("13.13.13.13")
@@ -168,6 +172,8 @@ def test_get_scaled(num, unit, number):
     ("None", [None]),
     ("None_None", [None, None]),
     ("48_None", [48, None]),
+    ("-3", [-3]),
+    ("-1.5_2", [-1.5, 2]),
 ])
 def test_to_numeric_list(IEC3SF, numeric_list):
     assert RangeFinder.to_numeric_list(IEC3SF) == numeric_list
@@ -197,6 +203,17 @@ def test_find_ranged_cols():
         assert numeric_cols[k] == expected_result[k]
 
 
+def test_find_ranged_ping_spread():
+    results = [
+        "01 10:00:00,0,7.46_7.63_8.74_9.00_0.58".split(","),
+        "01 11:00:00,37.5,None".split(","),
+    ]
+    assert RangeFinder.find_numeric_cols(results) == {
+        1: [[0], [37.5]],
+        2: [[7.46, 7.63, 8.74, 9.0, 0.58], [None]],
+    }
+
+
 def test_unzip():
     three_tuple = RangeFinder.unzip([["a", 22, 1], ["b", 44, 2]])
     # Makes 3 series of 2 entries each:
@@ -304,3 +321,42 @@ def test_display_statistics():
 </ul></li>
 </ul>
 """
+
+
+@pytest.mark.parametrize("rows", [
+    [[None], [1, 10], [3, 20]],
+    [[1, 10], [None], [3, 20]],
+])
+def test_display_statistics_unreachable(rows):
+    """Whichever row comes first, an unreachable node's "None" is a null of each sub-value."""
+    constant_content = display_statistics(["C1", "ping_spread"], {1: rows})
+    assert constant_content == """
+<h3>Statistics:</h3>
+<ul>
+<li><em>ping_spread:</em>
+<ul>
+<li><em>0:</em>
+<ul>
+<li><em>mean:</em> 2</li>
+<li><em>stdev:</em> 1.41</li>
+<li><em>min:</em> 1</li>
+<li><em>max:</em> 3</li>
+<li><em>nulls:</em> 1</li>
+</ul></li>
+<li><em>1:</em>
+<ul>
+<li><em>mean:</em> 15</li>
+<li><em>stdev:</em> 7.07</li>
+<li><em>min:</em> 10</li>
+<li><em>max:</em> 20</li>
+<li><em>nulls:</em> 1</li>
+</ul></li>
+</ul></li>
+</ul>
+"""
+
+
+def test_find_numeric_cols_expired_cert():
+    results = [["a", "30"], ["b", "-1"], ["c", "None"]]
+    assert RangeFinder.find_numeric_cols(results) == {1: [[30], [-1], [None]]}
+    assert RangeFinder.summarise_numbers([30, -1, None])["min"] == "-1"
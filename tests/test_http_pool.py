@@ -0,0 +1,205 @@
+import datetime
+import hashlib
+import socket
+import ssl
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch, Mock
+
+import pytest
+import requests
+
+import http_pool
+from http_pool import shared_session, connection_state, get_home_page, resuming_context, HttpPhases, \
+    CertSummary, COLD, WARM, RESUMED, BODY_CAP
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.do_HEAD()
+        self.wfile.write(self.body())
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(self.body())))
+        self.send_header("Set-Cookie", "visited=1")
+        self.end_headers()
+
+    def body(self):
+        return b"hello" * (10000 if self.path == "/big" else 1)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def home_page():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield "http://127.0.0.1:{}/".format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+
+def make_cert(cert_path, key_path):
+    """Self-signs a certificate for localhost."""
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import NameOID
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "localhost")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = x509.CertificateBuilder().subject_name(name).issuer_name(name) \
+        .public_key(key.public_key()).serial_number(x509.random_serial_number()) \
+        .not_valid_before(now - datetime.timedelta(days=1)) \
+        .not_valid_after(now + datetime.timedelta(days=30)) \
+        .add_extension(x509.SubjectAlternativeName([x509.DNSName("localhost")]), critical=False) \
+        .sign(key, hashes.SHA256())
+    cert_path.write_bytes(cert.public_bytes(serialization.Encoding.PEM))
+    key_path.write_bytes(key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()))
+    return cert
+
+
+@pytest.fixture
+def tls_home_page(tmp_path):
+    cert_path = tmp_path / "cert.pem"
+    cert = make_cert(cert_path, tmp_path / "key.pem")
+    server = ThreadingHTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert_path, tmp_path / "key.pem")
+    server.socket = context.wrap_socket(server.socket, server_side=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield "https://localhost:{}/".format(server.server_address[1]), str(cert_path), cert
+    server.shutdown()
+    server.server_close()
+
+
+def test_shared_session_per_process():
+    session = shared_session()
+    assert shared_session() is session
+    with patch("http_pool.os.getpid", return_value=-1):
+        assert shared_session() is not session
+
+
+@pytest.mark.parametrize("kept_limit, pool_hosts", [(1 << 20, http_pool.POOL_HOSTS), (256, 128), (1, 1)])
+def test_session_pools_within_open_files(kept_limit, pool_hosts):
+    with patch("http_pool.kept_connections_limit", return_value=kept_limit):
+        adapter = http_pool.make_session().get_adapter("https://example.com")
+    assert adapter._pool_connections == pool_hosts
+    assert adapter.poolmanager.pools._maxsize == pool_hosts
+
+
+def test_connection_state_by_socket():
+    sock = Mock()
+    assert connection_state(Mock(raw=Mock(connection=Mock(sock=sock)))) == COLD
+    assert connection_state(Mock(raw=Mock(connection=Mock(sock=sock)))) == WARM
+    assert connection_state(Mock(raw=Mock(connection=None))) == COLD
+
+
+def test_connection_kept_between_requests(home_page):
+    states = []
+    for _ in range(3):
+        resp = shared_session().get(home_page, timeout=5, stream=True)
+        states.append(connection_state(resp))
+        assert resp.content == b"hello"
+    assert states == [COLD, WARM, WARM]
+    assert not shared_session().cookies
+
+
+def test_http_phases_cell():
+    assert HttpPhases(1.25, 10, 0, 42.04, 0.5).cell() == "1.2_10.0_0.0_42.0_0.5"
+    assert HttpPhases().cell() == "0.0_0.0_0.0_0.0_0.0"
+
+
+def test_get_home_page_phases(home_page):
+    cold = get_home_page(home_page, True)
+    assert (cold.resp.status_code, cold.connection, cold.body_hash) == (200, COLD, None)
+    assert cold.phases.connect_ms > 0 and cold.phases.ttfb_ms > 0
+    # No TLS over http:
+    assert cold.phases.tls_ms == 0
+    warm = get_home_page(home_page, True)
+    assert warm.connection == WARM
+    assert (warm.phases.dns_ms, warm.phases.connect_ms, warm.phases.tls_ms) == (0, 0, 0)
+    assert warm.phases.ttfb_ms > 0
+
+
+def test_get_home_page_tries_each_address(home_page):
+    port = int(home_page.rsplit(":", 1)[1].strip("/"))
+    getaddrinfo = socket.getaddrinfo
+
+    def dual_stack(host, *args, **kwargs):
+        if host != "dual-stack.test":
+            return getaddrinfo(host, *args, **kwargs)
+        # The first refuses, as an unrouted IPv6 address would fail:
+        return [(socket.AF_INET, socket.SOCK_STREAM, 6, "", (address, port))
+                for address in ("127.0.0.2", "127.0.0.1")]
+
+    with patch("http_pool.socket.getaddrinfo", side_effect=dual_stack):
+        cold = get_home_page("http://dual-stack.test:{}/".format(port), True)
+    assert (cold.resp.status_code, cold.connection) == (200, COLD)
+    assert cold.phases.dns_ms > 0 and cold.phases.connect_ms > 0
+
+
+def test_get_home_page_capped(home_page):
+    hello = get_home_page(home_page, True, hash_body=True)
+    assert hello.body_hash == hashlib.blake2b(b"hello", digest_size=8).hexdigest()
+    big = get_home_page(home_page + "big", True, body_cap=4096, hash_body=True)
+    assert big.body_hash == hashlib.blake2b((b"hello" * 10000)[:4096], digest_size=8).hexdigest()
+    # Its connection, having unread body, is not kept:
+    assert get_home_page(home_page + "big", True).connection == COLD
+    assert len(b"hello" * 10000) < BODY_CAP
+    assert get_home_page(home_page + "big", True).connection == WARM
+    # A body of exactly the cap is read in full, and its connection kept:
+    exact = get_home_page(home_page + "big", True, body_cap=len(b"hello" * 10000), hash_body=True)
+    assert exact.body_hash == hashlib.blake2b(b"hello" * 10000, digest_size=8).hexdigest()
+    assert get_home_page(home_page + "big", True).connection == WARM
+
+
+def test_get_home_page_head(home_page):
+    get_home_page(home_page, True)
+    head = get_home_page(home_page, True, method="HEAD", hash_body=True)
+    assert head.resp.status_code == 200
+    assert head.connection == WARM
+    assert head.body_hash is None
+
+
+def test_resuming_context_per_verification():
+    assert resuming_context("CERT_REQUIRED", None, None) is resuming_context("CERT_REQUIRED", None, None)
+    unverified = resuming_context("CERT_NONE", None, None)
+    assert unverified.verify_mode == ssl.CERT_NONE and not unverified.check_hostname
+
+
+@pytest.mark.filterwarnings("ignore::urllib3.exceptions.InsecureRequestWarning")
+def test_get_home_page_resumes_tls(tls_home_page):
+    from cryptography.hazmat.primitives import hashes
+    url, cert_path, cert = tls_home_page
+    with pytest.raises(requests.exceptions.SSLError):
+        get_home_page(url, True)
+    for verify in (cert_path, False):
+        first = get_home_page(url, verify)
+        assert (first.resp.status_code, first.connection) == (200, COLD)
+        assert first.phases.tls_ms > 0
+        assert first.fingerprint == cert.fingerprint(hashes.SHA256()).hex()
+        # Before Python 3.10, an unverified certificate can't be read.
+        if sys.version_info >= (3, 10):
+            assert first.cert == CertSummary(cert.not_valid_after_utc.timestamp(), "localhost", 1)
+            assert first.cert.days_left() in (29, 30)
+        # Dropping the kept connections:
+        shared_session().close()
+        resumed = get_home_page(url, verify)
+        assert resumed.connection == RESUMED
+        assert resumed.fingerprint == first.fingerprint
+        # Though not sent again:
+        assert resumed.cert == first.cert
+        assert get_home_page(url, verify).connection == WARM
+
+
+def test_cert_summary_cells():
+    cert = CertSummary(1000.0 + 3.9 * 24 * 3600, "Acme, Inc", 3)
+    assert cert.cells(now=1000.0) == ["3", "Acme  Inc", "3"]
+    assert CertSummary(1000.0, None, None).cells(now=1001.0) == ["-1", None, None]
@@ -11,7 +11,7 @@ from indie_gen_funcs import send_email, monitor_runners_ipv4, \
     compose_email, parse_args_for_monitoring, CheckResult, \
     email_wout_further_checks, ResultHolder
 from indie_gen_funcs import ErrorHandler, find_cells_under, \
-    convert_date_to_human_readable, load_results, RESULTS_DIR, get_public_ip, plural
+    convert_date_to_human_readable, load_results, load_results_by_ip, RESULTS_DIR, get_public_ip, plural
 import indie_gen_funcs
 
 
@@ -151,10 +151,45 @@ def test_parse_args_for_monitoring_help():
         parse_args_for_monitoring(["-h"], "sentinel.monitored")
 
 
+@pytest.mark.parametrize("count_args", [["-w0"], ["-p", "0"], ["--sample_every", "0"], ["--sample_every", "-2"],
+                                        ["-c0"], ["-k", "0"], ["-o", "-1"]])
+def test_parse_args_for_monitoring_counts_positive(count_args):
+    with pytest.raises(SystemExit):
+        parse_args_for_monitoring(["addy", "password", *count_args], "sentinel.monitored")
+
+
+@pytest.mark.parametrize("limits", ["0,10", "50,-1", "50", "200,50,10", "1,2,3,4", "50,x"])
+def test_parse_args_for_monitoring_stage_limits(limits):
+    with pytest.raises(SystemExit):
+        parse_args_for_monitoring(["addy", "password", "-a", limits], "sentinel.monitored")
+
+
+@pytest.mark.parametrize("soft, kept", [(1024, 256), (2, 1)])
+def test_kept_connections_limit(soft, kept):
+    with patch("resource.getrlimit", return_value=(soft, 4096)):
+        assert indie_gen_funcs.kept_connections_limit() == kept
+
+
+def test_parse_args_for_monitoring_shards_async():
+    with pytest.raises(SystemExit):
+        parse_args_for_monitoring(["addy", "password", "-a50,10", "-p4"], "sentinel.monitored")
+
+
 @pytest.mark.parametrize("extra_args, extra_expected_ns", [
     ([], {}),
     (["-esentinel.recipient_email_addy"], {"email_to": "sentinel.recipient_email_addy"}),
     (["-nsentinel.nodes_file"], {"nodes_file": "sentinel.nodes_file"}),
+    (["-w8"], {"workers": 8}),
+    (["-a50,10"], {"stage_limits": "50,10"}),
+    (["-p4"], {"shards": 4}),
+    (["-b30", "-d600"], {"node_budget": 30.0, "sweep_deadline": 600.0}),
+    (["--daemon", "--interval=900", "--jitter=60"], {"daemon": True, "interval": 900.0, "jitter": 60.0}),
+    (["--adaptive"], {"adaptive": True}),
+    (["-k", "3"], {"trip_after": 3}),
+    (["-o", "10"], {"priority_wave": 10}),
+    (["-c", "20", "-i", "0.2"], {"ping_count": 20, "ping_interval": 0.2}),
+    (["-r", "--sample_every", "6"], {"reach_first": True, "sample_every": 6}),
+    (["-t", "fallback", "--tcp_ports", "443"], {"tcp_probe": "fallback", "tcp_ports": "443"}),
 ])
 def test_parse_args_for_monitoring(extra_args, extra_expected_ns):
     MOCK_ARGS_LIST = ["sentinel.email_addy", "sentinel.email_password"]
@@ -164,7 +199,24 @@ def test_parse_args_for_monitoring(extra_args, extra_expected_ns):
         email_to=None,
         nodes_file="monitored_sentinel.monitoreds.json",
         password="sentinel.email_password",
-        send_on_success=False
+        send_on_success=False,
+        workers=1,
+        stage_limits=None,
+        shards=1,
+        node_budget=None,
+        sweep_deadline=None,
+        adaptive=False,
+        trip_after=None,
+        priority_wave=None,
+        ping_count=4,
+        ping_interval=1.0,
+        reach_first=False,
+        sample_every=1,
+        tcp_probe=None,
+        tcp_ports="22,443",
+        daemon=False,
+        interval=7200.0,
+        jitter=2400.0
     )
     args = parse_args_for_monitoring(MOCK_ARGS_LIST + extra_args, MOCK_UNIT_NAME)
     assert args == argparse.Namespace(**{**EXPECTED_MOCK_ARGS_OUT, **extra_expected_ns})
@@ -197,6 +249,20 @@ def test_load_results():
         assert results == ["ta\n", "yay\n", "aye\n", "nay\n"]
 
 
+def test_load_results_by_ip():
+    rows = "".join(CheckResult(time, ipv4, ping).to_csv() for time, ipv4, ping in [
+        ("01 10:00:00", "1.1.1.1", "5"), ("01 10:00:00", "2.2.2.2", "6"), ("01 12:00:00", "1.1.1.1", "7")])
+    with patch("builtins.open", mock_open(read_data=rows)):
+        results_by_ip = load_results_by_ip("4499", CheckResult)
+    assert list(results_by_ip.keys()) == ["1.1.1.1", "2.2.2.2"]
+    assert [r.ave_ping_rtt_ms for r in results_by_ip["1.1.1.1"]] == ["5", "7"]
+
+
+@patch("indie_gen_funcs.load_results", autospec=True, side_effect=FileNotFoundError)
+def test_load_results_by_ip_none_yet(mock_load_results):
+    assert load_results_by_ip("4499", CheckResult) == {}
+
+
 def test_error_handler():
     error_handler = ErrorHandler()
     assert error_handler.msg["To"] == indie_gen_funcs._MONITOR_EMAIL
@@ -218,6 +284,35 @@ def get_minimal_error_handler(errors_to_add: List[Exception]):
     return error_handler
 
 
+def test_error_handler_merge():
+    first_err, second_err, third_err = RuntimeError("1"), RuntimeError("2"), RuntimeError("3")
+    error_handler = ErrorHandler()
+    node_handler_1 = get_minimal_error_handler([first_err, second_err])
+    node_handler_2 = ErrorHandler()
+    node_handler_2.current_ip = "there"
+    node_handler_2.append(third_err)
+    error_handler.merge(ErrorHandler())
+    assert error_handler.first_error is None
+    error_handler.merge(node_handler_1)
+    error_handler.merge(node_handler_2)
+    assert error_handler.first_error == first_err
+    assert error_handler.first_ip == "here"
+    assert error_handler.errors == {"here": [first_err, second_err], "there": [third_err]}
+
+
+def test_error_handler_flatten_tracebacks():
+    try:
+        raise RuntimeError("testing")
+    except RuntimeError as e:
+        error_handler = get_minimal_error_handler([e, "plain"])
+    error_handler.flatten_tracebacks()
+    assert error_handler.first_error == "testing"
+    flattened, plain = error_handler.errors["here"]
+    assert flattened.startswith("Traceback (most recent call last):\n")
+    assert flattened.endswith("RuntimeError: testing\n")
+    assert plain == "plain"
+
+
 def test_error_handler_set_subject_no_errors():
     error_handler = ErrorHandler()
     error_handler.set_subject(sentinel.unit_name)
@@ -252,6 +347,27 @@ def test_result_holder():
     assert t1 <= result_holder.time <= t2
 
 
+def test_result_holder_given_time():
+    sweep_time = datetime.datetime(2000, 1, 13, 13, 30, 00)
+    assert ResultHolder(sweep_time).time == sweep_time
+
+
+def test_result_holder_extends():
+    result_holder = ResultHolder()
+    check_results = [Mock(CheckResult), Mock(CheckResult)]
+    result_holder.append(sentinel.first)
+    result_holder.extend(check_results)
+    assert result_holder.results == [sentinel.first] + check_results
+
+
+def test_result_holder_partial():
+    result_holder = ResultHolder()
+    assert result_holder.partial("here") is None
+    result_holder.track("here", lambda: sentinel.partial)
+    assert result_holder.partial("here") == sentinel.partial
+    assert result_holder.results == []
+
+
 def test_result_holder_appends():
     result_holder = ResultHolder()
     check_result = Mock(CheckResult)
@@ -319,7 +435,7 @@ def test_monitor_runners_first_ipv4(mocked_get_public_ip):
     mocked_get_public_ip.assert_called_once_with()
 
 
-@patch("indie_gen_funcs.requests.get", autospec=True)
+@patch("requests.get", autospec=True)
 def test_get_public_ip(mock_requests_get):
     test_ip = "8.8.8.8"
     mock_requests_get.return_value.json.return_value = {
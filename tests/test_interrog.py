@@ -1,11 +1,18 @@
+import dataclasses
 import datetime
-from unittest.mock import patch, sentinel, Mock
+import time
+from unittest.mock import patch, sentinel, Mock, ANY
 
 import requests
 from requests.exceptions import SSLError
 
+from http_pool import HttpPhases, HomePage, CertSummary
 from indie_gen_funcs import DAY_TIME_FMT, ResultHolder, ErrorHandler
-from interrog_routines import interrog_routine
+from tls_cache import TlsCache, CHANGED
+from interrog_routines import interrog_routine, interrog_ssh, probe_home_page, HttpOutcome, CERT_EXPIRING
+
+
+HOME_PAGE = "http://example.com/"
 
 
 def configure_mock_get(mock_get, mock_http_response_time):
@@ -22,17 +29,19 @@ def get_interrog_mock_args():
 
 def get_ave_max_latencies(latencies):
     latencies = list(map(float, latencies))
-    ave_latency = str(int(round(sum(latencies) / len(latencies))))
-    max_latency = str(int(round(max(latencies))))
+    ave_latency = "{:.3f}".format(sum(latencies) / len(latencies)).rstrip("0").rstrip(".")
+    max_latency = "{:.3f}".format(max(latencies)).rstrip("0").rstrip(".")
     return ave_latency, max_latency
 
 
 
 
 @patch("interrog_routines.CheckResult", autospec=True)
-@patch.object(requests, "get", autospec=True)
-@patch("interrog_routines.SSHInterrogator.do_queries", autospec=True)
-def test_interrog_routine(mock_queries, mock_get, mock_check_result):
+@patch("http_pool.request_phases", return_value=HttpPhases(0, 0, 0, 40.0, 2.1))
+@patch("http_pool.connection_state", return_value="warm")
+@patch.object(requests.Session, "request", autospec=True)
+@patch("paramiko_client.SSHInterrogator.do_queries", autospec=True)
+def test_interrog_routine(mock_queries, mock_get, mock_state, mock_phases, mock_check_result):
     mock_http_response_time = 0.0421
     sample_latencies = ['16.0', '15.0', '18.0', '16.0']
     configure_mock_get(mock_get, mock_http_response_time)
@@ -40,65 +49,148 @@ def test_interrog_routine(mock_queries, mock_get, mock_check_result):
     ave_latency, max_latency = get_ave_max_latencies(sample_latencies)
     interrog_routine(
         err_handler,
-        {"home_page": sentinel.home_page},
+        {"home_page": HOME_PAGE},
         result_holder, sentinel.ipv4, sample_latencies)
     mock_check_result.assert_called_once_with(
         result_holder.time.strftime(DAY_TIME_FMT), sentinel.ipv4,
         ave_latency, max_latency,
         str(int(round(1000 * mock_http_response_time))),
         str(mock_get.return_value.status_code), None, None,
-        None, None, None, None)
+        None, None, None, ping_loss_pct="0",
+        ping_spread_ms="15.00_16.00_17.70_18.00_1.09", ping_method=None, http_conn="warm",
+        http_phases="0.0_0.0_0.0_40.0_2.1", body_hash=None, cert_days=None, cert_issuer=None,
+        cert_chain=None, ssh_peers=None)
+    mock_queries.assert_called_once()
+    mock_get.assert_called_once_with(ANY, "GET", HOME_PAGE, timeout=5, verify=True, stream=True)
+    assert result_holder.track.call_count == 2
+
+
+@patch("paramiko_client.SSHInterrogator.do_queries", autospec=True)
+def test_interrog_ssh_tracks_partial(mock_queries):
+    result_holder = ResultHolder()
+
+    def stall(ssh_interrogator, rmt_pc):
+        ssh_interrogator.mem_avail = "3.2Gi"
+        partial = result_holder.partial(sentinel.ipv4)
+        assert (partial.ave_ping_rtt_ms, partial.http_code, partial.mem_avail, partial.ports) == \
+               ("16", "200", "3.2Gi", None)
+        assert ssh_interrogator.timeout == 7.5
+    mock_queries.side_effect = stall
+    interrog_ssh(Mock(ErrorHandler), {"ssh_timeout": 7.5}, result_holder, sentinel.ipv4,
+                 ['16.0'], HttpOutcome(status_code=200))
     mock_queries.assert_called_once()
-    mock_get.assert_called_once_with(sentinel.home_page, timeout=5, verify=True)
+    assert result_holder.results[0].mem_avail == "3.2Gi"
 
 
 @patch("interrog_routines.CheckResult", autospec=True)
-@patch.object(requests, "get", autospec=True)
-@patch("interrog_routines.SSHInterrogator.do_queries", autospec=True)
-def test_self_sign_interrog_routine(mock_queries, mock_get, mock_check_result):
+@patch("http_pool.connection_state", return_value="warm")
+@patch.object(requests.Session, "request", autospec=True)
+@patch("paramiko_client.SSHInterrogator.do_queries", autospec=True)
+def test_self_sign_interrog_routine(mock_queries, mock_get, mock_state, mock_check_result):
     mock_http_response_time = 0.0421
     sample_latencies = ['16.0', '15.0', '18.0', '16.0']
     configure_mock_get(mock_get, mock_http_response_time)
     err_handler, result_holder = get_interrog_mock_args()
     interrog_routine(
         err_handler,
-        {"home_page": sentinel.home_page, "verify": sentinel.vrfy_path},
+        {"home_page": HOME_PAGE, "verify": sentinel.vrfy_path},
         result_holder, sentinel.ipv4, sample_latencies)
     mock_check_result.assert_called_once()
     mock_queries.assert_called_once()
     mock_get.assert_called_once_with(
-        sentinel.home_page, timeout=5, verify=sentinel.vrfy_path)
+        ANY, "GET", HOME_PAGE, timeout=5, verify=sentinel.vrfy_path, stream=True)
 
 
 @patch("interrog_routines.CheckResult", autospec=True)
-@patch.object(requests, "get", autospec=True, side_effect=[
-    SSLError(), Mock(ok=True, status_code=200, elapsed=Mock(total_seconds=lambda:200))])
-@patch("interrog_routines.SSHInterrogator.do_queries", autospec=True)
-def test_interrog_routine_when_cert_expired(mock_queries, mock_get, mock_check_result):
+@patch("http_pool.connection_state", return_value="cold")
+@patch.object(requests.Session, "request", autospec=True, side_effect=[
+    SSLError(), Mock(ok=True, status_code=200, elapsed=Mock(total_seconds=lambda:200),
+               iter_content=Mock(return_value=[b"hello"]))])
+@patch("paramiko_client.SSHInterrogator.do_queries", autospec=True)
+def test_interrog_routine_when_cert_expired(mock_queries, mock_get, mock_state, mock_check_result):
     sample_latencies = ['16.0', '15.0', '18.0', '16.0']
     # configure_mock_get(mock_get, mock_http_response_time)
     err_handler, result_holder = get_interrog_mock_args()
     interrog_routine(
         err_handler,
-        {"home_page": sentinel.home_page},
+        {"home_page": HOME_PAGE},
         result_holder, sentinel.ipv4, sample_latencies)
     mock_check_result.assert_called_once()
     assert mock_get.call_count == 2
+    assert mock_get.call_args.kwargs["verify"] is False
     mock_queries.assert_called_once()
     err_handler.append.assert_called_once()
 
 
 @patch("interrog_routines.CheckResult", autospec=True)
-@patch.object(requests, "get", autospec=True, side_effect=requests.exceptions.ConnectionError())
-@patch("interrog_routines.SSHInterrogator.do_queries", autospec=True)
-def test_interrog_routine_when_server_unresponsive(mock_queries, mock_get, mock_check_result):
+@patch("http_pool.connection_state", return_value="cold")
+@patch.object(requests.Session, "request", autospec=True, side_effect=requests.exceptions.ConnectionError())
+@patch("paramiko_client.SSHInterrogator.do_queries", autospec=True)
+def test_interrog_routine_when_server_unresponsive(mock_queries, mock_get, mock_state, mock_check_result):
     sample_latencies = ['16.0', '15.0', '18.0', '16.0']
     err_handler, result_holder = get_interrog_mock_args()
     interrog_routine(
         err_handler,
-        {"home_page": sentinel.home_page},
+        {"home_page": HOME_PAGE},
         result_holder, sentinel.ipv4, sample_latencies)
     mock_check_result.assert_not_called()
     mock_get.assert_called_once()
     mock_queries.assert_not_called()
     err_handler.append.assert_called_once_with(mock_get.side_effect)
+
+
+def test_probe_home_page_without_one():
+    assert probe_home_page(Mock(ErrorHandler), {"ip": "1.2.3.4"}) == HttpOutcome()
+
+
+@patch("http_pool.get_home_page", autospec=True)
+def test_probe_home_page_options(mock_get_home_page):
+    mock_get_home_page.return_value = HomePage(
+        Mock(ok=False, status_code=404), "cold", None, "5ae1c6a1ad9bc69e")
+    outcome = probe_home_page(Mock(ErrorHandler), {
+        "home_page": HOME_PAGE, "http_method": "HEAD", "body_cap": 1024, "hash_body": True})
+    assert outcome == HttpOutcome(None, 404, "cold", None, "5ae1c6a1ad9bc69e")
+    mock_get_home_page.assert_called_once_with(
+        HOME_PAGE, True, method="HEAD", body_cap=1024, hash_body=True)
+
+
+@patch("tls_cache.shared_cache")
+@patch("http_pool.get_home_page", autospec=True)
+def test_probe_home_page_remembers_unverified(mock_get_home_page, mock_shared_cache, tmp_path):
+    mock_shared_cache.return_value = TlsCache.load(str(tmp_path / "tls_state.json"))
+    home_page = HomePage(Mock(ok=False, status_code=503), "cold", None, fingerprint="f1")
+    ssl_e = SSLError()
+    mock_get_home_page.side_effect = [ssl_e, home_page]
+    rmt_pc = {"home_page": "https://example.com/"}
+    err_handler = Mock(ErrorHandler)
+    assert probe_home_page(err_handler, rmt_pc).status_code == 503
+    err_handler.append.assert_called_once_with(ssl_e)
+    # Now known not to verify, so it isn't tried, nor reported:
+    mock_get_home_page.side_effect = [home_page]
+    err_handler = Mock(ErrorHandler)
+    probe_home_page(err_handler, rmt_pc)
+    assert mock_get_home_page.call_args.args[:2] == ("https://example.com/", False)
+    err_handler.append.assert_not_called()
+    # Unless its certificate changes:
+    mock_get_home_page.side_effect = [dataclasses.replace(home_page, fingerprint="f2")]
+    probe_home_page(err_handler, rmt_pc)
+    err_handler.append.assert_called_once_with(CHANGED.format("example.com:443", "f1", "f2"))
+
+
+@patch("tls_cache.shared_cache")
+@patch("http_pool.get_home_page", autospec=True)
+def test_probe_home_page_cert(mock_get_home_page, mock_shared_cache, tmp_path):
+    mock_shared_cache.return_value = TlsCache.load(str(tmp_path / "tls_state.json"))
+    not_after = time.time() + 20.5 * 24 * 3600
+    mock_get_home_page.return_value = HomePage(
+        Mock(ok=False, status_code=503), "cold", None, fingerprint="f1",
+        cert=CertSummary(not_after, "Let's Encrypt, Inc", 2))
+    err_handler = Mock(ErrorHandler)
+    outcome = probe_home_page(err_handler, {"home_page": "https://example.com/"})
+    assert (outcome.cert_days, outcome.cert_issuer, outcome.cert_chain) == ("20", "Let's Encrypt  Inc", "2")
+    err_handler.append.assert_not_called()
+    mock_get_home_page.return_value = dataclasses.replace(
+        mock_get_home_page.return_value, cert=CertSummary(not_after - 10 * 24 * 3600, None, None))
+    outcome = probe_home_page(err_handler, {"home_page": "https://example.com/"})
+    assert (outcome.cert_days, outcome.cert_issuer, outcome.cert_chain) == ("10", None, None)
+    err_handler.append.assert_called_once_with(CERT_EXPIRING.format("example.com:443", "10"))
@@ -0,0 +1,43 @@
+import os
+
+from nodes_watch import NodesDiff, NodesFileWatcher, diff_nodes
+
+
+def test_diff_nodes():
+    old = [{"ip": "1.1.1.1"}, {"ip": "2.2.2.2", "creds": []}, {"ip": "3.3.3.3"}]
+    new = [{"ip": "4.4.4.4"}, {"ip": "2.2.2.2", "creds": [{"username": "u"}]}, {"ip": "1.1.1.1"}]
+    diff = diff_nodes(old, new)
+    assert diff == NodesDiff([{"ip": "4.4.4.4"}], ["3.3.3.3"], [new[1]])
+    assert diff
+    assert not diff_nodes(old, list(reversed(old)))
+
+
+def test_watcher_notices_writes_and_replacements(tmp_path):
+    nodes_file = tmp_path / "nodes.json"
+    nodes_file.write_text("{}")
+    watcher = NodesFileWatcher(str(nodes_file))
+    assert not watcher.has_changed()
+    nodes_file.write_text('{"servers": []}')
+    assert watcher.has_changed()
+    assert not watcher.has_changed()
+    # Same size and mtime, but another inode:
+    stat = os.stat(nodes_file)
+    replacement = tmp_path / "nodes.json.new"
+    replacement.write_text('{"servers":[1]}')
+    os.utime(replacement, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    keep_inode_in_use = open(nodes_file)
+    os.replace(replacement, nodes_file)
+    keep_inode_in_use.close()
+    assert watcher.has_changed()
+    watcher.retry()
+    assert watcher.has_changed()
+
+
+def test_watcher_missing_file(tmp_path):
+    nodes_file = tmp_path / "nodes.json"
+    watcher = NodesFileWatcher(str(nodes_file))
+    assert not watcher.has_changed()
+    nodes_file.write_text("{}")
+    assert watcher.has_changed()
+    os.remove(nodes_file)
+    assert watcher.has_changed()
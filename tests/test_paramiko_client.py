@@ -5,10 +5,11 @@ import pytest
 from paramiko.channel import ChannelFile
 from paramiko.client import SSHClient
 from paramiko.pkey import PKey
-from paramiko.ssh_exception import AuthenticationException, BadHostKeyException
+from paramiko.ssh_exception import AuthenticationException, BadHostKeyException, SSHException
 
 import indie_gen_funcs
 from paramiko_client import SSHInterrogator, MinerInterrogator
+from ssh_pool import SSHPool
 
 SENTINEL_ERROR = RuntimeError("test injected")
 
@@ -240,25 +241,37 @@ def test_query_disk_free_fail(mock_error_handler):
     mock_error_handler.append.assert_called_once_with(SENTINEL_ERROR)
 
 
+@patch("paramiko_client.ErrorHandler", autospec=True)
+def test_query_parallel_fail(mock_error_handler):
+    interrogator = mk_interrogator(mock_error_handler, [], SENTINEL_ERROR)
+    interrogator.query_parallel(interrogator.sections({}))
+    assert interrogator.client.exec_command.call_count == 5
+    assert mock_error_handler.append.call_args_list == [call(SENTINEL_ERROR)] * 5
+
+
 def test_remote_tentative_calls():
     fake_instance = Mock(SSHInterrogator)
+    SSHInterrogator.remote_tentative_calls(fake_instance, {})
+    fake_instance.sections.assert_called_once_with({})
+    fake_instance.query_batch.assert_called_once_with(fake_instance.sections.return_value)
+    fake_instance.query_parallel.assert_not_called()
+    SSHInterrogator.remote_tentative_calls(fake_instance, {"ssh_batch": False})
+    fake_instance.query_parallel.assert_called_once_with(fake_instance.sections.return_value)
+    fake_instance.query_batch.assert_called_once()
+
+
+@patch("paramiko_client.ErrorHandler", autospec=True)
+def test_sections(mock_error_handler):
+    interrogator = SSHInterrogator(mock_error_handler)
     mock_rmt_pc = {
         "ssh_peers": "NOO.YOO.GET.LOS",
         "known_ports": "100,220,441",
     }
-    fake_instance.parse_user_csv.side_effect = SSHInterrogator.parse_user_csv
-    SSHInterrogator.remote_tentative_calls(fake_instance, mock_rmt_pc)
-    fake_instance.query_free.assert_called_once_with()
-    fake_instance.query_boot_time.assert_called_once_with()
-    fake_instance.query_disk_free.assert_called_once_with()
-    fake_instance.parse_user_csv.assert_has_calls([
-        call(mock_rmt_pc.get("ssh_peers", "")),
-        call(mock_rmt_pc.get("known_ports", "")),
-    ])
-    fake_instance.query_ssh_peers.assert_called_once_with(
-        {indie_gen_funcs.PUBLIC_IP, "NOO.YOO.GET.LOS"})
-    fake_instance.query_ports.assert_called_once_with(
-        SSHInterrogator.parse_user_csv(mock_rmt_pc["known_ports"]))
+    sections = interrogator.sections(mock_rmt_pc)
+    assert [command for command, _ in sections] == [
+        "free -h", "who -b", "df -h --output=avail /", "ss -tn sport = 22", "ss -tuln"]
+    assert sections[3][1].keywords == {"known_peers": {indie_gen_funcs.PUBLIC_IP, "NOO.YOO.GET.LOS"}}
+    assert sections[4][1].keywords == {"known_ports": {"100", "220", "441"}}
 
 
 def test_read_gpu():
@@ -300,11 +313,65 @@ def test_miner_do_queries(
     interrogator = MinerInterrogator(mock_error_handler)
     interrogator.do_queries(mock_rmt_pc_1)
     mock_initialise_connection.assert_called_once_with(mock_rmt_pc_1["ip"], mock_rmt_pc_1["creds"])
-    mock_query_gpus.assert_called_once_with()
+    # Batched, with the other commands:
+    mock_query_gpus.assert_not_called()
     mock_remote_tentative_calls.assert_called_once_with(mock_rmt_pc_1)
     mock_error_handler.append.assert_not_called()
 
 
+def mk_exec_by_command(outputs: dict) -> Mock:
+    """:return: an exec_command answering each command with its lines, or raising them."""
+    def exec_command(command, **kwargs):
+        if isinstance(outputs[command], Exception):
+            raise outputs[command]
+        return sentinel.stdin, Mock(spec=ChannelFile, readlines=Mock(return_value=outputs[command])), sentinel.stderr
+    return Mock(side_effect=exec_command)
+
+
+@patch("paramiko_client.ErrorHandler", autospec=True)
+def test_miner_query_parallel(mock_error_handler, mock_rmt_pc_1, nvidia_smi_lines_1, free_lines_1, sport22_lines,
+                              ss_lines_1):
+    interrogator = MinerInterrogator(mock_error_handler)
+    interrogator.client = Mock(spec=SSHClient, exec_command=mk_exec_by_command({
+        "nvidia-smi": nvidia_smi_lines_1,
+        "free -h": free_lines_1,
+        "who -b": ["         system boot  2021-10-01 08:55\n"],
+        "df -h --output=avail /": SENTINEL_ERROR,
+        "ss -tn sport = 22": sport22_lines,
+        "ss -tuln": ss_lines_1,
+    }))
+    interrogator.remote_tentative_calls({**mock_rmt_pc_1, "ssh_batch": False})
+    assert interrogator.client.exec_command.call_count == 6
+    assert interrogator.g_pwr == ['77', '114', '86']
+    assert interrogator.mem_avail == "3.2Gi"
+    assert interrogator.last_boot == "Oct  1 2021"
+    assert interrogator.ssh_peers == "61.177.173.18"
+    assert interrogator.ports == "22"
+    # Only its own section is lost:
+    assert interrogator.disk_avail is None
+    mock_error_handler.append.assert_called_once_with(SENTINEL_ERROR)
+
+
+@patch("paramiko_client.ErrorHandler", autospec=True)
+@patch("paramiko_client.SSHClient", autospec=True)
+def test_query_parallel_reconnects_once(mock_ssh_client, mock_error_handler, mock_rmt_pc_1, free_lines_1):
+    pool = Mock(spec=SSHPool)
+    pool.take.return_value = Mock(spec=SSHClient, exec_command=Mock(side_effect=EOFError()))
+    interrogator = SSHInterrogator(mock_error_handler, pool=pool)
+    assert interrogator.connect(mock_rmt_pc_1) is None
+    mock_ssh_client.return_value.exec_command = mk_exec_by_command({
+        "free -h": free_lines_1,
+        "df -h --output=avail /": ["Avail\n", "124G\n"],
+    })
+    interrogator.query_parallel([("free -h", interrogator.read_free),
+                                 ("df -h --output=avail /", interrogator.read_disk_free)])
+    mock_ssh_client.return_value.connect.assert_called_once()
+    pool.take.return_value.close.assert_called_once_with()
+    assert interrogator.mem_avail == "3.2Gi"
+    assert interrogator.disk_avail == "124G"
+    mock_error_handler.append.assert_not_called()
+
+
 @patch("paramiko_client.ErrorHandler", autospec=True)
 @patch("paramiko_client.SSHInterrogator.initialise_connection", side_effect=SENTINEL_ERROR)
 def test_miner_do_queries_fail(mock_initialise_connection, mock_error_handler, mock_rmt_pc_1):
@@ -315,3 +382,176 @@ def test_miner_do_queries_fail(mock_initialise_connection, mock_error_handler, m
     mock_error_handler.append.assert_called_once_with(SENTINEL_ERROR)
 
 
+
+
+@patch("paramiko_client.ErrorHandler", autospec=True)
+@patch("paramiko_client.SSHClient", autospec=True)
+@patch("paramiko_client.paramiko.AutoAddPolicy", autospec=True)
+def test_initialise_connection_with_timeout(mock_autoaddpolicy, mock_ssh_client, mock_error_handler, mock_rmt_pc_1):
+    interrogator = SSHInterrogator(mock_error_handler, timeout=7.5)
+    assert interrogator.initialise_connection(mock_rmt_pc_1["ip"], mock_rmt_pc_1["creds"]) is None
+    mock_ssh_client.return_value.connect.assert_called_once_with(
+        mock_rmt_pc_1["ip"], timeout=7.5, banner_timeout=7.5, auth_timeout=7.5,
+        **mock_rmt_pc_1["creds"][0])
+
+
+@patch("paramiko_client.ErrorHandler", autospec=True)
+def test_query_free_with_timeout(mock_error_handler, free_lines_1):
+    interrogator = mk_interrogator(mock_error_handler, free_lines_1)
+    interrogator.timeout = 7.5
+    interrogator.query_free()
+    assert interrogator.mem_avail == "3.2Gi"
+    interrogator.client.exec_command.assert_called_once_with("free -h", timeout=7.5)
+
+
+@patch("paramiko_client.ErrorHandler", autospec=True)
+@patch("paramiko_client.SSHInterrogator.initialise_connection")
+@patch("paramiko_client.SSHInterrogator.remote_tentative_calls")
+def test_do_queries_pooled(mock_remote_tentative_calls, mock_initialise_connection, mock_error_handler,
+                           mock_rmt_pc_1):
+    pool = Mock(spec=SSHPool)
+    pool.take.return_value = sentinel.client
+    interrogator = SSHInterrogator(mock_error_handler, pool=pool)
+    interrogator.do_queries(mock_rmt_pc_1)
+    pool.take.assert_called_once_with(mock_rmt_pc_1["ip"], mock_rmt_pc_1["creds"])
+    mock_initialise_connection.assert_not_called()
+    mock_remote_tentative_calls.assert_called_once_with(mock_rmt_pc_1)
+    pool.give.assert_called_once_with(mock_rmt_pc_1["ip"], mock_rmt_pc_1["creds"], sentinel.client)
+    assert interrogator.client is None
+
+
+@patch("paramiko_client.ErrorHandler", autospec=True)
+@patch("paramiko_client.SSHClient", autospec=True)
+@patch("paramiko_client.SSHInterrogator.remote_tentative_calls")
+def test_do_queries_pool_empty(mock_remote_tentative_calls, mock_ssh_client, mock_error_handler, mock_rmt_pc_1):
+    pool = Mock(spec=SSHPool)
+    pool.take.return_value = None
+    interrogator = SSHInterrogator(mock_error_handler, pool=pool)
+    interrogator.do_queries(mock_rmt_pc_1)
+    mock_ssh_client.return_value.connect.assert_called_once()
+    pool.give.assert_called_once_with(
+        mock_rmt_pc_1["ip"], mock_rmt_pc_1["creds"], mock_ssh_client.return_value)
+    mock_ssh_client.return_value.close.assert_not_called()
+
+
+@patch("paramiko_client.ErrorHandler", autospec=True)
+@patch("paramiko_client.SSHClient", autospec=True)
+@patch("paramiko_client.SSHInterrogator.remote_tentative_calls")
+def test_do_queries_closes_unpooled(mock_remote_tentative_calls, mock_ssh_client, mock_error_handler,
+                                    mock_rmt_pc_1):
+    SSHInterrogator(mock_error_handler).do_queries(mock_rmt_pc_1)
+    mock_ssh_client.return_value.close.assert_called_once_with()
+
+
+@patch("paramiko_client.ErrorHandler", autospec=True)
+@patch("paramiko_client.SSHClient", autospec=True)
+def test_exec_command_reconnects_once(mock_ssh_client, mock_error_handler, mock_rmt_pc_1, free_lines_1):
+    pool = Mock(spec=SSHPool)
+    interrogator = SSHInterrogator(mock_error_handler, pool=pool)
+    patch_interrogator_client(interrogator, [])
+    dead = interrogator.client
+    dead.exec_command.side_effect = EOFError()
+    pool.take.return_value = dead
+    assert interrogator.connect(mock_rmt_pc_1) is None
+    mock_ssh_client.return_value.exec_command.return_value = (
+        sentinel.stdin, Mock(spec=ChannelFile, readlines=Mock(return_value=free_lines_1)), sentinel.stderr)
+    interrogator.query_free()
+    dead.close.assert_called_once_with()
+    mock_ssh_client.return_value.connect.assert_called_once()
+    assert interrogator.mem_avail == "3.2Gi"
+    mock_error_handler.append.assert_not_called()
+    # The new connection is no more likely to be dead, so isn't retried:
+    mock_ssh_client.return_value.exec_command.side_effect = SSHException("closed")
+    interrogator.query_disk_free()
+    assert mock_ssh_client.return_value.connect.call_count == 1
+    mock_error_handler.append.assert_called_once_with(mock_ssh_client.return_value.exec_command.side_effect)
+
+
+@patch("paramiko_client.ErrorHandler", autospec=True)
+@patch("paramiko_client.SSHInterrogator.initialise_connection", autospec=True)
+def test_exec_command_kept_alive_not_retried(mock_initialise_connection, mock_error_handler, mock_rmt_pc_1):
+    pool = Mock(spec=SSHPool)
+    interrogator = SSHInterrogator(mock_error_handler, pool=pool)
+    patch_interrogator_client(interrogator, [])
+    pool.take.return_value = interrogator.client
+    interrogator.connect(mock_rmt_pc_1)
+    interrogator.exec_command("free -h")
+    # Once a command has worked, a later timeout is the node's, not a dead connection's:
+    interrogator.client.exec_command.side_effect = TimeoutError()
+    with pytest.raises(TimeoutError):
+        interrogator.exec_command("who -b")
+    mock_initialise_connection.assert_not_called()
+    interrogator.client.close.assert_not_called()
+
+
+@patch("paramiko_client.ErrorHandler", autospec=True)
+def test_exec_command_fresh_not_retried(mock_error_handler):
+    interrogator = mk_interrogator(mock_error_handler, [], EOFError())
+    with pytest.raises(EOFError):
+        interrogator.exec_command("free -h")
+    interrogator.client.exec_command.assert_called_once_with("free -h")
+
+
+def mk_batch_output(*sections: List[str]) -> List[str]:
+    lines = []
+    for i, section_lines in enumerate(sections):
+        lines += section_lines + ["server_mon-f00d {}\n".format(i)]
+    return lines
+
+
+@patch("paramiko_client.secrets.token_hex", autospec=True, return_value="f00d")
+@patch("paramiko_client.ErrorHandler", autospec=True)
+def test_query_batch(mock_error_handler, mock_token_hex, free_lines_1, sport22_lines, ss_lines_1, mock_rmt_pc_1):
+    interrogator = mk_interrogator(mock_error_handler, mk_batch_output(
+        free_lines_1, ["         system boot  2021-10-01 08:55\n"], ["Avail\n", "124G\n"],
+        sport22_lines, ss_lines_1))
+    interrogator.remote_tentative_calls(mock_rmt_pc_1)
+    interrogator.client.exec_command.assert_called_once_with(
+        "free -h; echo 'server_mon-f00d 0'\n"
+        "who -b; echo 'server_mon-f00d 1'\n"
+        "df -h --output=avail /; echo 'server_mon-f00d 2'\n"
+        "ss -tn sport = 22; echo 'server_mon-f00d 3'\n"
+        "ss -tuln; echo 'server_mon-f00d 4'")
+    assert interrogator.mem_avail == "3.2Gi"
+    assert interrogator.swap_free == "4Gi"
+    assert interrogator.last_boot == "Oct  1 2021"
+    assert interrogator.disk_avail == "124G"
+    assert interrogator.ssh_peers == "61.177.173.18"
+    assert interrogator.ports == "22"
+    mock_error_handler.append.assert_not_called()
+
+
+@patch("paramiko_client.secrets.token_hex", autospec=True, return_value="f00d")
+@patch("paramiko_client.ErrorHandler", autospec=True)
+def test_query_batch_isolates_sections(mock_error_handler, mock_token_hex, free_lines_1):
+    interrogator = mk_interrogator(mock_error_handler, mk_batch_output(
+        ["garbage\n"], free_lines_1)[:-1] + ["Avail\n", "124Gserver_mon-f00d 2\n"])
+    interrogator.query_batch([
+        ("free -h", interrogator.read_free),
+        ("free -h", interrogator.read_free),
+        ("df", interrogator.read_disk_free),
+        ("hung", interrogator.read_disk_free),
+    ])
+    # Output lacking a trailing newline is still read:
+    assert interrogator.disk_avail == "124G"
+    assert interrogator.mem_avail is None
+    errors = [c.args[0] for c in mock_error_handler.append.call_args_list]
+    assert len(errors) == 3
+    assert isinstance(errors[0], IndexError)
+    # The second section's output ran into the third's, without its marker:
+    assert str(errors[1]) == "No output from `free -h`"
+    assert str(errors[2]) == "No output from `hung`"
+
+
+@patch("paramiko_client.ErrorHandler", autospec=True)
+def test_query_batch_fail(mock_error_handler):
+    interrogator = mk_interrogator(mock_error_handler, [], SENTINEL_ERROR)
+    interrogator.query_batch([("free -h", interrogator.read_free), ("who -b", interrogator.read_boot_time)])
+    mock_error_handler.append.assert_called_once_with(SENTINEL_ERROR)
+
+
+@patch("paramiko_client.ErrorHandler", autospec=True)
+def test_miner_sections(mock_error_handler, mock_rmt_pc_1):
+    interrogator = MinerInterrogator(mock_error_handler)
+    commands = [command for command, _ in interrogator.sections(mock_rmt_pc_1)]
+    assert commands == ["nvidia-smi", "free -h", "who -b", "df -h --output=avail /", "ss -tn sport = 22", "ss -tuln"]
@@ -1,8 +1,15 @@
+import socket
 import subprocess
+import time
 from unittest.mock import Mock, patch, sentinel
 
 from indie_gen_funcs import ErrorHandler
-from ping_functions import ping, get_ping_latencies
+import pytest
+
+from ping_functions import ping, ping_command, is_reachable, get_ping_latencies, \
+    checksum, echo_request, native_ping, open_icmp_socket, EchoSession, ping_latencies, \
+    native_ping_many, ping_many, ICMP_ECHO_REPLY, Latencies, PingStats, parse_ping_latencies, reach_many, \
+    SO_TIMESTAMPNS, TIMESPEC, format_ms, kernel_timestamp_ns
 
 STDOUT_WINDOWS_ONLINE = \
     b'\r\nPinging 8.8.8.8 with 32 bytes of data:\r\nReply from 8.8.8.8: bytes=32 time=16ms TTL=119\r\nReply from ' \
@@ -101,47 +108,334 @@ def test_ping_failure_linux(mock_system, mock_run):
     assert result.stdout == STDOUT_LINUX_FAILURE
 
 
+@patch("ping_functions.native_ping", return_value=None)
 @patch("ping_functions.ping", return_value=Mock(
     subprocess.CompletedProcess,
     returncode=0,
     stdout=STDOUT_LINUX_ONLINE))
-def test_get_ping_latencies_linux(mock_ping):
+def test_get_ping_latencies_linux(mock_ping, mock_native_ping):
     error_handler = ErrorHandler()
     latencies = get_ping_latencies(error_handler, sentinel.ip_addy)
-    mock_ping.assert_called_once_with(sentinel.ip_addy)
+    mock_ping.assert_called_once_with(sentinel.ip_addy, 4, None, 1.0)
     assert len(latencies) == 4
     assert list(map(float, latencies)) == [7.51, 7.63, 7.68, 7.46]
 
 
+@patch("ping_functions.native_ping", return_value=None)
 @patch("ping_functions.ping", return_value=Mock(
     subprocess.CompletedProcess,
     returncode=1,
     stdout=STDOUT_LINUX_FAILURE))
-def test_get_ping_latencies_linux_failure(mock_ping):
+def test_get_ping_latencies_linux_failure(mock_ping, mock_native_ping):
     error_handler = ErrorHandler()
     latencies = get_ping_latencies(error_handler, sentinel.ip_addy)
-    mock_ping.assert_called_once_with(sentinel.ip_addy)
+    mock_ping.assert_called_once_with(sentinel.ip_addy, 4, None, 1.0)
     assert len(latencies) == 0
 
 
+@patch("ping_functions.native_ping", return_value=None)
 @patch("ping_functions.ping", return_value=Mock(
     subprocess.CompletedProcess,
     returncode=0,
     stdout=STDOUT_WINDOWS_ONLINE))
-def test_get_ping_latencies_windows(mock_ping):
+def test_get_ping_latencies_windows(mock_ping, mock_native_ping):
     error_handler = ErrorHandler()
     latencies = get_ping_latencies(error_handler, sentinel.ip_addy)
-    mock_ping.assert_called_once_with(sentinel.ip_addy)
+    mock_ping.assert_called_once_with(sentinel.ip_addy, 4, None, 1.0)
     assert len(latencies) == 4
     assert list(map(float, latencies)) == [16.0, 15.0, 18.0, 16.0]
 
 
+@patch("ping_functions.native_ping", return_value=None)
 @patch("ping_functions.ping", return_value=Mock(
     subprocess.CompletedProcess,
     returncode=1,
     stdout=STDOUT_WINDOWS_FAILURE))
-def test_get_ping_latencies_windows_failure(mock_ping):
+def test_get_ping_latencies_windows_failure(mock_ping, mock_native_ping):
     error_handler = ErrorHandler()
     latencies = get_ping_latencies(error_handler, sentinel.ip_addy)
-    mock_ping.assert_called_once_with(sentinel.ip_addy)
+    mock_ping.assert_called_once_with(sentinel.ip_addy, 4, None, 1.0)
     assert len(latencies) == 0
+
+
+@patch("ping_functions.native_ping", return_value=None)
+@patch("ping_functions.platform.system", return_value="Linux")
+@patch("ping_functions.subprocess.run", autospec=True)
+def test_is_reachable(mock_run, mock_system, mock_native_ping):
+    mock_run.return_value = Mock(returncode=0, stdout=STDOUT_LINUX_ONLINE)
+    assert is_reachable("8.8.8.8")
+    mock_run.assert_called_once_with(['ping', '-c', '1', '-W', '1', "8.8.8.8"], capture_output=True)
+    mock_run.return_value = Mock(returncode=1, stdout=STDOUT_LINUX_FAILURE)
+    assert not is_reachable("248.248.128.128")
+
+
+@patch("ping_functions.platform.system", return_value="Windows")
+def test_ping_command_windows_wait(mock_system):
+    assert ping_command("8.8.8.8", 1, 2) == ['ping', '-n', '1', '-w', '2000', "8.8.8.8"]
+
+
+@patch("ping_functions.platform.system", return_value="Linux")
+def test_ping_command_interval(mock_system):
+    assert ping_command("8.8.8.8", 20, None, 0.2) == ['ping', '-c', '20', '-i', '0.2', "8.8.8.8"]
+    mock_system.return_value = "Windows"
+    assert ping_command("8.8.8.8", 20, None, 0.2) == ['ping', '-n', '20', "8.8.8.8"]
+
+
+def test_parse_ping_latencies_counts_sent():
+    latencies = parse_ping_latencies(Mock(returncode=0, stdout=STDOUT_LINUX_ONLINE), 5)
+    assert latencies == [7.51, 7.63, 7.68, 7.46]
+    assert latencies.sent == 5
+    assert parse_ping_latencies(Mock(returncode=1, stdout=STDOUT_LINUX_FAILURE), 5).sent == 5
+
+
+def test_ping_stats():
+    stats = PingStats.of(Latencies([7.51, 7.63, 7.68, 7.46, 9.0], 8))
+    assert stats.loss_cell() == "37.5"
+    assert (stats.min_ms, stats.p50_ms, stats.max_ms) == (7.46, 7.63, 9.0)
+    assert stats.p95_ms == pytest.approx(8.736)
+    assert stats.spread_cell() == "7.46_7.63_8.74_9.00_0.58"
+
+
+def test_ping_stats_unanswered():
+    stats = PingStats.of(Latencies(sent=4))
+    assert stats.loss_cell() == "100"
+    assert stats.spread_cell() is None
+    # Plain lists don't say how many were sent, so nothing is taken as lost:
+    assert PingStats.of([7.5]).loss_cell() == "0"
+    assert PingStats.of([7.5]).spread_cell() == "7.50_7.50_7.50_7.50_0.00"
+
+
+@patch("ping_functions.native_ping", autospec=True, return_value=[7.5, 7.6])
+@patch("ping_functions.ping", autospec=True)
+def test_ping_latencies_native(mock_ping, mock_native_ping):
+    assert ping_latencies("8.8.8.8", 2, 0.2, 0.5) == [7.5, 7.6]
+    mock_native_ping.assert_called_once_with("8.8.8.8", 2, 0.2, 0.5)
+    mock_ping.assert_not_called()
+
+
+@patch("ping_functions.native_ping", autospec=True, return_value=None)
+@patch("ping_functions.ping", autospec=True, return_value=Mock(returncode=1, stdout=b""))
+def test_ping_latencies_fallback_waits_whole_seconds(mock_ping, mock_native_ping):
+    assert ping_latencies("8.8.8.8", 2, timeout_s=0.5) == []
+    mock_ping.assert_called_once_with("8.8.8.8", 2, 1, 1.0)
+
+
+def test_checksum():
+    # The worked example of RFC 1071, section 3, in network byte order:
+    assert checksum(bytes.fromhex("0001f203f4f5f6f7")) == ~0xddf2 & 0xFFFF
+    request = echo_request(0x1234, 7)
+    assert checksum(request) == 0
+    assert request[:1] == b"\x08"
+    assert checksum(b"\x01") == ~0x0100 & 0xFFFF
+
+
+class FakeSocket:
+    def __init__(self, *packets):
+        self.packets = list(packets)
+        self.sent = []
+
+    def sendto(self, data, address):
+        self.sent.append((data, address))
+
+    def recvmsg(self, size, ancbufsize):
+        if not self.packets:
+            raise BlockingIOError
+        data, address, *ancdata = self.packets.pop(0)
+        return data, ancdata, 0, address
+
+
+def echo_reply(ident, seq):
+    return bytes([ICMP_ECHO_REPLY]) + echo_request(ident, seq)[1:]
+
+
+def test_echo_session_datagram():
+    session = EchoSession(["10.0.0.1", "10.0.0.2", "10.0.0.1"], False, 2, 0.0, 1.0)
+    sock = FakeSocket((echo_reply(999, 0), ("10.0.0.1", 0)),
+                      (echo_reply(999, 0), ("10.0.0.1", 0)),
+                      (echo_reply(999, 1), ("10.0.0.3", 0)),
+                      (echo_reply(999, 1), ("10.0.0.1", 0)),
+                      (echo_reply(999, 1), ("10.0.0.2", 0)))
+    session.send_due(sock)
+    # Interleaved, a round at a time:
+    assert [(data[6:8], address[0]) for data, address in sock.sent] == [
+        (b"\0\0", "10.0.0.1"), (b"\0\0", "10.0.0.2"), (b"\0\1", "10.0.0.1"), (b"\0\1", "10.0.0.2")]
+    assert session.wake_in() > 0
+    for i in range(6):
+        session.receive(sock)
+    # Duplicates, and replies from elsewhere, are ignored:
+    latencies = session.latencies()
+    assert list(latencies) == ["10.0.0.1", "10.0.0.2"]
+    assert len(latencies["10.0.0.1"]) == 2
+    assert len(latencies["10.0.0.2"]) == 1
+    assert session.wake_in() > 0
+
+
+def test_echo_session_paces_rounds():
+    session = EchoSession(["10.0.0.1", "10.0.0.2"], False, 3, 60.0, 1.0)
+    sock = FakeSocket()
+    session.send_due(sock)
+    assert len(sock.sent) == 2
+    assert 59 < session.wake_in() <= 60
+
+
+def test_echo_session_until_first():
+    session = EchoSession(["10.0.0.1", "10.0.0.2"], False, 3, 0.05, 1.0, until_first=True)
+    sock = FakeSocket((echo_reply(999, 0), ("10.0.0.1", 0)))
+    session.send_due(sock)
+    session.receive(sock)
+    time.sleep(0.06)
+    session.send_due(sock)
+    # Only the host yet to answer is sent another:
+    assert [address[0] for _, address in sock.sent] == ["10.0.0.1", "10.0.0.2", "10.0.0.2"]
+    assert session.wake_in() > 0
+    sock.packets.append((echo_reply(999, 1), ("10.0.0.2", 0)))
+    session.receive(sock)
+    # Everything answered, so there's no waiting out the rest:
+    assert session.wake_in() is None
+    latencies = session.latencies()
+    assert (len(latencies["10.0.0.1"]), latencies["10.0.0.1"].sent) == (1, 1)
+    assert (len(latencies["10.0.0.2"]), latencies["10.0.0.2"].sent) == (1, 2)
+
+
+def test_echo_session_kernel_timestamps():
+    session = EchoSession(["10.0.0.1", "10.0.0.2"], False, 1, 0.0, 1.0)
+    session.send_due(FakeSocket())
+    stamped = (socket.SOL_SOCKET, SO_TIMESTAMPNS, TIMESPEC.pack(
+        *divmod(session.sent_ns[("10.0.0.1", 0)] + 183_000, 10**9)))
+    # As if the wall clock were stepped back since sending:
+    stepped = (socket.SOL_SOCKET, SO_TIMESTAMPNS, TIMESPEC.pack(0, 0))
+    time.sleep(0.01)
+    sock = FakeSocket((echo_reply(999, 0), ("10.0.0.1", 0), stamped),
+                      (echo_reply(999, 0), ("10.0.0.2", 0), stepped))
+    session.receive(sock)
+    session.receive(sock)
+    latencies = session.latencies()
+    # The kernel's stamp is preferred, to the microsecond:
+    assert latencies["10.0.0.1"] == [pytest.approx(0.183)]
+    assert latencies["10.0.0.2"][0] > 10
+
+
+def test_kernel_timestamp_ns():
+    assert kernel_timestamp_ns([]) is None
+    assert kernel_timestamp_ns([(socket.SOL_SOCKET, SO_TIMESTAMPNS, TIMESPEC.pack(3, 5))]) == 3_000_000_005
+
+
+def test_format_ms():
+    assert format_ms(0.1834) == "0.183"
+    assert format_ms(16.0) == "16"
+    assert format_ms(16.25) == "16.25"
+
+
+class FullSocket(FakeSocket):
+    def sendto(self, data, address):
+        raise BlockingIOError
+
+
+def test_echo_session_send_buffer_full():
+    session = EchoSession(["10.0.0.1"], False, 1, 0.0, 1.0)
+    session.send_due(FullSocket())
+    assert session.sent == {}
+    assert session.wake_in() == 0.001
+
+
+def test_echo_session_raw():
+    session = EchoSession(["10.0.0.1"], True, 1, 0.0, 1.0)
+    ip_header = bytes([0x45]) + bytes(19)
+    sock = FakeSocket((ip_header + echo_reply(session.ident ^ 1, 0), ("10.0.0.1", 0)),
+                      (ip_header + echo_request(session.ident, 0), ("10.0.0.1", 0)),
+                      (ip_header + echo_reply(session.ident, 0), ("10.0.0.1", 0)))
+    session.send_due(sock)
+    session.receive(sock)
+    session.receive(sock)
+    assert session.latencies() == {"10.0.0.1": []}
+    session.receive(sock)
+    assert len(session.latencies()["10.0.0.1"]) == 1
+    assert session.wake_in() is None
+
+
+@patch("ping_functions.platform.system", return_value="Darwin")
+def test_echo_session_datagram_bsd(mock_system):
+    # Unlike Linux, these keep the IP header, and the identifier sent:
+    session = EchoSession(["10.0.0.1"], False, 1, 0.0, 1.0)
+    ip_header = bytes([0x45]) + bytes(19)
+    sock = FakeSocket((ip_header + echo_reply(session.ident ^ 1, 0), ("10.0.0.1", 0)),
+                      (ip_header + echo_reply(session.ident, 0), ("10.0.0.1", 0)))
+    session.send_due(sock)
+    session.receive(sock)
+    assert session.latencies() == {"10.0.0.1": []}
+    session.receive(sock)
+    assert len(session.latencies()["10.0.0.1"]) == 1
+
+
+def test_echo_session_times_out():
+    session = EchoSession(["10.0.0.1"], False, 1, 0.0, 0.0)
+    session.send_due(FakeSocket())
+    assert session.wake_in() is None
+    assert session.latencies() == {"10.0.0.1": []}
+    assert session.latencies()["10.0.0.1"].sent == 1
+
+
+@patch("ping_functions.native_ping_many", autospec=True, return_value=None)
+@patch("ping_functions.ping", autospec=True, side_effect=lambda host, count, wait_s, interval_s: Mock(
+    returncode=0 if host == "8.8.8.8" else 1, stdout=STDOUT_LINUX_ONLINE))
+def test_ping_many_fallback(mock_ping, mock_native_ping_many):
+    assert ping_many(["8.8.8.8", "248.248.128.128"], timeout_s=1.5) == {
+        "8.8.8.8": [7.51, 7.63, 7.68, 7.46], "248.248.128.128": []}
+    mock_ping.assert_any_call("248.248.128.128", 4, 2, 1.0)
+
+
+@patch("ping_functions.native_ping_many", autospec=True, return_value={"8.8.8.8": [7.5]})
+def test_reach_many(mock_native_ping_many):
+    assert reach_many(["8.8.8.8"]) == {"8.8.8.8": [7.5]}
+    mock_native_ping_many.assert_called_once_with(["8.8.8.8"], 3, 0.25, 1.0, until_first=True)
+
+
+@patch("ping_functions.native_ping_many", autospec=True, return_value=None)
+@patch("ping_functions.ping", autospec=True, return_value=Mock(returncode=0, stdout=STDOUT_LINUX_ONLINE))
+def test_reach_many_fallback(mock_ping, mock_native_ping_many):
+    assert reach_many(["8.8.8.8"]) == {"8.8.8.8": [7.51, 7.63, 7.68, 7.46]}
+    mock_ping.assert_called_once_with("8.8.8.8", 1, 1, 1.0)
+
+
+@patch("ping_functions.socket.socket", autospec=True, side_effect=PermissionError)
+def test_open_icmp_socket_not_permitted(mock_socket):
+    assert open_icmp_socket() is None
+    assert mock_socket.call_count == 2
+
+
+@patch("ping_functions.open_icmp_socket", autospec=True, return_value=None)
+def test_native_ping_not_permitted(mock_open_icmp_socket):
+    assert native_ping("127.0.0.1") is None
+
+
+def can_ping_natively():
+    opened = open_icmp_socket()
+    if opened is not None:
+        opened[0].close()
+    return opened is not None
+
+
+@pytest.mark.skipif(not can_ping_natively(), reason="ICMP sockets aren't permitted here")
+def test_native_ping_loopback():
+    latencies = native_ping("127.0.0.1", 3, 0.01, 1.0)
+    assert len(latencies) == 3
+    assert all(0 < latency < 1000 for latency in latencies)
+    assert native_ping("no.such.host.invalid") == []
+
+
+@pytest.mark.skipif(not can_ping_natively(), reason="ICMP sockets aren't permitted here")
+def test_native_ping_many_loopback():
+    started = time.monotonic()
+    latencies = native_ping_many(["127.0.0.1", "127.0.0.2", "localhost", "no.such.host.invalid"],
+                                 2, 0.01, 1.0)
+    assert time.monotonic() - started < 1
+    assert [len(latencies[host]) for host in latencies] == [2, 2, 2, 0]
+
+
+@pytest.mark.skipif(not can_ping_natively(), reason="ICMP sockets aren't permitted here")
+def test_reach_many_loopback():
+    started = time.monotonic()
+    latencies = reach_many(["127.0.0.1", "127.0.0.2"])
+    # Well before a second retry, let alone the timeout:
+    assert time.monotonic() - started < 0.25
+    assert [len(latencies[host]) for host in latencies] == [1, 1]
@@ -1,9 +1,25 @@
-from unittest.mock import patch, sentinel, create_autospec
+import argparse
+import datetime
+import json
+import os
+import pickle
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch, sentinel, create_autospec, MagicMock, Mock, ANY
 
-from server_mon import CheckResult, \
+import pytest
+
+from server_mon import alert_early, AdaptiveScheduler, CheckResult, CircuitBreaker, MonitorDaemon, StageLimits, SweepOptions, TimeBudget, probe_node_within, \
+    sweep_shard, sweep_shards, sweep_inventory, ping_inventory, \
     process_args, \
     iterate_rmt_servers
-from indie_gen_funcs import ErrorHandler, _MONITOR_EMAIL
+import indie_gen_funcs
+from indie_gen_funcs import ErrorHandler, ResultHolder, _MONITOR_EMAIL
+from ping_functions import Latencies
+import ssh_pool
+from ssh_pool import SSHPool
 
 
 @patch("server_mon.parse_args_for_monitoring", autospec=True, return_value=type('', (), {
@@ -11,7 +27,22 @@ from indie_gen_funcs import ErrorHandler, _MONITOR_EMAIL
     "email_addy": sentinel.email_addy,
     "password": sentinel.password,
     "nodes_file": sentinel.nodes_file,
-    "send_on_success": False
+    "send_on_success": False,
+    "workers": 1,
+    "stage_limits": None,
+    "shards": 1,
+    "node_budget": None,
+    "sweep_deadline": None,
+    "daemon": False,
+    "adaptive": False,
+    "trip_after": None,
+    "priority_wave": None,
+    "ping_count": 4,
+    "ping_interval": 1.0,
+    "reach_first": False,
+    "sample_every": 1,
+    "tcp_probe": None,
+    "tcp_ports": "22,443"
 })())
 @patch("server_mon.CheckResult", autospec=True)
 @patch("server_mon.interrog_routine", autospec=True)
@@ -29,7 +60,9 @@ def test_process_args(
         sentinel.nodes_file,
         mock_c_res,
         mock_interrog_routine,
-        mock_result_holder.return_value)
+        mock_result_holder.return_value,
+        SweepOptions(),
+        ANY)
 
 
 @patch("server_mon.parse_args_for_monitoring", autospec=True, return_value=type('', (), {
@@ -37,7 +70,22 @@ def test_process_args(
     "email_addy": sentinel.email_addy,
     "password": sentinel.password,
     "nodes_file": sentinel.nodes_file,
-    "send_on_success": True
+    "send_on_success": True,
+    "workers": 1,
+    "stage_limits": None,
+    "shards": 1,
+    "node_budget": None,
+    "sweep_deadline": None,
+    "daemon": False,
+    "adaptive": False,
+    "trip_after": None,
+    "priority_wave": None,
+    "ping_count": 4,
+    "ping_interval": 1.0,
+    "reach_first": False,
+    "sample_every": 1,
+    "tcp_probe": None,
+    "tcp_ports": "22,443"
 })())
 @patch("server_mon.send_email", autospec=True)
 @patch("server_mon.compose_email", return_value=sentinel.msg)
@@ -60,7 +108,12 @@ def test_process_args_then_send(
         sentinel.nodes_file,
         mock_c_res,
         mock_interrog_routine,
-        mock_result_holder.return_value)
+        mock_result_holder.return_value,
+        SweepOptions(),
+        ANY)
+    alert = mock_iterate_rmt_servers.call_args.args[5]
+    assert alert.func is alert_early
+    assert alert.args == (mock_parse_args.return_value, mock_c_res)
     mock_compose_email.assert_called_once_with(
         sentinel.results, _MONITOR_EMAIL, sentinel.header, sentinel.unit, "")
     mock_send_email.assert_called_once_with(sentinel.msg, sentinel.email_addy, sentinel.password)
@@ -72,7 +125,22 @@ def test_process_args_then_send(
     "email_addy": sentinel.email_addy,
     "password": sentinel.password,
     "nodes_file": sentinel.nodes_file,
-    "send_on_success": False
+    "send_on_success": False,
+    "workers": 1,
+    "stage_limits": None,
+    "shards": 1,
+    "node_budget": None,
+    "sweep_deadline": None,
+    "daemon": False,
+    "adaptive": False,
+    "trip_after": None,
+    "priority_wave": None,
+    "ping_count": 4,
+    "ping_interval": 1.0,
+    "reach_first": False,
+    "sample_every": 1,
+    "tcp_probe": None,
+    "tcp_ports": "22,443"
 })())
 @patch("server_mon.CheckResult", spec=CheckResult)
 @patch("server_mon.email_wout_further_checks", autospec=True)
@@ -99,13 +167,13 @@ def test_process_args_and_email(
 @patch("server_mon.ResultHolder", autospec=True)
 @patch("server_mon.CheckResult", spec=CheckResult)
 @patch("builtins.open", autospec=True)
-@patch("server_mon.get_ping_latencies", autospec=True)
+@patch("server_mon.ping_many", autospec=True)
 @patch("server_mon.json.load", autospec=True)
 def test_iterate_rmt_servers_good_pings(
-        mock_json_load, mock_get_pings, mocked_open, mock_c_res,
+        mock_json_load, mock_ping_many, mocked_open, mock_c_res,
         mock_result_holder, mock_interrog, mock_ipv4_monitor):
-    iterable_latencies = ["21.43", "24.21", "27.87"]
-    mock_get_pings.return_value = iterable_latencies
+    iterable_latencies = [21.43, 24.21, 27.87]
+    mock_ping_many.return_value = {sentinel.ip: iterable_latencies}
     mock_rmt_pc = {
         "servers": [{
             "ip": sentinel.ip
@@ -119,8 +187,497 @@ def test_iterate_rmt_servers_good_pings(
     mock_interrog.assert_called_once_with(
         err_handler, mock_rmt_pc["servers"][0],
         mock_result_holder, sentinel.ip, iterable_latencies)
-    mock_get_pings.assert_called_once_with(err_handler, sentinel.ip)
+    mock_ping_many.assert_called_once_with([sentinel.ip], 4, 1.0)
     mocked_open.assert_called_once_with(sentinel.file_name, encoding="utf8")
     mock_ipv4_monitor.assert_called_once_with()
 
 
+
+
+@patch("server_mon.monitor_runners_ipv4", autospec=True)
+@patch("builtins.open", autospec=True)
+@patch("server_mon.json.load", autospec=True)
+def test_iterate_rmt_servers_concurrently(mock_json_load, mocked_open, mock_ipv4_monitor):
+    ips = ["10.0.0.{}".format(i) for i in range(6)]
+    mock_json_load.return_value = {"servers": [{"ip": ip} for ip in ips]}
+
+    # Odd nodes are unpingable.
+    pings = {ip: [] if int(ip[-1]) % 2 else ["10.0"] for ip in ips}
+
+    def fake_interrog(err_handler, rmt_pc, result_holder, ipv4, latencies):
+        # Earlier nodes take longest, so finish out of inventory order.
+        time.sleep(0.01 * (len(ips) - int(ipv4[-1])))
+        err_handler.append("failed on " + ipv4)
+        result_holder.append(CheckResult.from_fields(["t", ipv4, latencies[0]]))
+
+    result_holder = ResultHolder()
+    with patch("server_mon.ping_many", return_value=pings):
+        err_handler = iterate_rmt_servers(
+            sentinel.file_name, CheckResult, fake_interrog, result_holder, SweepOptions(workers=4))
+    assert [r.ipv4 for r in result_holder.results] == ips
+    assert [r.ave_ping_rtt_ms for r in result_holder.results] == ["10.0", None] * 3
+    assert [r.ping_loss_pct for r in result_holder.results[1::2]] == ["100"] * 3
+    assert err_handler.errors == {ip: ["failed on " + ip] for ip in ips[::2]}
+    assert err_handler.first_ip == ips[0]
+
+
+@patch("server_mon.monitor_runners_ipv4", autospec=True)
+@patch("server_mon.AsyncSweeper", autospec=True)
+@patch("builtins.open", autospec=True)
+@patch("server_mon.json.load", autospec=True)
+@patch("server_mon.ping_many", autospec=True, return_value=sentinel.pings)
+def test_iterate_rmt_servers_async(mock_ping_many, mock_json_load, mocked_open, mock_sweeper, mock_ipv4_monitor):
+    servers = [{"ip": "10.0.0.1"}]
+    mock_json_load.return_value = {"servers": servers}
+    limits = StageLimits(2, 1)
+    err_handler = iterate_rmt_servers(
+        sentinel.file_name, sentinel.check_result, sentinel.interrog,
+        sentinel.result_holder, SweepOptions(stage_limits=limits))
+    mock_sweeper.assert_called_once_with(sentinel.check_result, sentinel.interrog, limits, sentinel.pings, None)
+    mock_sweeper.return_value.sweep.assert_called_once_with(
+        servers, sentinel.result_holder, err_handler)
+
+
+def test_sweep_options_from_args():
+    args = argparse.Namespace(workers=3, stage_limits="5,1", shards=2, node_budget=30.0, sweep_deadline=600.0,
+                              adaptive=True, trip_after=3, priority_wave=10,
+                              ping_count=20, ping_interval=0.2, reach_first=True, sample_every=6,
+                              tcp_probe="primary", tcp_ports="443")
+    assert SweepOptions.from_args(args) == SweepOptions(
+        3, StageLimits(5, 1), 2, 30.0, 600.0, True, 3, 10, 20, 0.2, True, 6, "primary", (443,))
+    args = argparse.Namespace(workers=1, stage_limits=None, shards=1, node_budget=None, sweep_deadline=None,
+                              adaptive=False, trip_after=None, priority_wave=None,
+                              ping_count=4, ping_interval=1.0, reach_first=False, sample_every=1,
+                              tcp_probe=None, tcp_ports="22,443")
+    assert SweepOptions.from_args(args) == SweepOptions()
+
+
+def failing_interrog(err_handler, rmt_pc, result_holder, ipv4, latencies):
+    try:
+        raise RuntimeError("failed on " + ipv4)
+    except RuntimeError as e:
+        err_handler.append(e)
+    result_holder.append(CheckResult.from_fields(["t", ipv4, indie_gen_funcs.PUBLIC_IP]))
+
+
+def fake_pings(err_handler, ipv4):
+    err_handler.current_ip = ipv4
+    return ["10.0"]
+
+
+@patch("indie_gen_funcs._MONITOR_EMAIL", None)
+@patch("indie_gen_funcs.PUBLIC_IP", None)
+@patch("server_mon.get_ping_latencies", side_effect=fake_pings)
+def test_sweep_shard(mock_pings):
+    sweep_time = datetime.datetime(2000, 1, 13, 13, 30, 00)
+    results, err_handler = sweep_shard(
+        [{"ip": "10.0.0.1"}, {"ip": "10.0.0.2"}], CheckResult, failing_interrog,
+        sweep_time, "sentinel.public_ip", "sentinel@email", 1)
+    assert [r.ave_ping_rtt_ms for r in results] == ["sentinel.public_ip"] * 2
+    assert indie_gen_funcs._MONITOR_EMAIL == "sentinel@email"
+    assert err_handler.first_error == "failed on 10.0.0.1"
+    assert pickle.loads(pickle.dumps(err_handler)).errors.keys() == {"10.0.0.1", "10.0.0.2"}
+
+
+def spawning_pool(max_workers, mp_context):
+    """Stands in for a ProcessPoolExecutor, checking its workers are spawned."""
+    assert mp_context.get_start_method() == "spawn"
+    return ThreadPoolExecutor(max_workers)
+
+
+@patch("server_mon.ProcessPoolExecutor", spawning_pool)
+@patch("server_mon.get_ping_latencies", side_effect=fake_pings)
+def test_sweep_shards(mock_pings):
+    ips = ["10.0.0.{}".format(i) for i in range(7)]
+    result_holder = ResultHolder()
+    err_handler = ErrorHandler()
+    sweep_shards([{"ip": ip} for ip in ips], CheckResult, failing_interrog,
+                 result_holder, err_handler, SweepOptions(workers=2, shards=3))
+    assert [r.ipv4 for r in result_holder.results] == ips
+    assert list(err_handler.errors.keys()) == ips
+    assert err_handler.first_ip == ips[0]
+
+
+@patch("server_mon.ProcessPoolExecutor", spawning_pool)
+@patch("server_mon.get_ping_latencies", autospec=True)
+def test_sweep_shards_given_pings(mock_pings):
+    ips = ["10.0.0.{}".format(i) for i in range(4)]
+    pings = {ip: [float(i)] for i, ip in enumerate(ips)}
+    result_holder = ResultHolder()
+    sweep_shards([{"ip": ip} for ip in ips], CheckResult,
+                 lambda err_handler, rmt_pc, result_holder, ipv4, latencies: result_holder.append(
+                     CheckResult.from_fields(["t", ipv4, latencies[0]])),
+                 result_holder, ErrorHandler(), SweepOptions(shards=2), None, pings)
+    mock_pings.assert_not_called()
+    assert [r.ave_ping_rtt_ms for r in result_holder.results] == [0.0, 1.0, 2.0, 3.0]
+
+
+def stalling_interrog(err_handler, rmt_pc, result_holder, ipv4, latencies):
+    """Gets as far as tracking a partial result, then stalls past any budget."""
+    err_handler.append("stalling with timeout {:.2f}".format(rmt_pc["ssh_timeout"]))
+    result_holder.track(ipv4, lambda: CheckResult.from_fields(["partial", ipv4, latencies[0]]))
+    time.sleep(1)
+
+
+@patch("server_mon.get_ping_latencies", side_effect=fake_pings)
+def test_probe_node_within_budget_overrun(mock_pings):
+    result_holder = ResultHolder()
+    err_handler = ErrorHandler()
+    started = time.monotonic()
+    probe_node_within(TimeBudget(0.05), err_handler, {"ip": "10.0.0.1"}, CheckResult,
+                      stalling_interrog, result_holder)
+    assert time.monotonic() - started < 0.5
+    assert result_holder.results == [CheckResult.from_fields(["partial", "10.0.0.1", "10.0"])]
+    assert err_handler.errors == {"10.0.0.1": [
+        "stalling with timeout 0.05", TimeBudget.OVERRUN.format("10.0.0.1")]}
+
+
+@patch("server_mon.get_ping_latencies", side_effect=fake_pings)
+def test_probe_node_within_budget(mock_pings):
+    result_holder = ResultHolder()
+    err_handler = ErrorHandler()
+    probe_node_within(TimeBudget(5), err_handler, {"ip": "10.0.0.1"}, CheckResult,
+                      failing_interrog, result_holder)
+    assert [r.ipv4 for r in result_holder.results] == ["10.0.0.1"]
+    assert list(err_handler.errors.keys()) == ["10.0.0.1"]
+
+
+@patch("server_mon.get_ping_latencies", side_effect=fake_pings)
+def test_probe_node_after_deadline(mock_pings):
+    result_holder = ResultHolder()
+    err_handler = ErrorHandler()
+    probe_node_within(TimeBudget(5, time.monotonic() - 1), err_handler, {"ip": "10.0.0.1"},
+                      CheckResult, failing_interrog, result_holder)
+    mock_pings.assert_not_called()
+    assert [(r.ipv4, r.ave_ping_rtt_ms) for r in result_holder.results] == [("10.0.0.1", None)]
+    assert err_handler.errors == {"10.0.0.1": [TimeBudget.OVERRUN.format("10.0.0.1")]}
+
+
+@patch("server_mon.get_ping_latencies", side_effect=RuntimeError("unexpected"))
+def test_probe_node_within_budget_raising(mock_pings):
+    with pytest.raises(RuntimeError):
+        probe_node_within(TimeBudget(5), ErrorHandler(), {"ip": "10.0.0.1"}, CheckResult,
+                          failing_interrog, ResultHolder())
+
+
+@patch("server_mon.ping_many", autospec=True, side_effect=lambda ips, count, interval_s: {ip: [] for ip in ips})
+@patch("server_mon.sweep_servers", autospec=True)
+def test_sweep_inventory_adaptive(mock_sweep_servers, mock_ping_many):
+    servers = [{"ip": "1.1.1.1"}, {"ip": "2.2.2.2"}]
+    scheduler = MagicMock(spec=AdaptiveScheduler)
+    scheduler.due.return_value = servers[1:]
+    result_holder = ResultHolder()
+    err_handler = ErrorHandler()
+    sweep_inventory(servers, CheckResult, sentinel.interrog, result_holder, err_handler,
+                    SweepOptions(adaptive=True), scheduler)
+    scheduler.due.assert_called_once_with(servers)
+    assert mock_sweep_servers.call_args.args[0] == servers[1:]
+    scheduler.record.assert_called_once_with(servers[1:], result_holder.results, err_handler)
+    scheduler.save.assert_called_once_with()
+
+
+@patch("server_mon.ping_many", autospec=True, side_effect=lambda ips, count, interval_s: {ip: [] for ip in ips})
+@patch("server_mon.sweep_servers", autospec=True)
+def test_sweep_inventory_circuit_breaker(mock_sweep_servers, mock_ping_many):
+    servers = [{"ip": "1.1.1.1"}, {"ip": "2.2.2.2"}, {"ip": "3.3.3.3"}]
+    breaker = MagicMock(spec=CircuitBreaker)
+    breaker.triage.return_value = [servers[1]], [servers[0], servers[2]]
+    result_holder = ResultHolder()
+    err_handler = ErrorHandler()
+    sweep_inventory(servers, CheckResult, sentinel.interrog, result_holder, err_handler,
+                    SweepOptions(workers=4, trip_after=3), breaker=breaker)
+    breaker.triage.assert_called_once_with(servers, 4)
+    assert mock_sweep_servers.call_args.args[0] == [servers[1]]
+    breaker.record.assert_called_once_with([servers[1]], result_holder.results, err_handler)
+    breaker.save.assert_called_once_with()
+    assert [(r.ipv4, r.status) for r in result_holder.results] == [
+        ("1.1.1.1", "skipped"), ("3.3.3.3", "skipped")]
+
+
+@patch("server_mon.ping_many", autospec=True, return_value={"1.1.1.1": Latencies([10.0, 14.0, 12.0], 4)})
+@patch("server_mon.reach_many", autospec=True, return_value={"1.1.1.1": [11.0], "2.2.2.2": []})
+@patch("server_mon.sweep_servers", autospec=True)
+def test_sweep_inventory_reach_first(mock_sweep_servers, mock_reach_many, mock_ping_many):
+    servers = [{"ip": "1.1.1.1"}, {"ip": "2.2.2.2"}]
+
+    def sweep(servers, check_result, interrog_routine, result_holder, err_handler, workers, budget, pings):
+        for rmt_pc in servers:
+            latencies = pings[rmt_pc["ip"]]
+            result_holder.append(CheckResult(
+                "t", rmt_pc["ip"], *(["11", "11"] if latencies else []),
+                ping_loss_pct="0" if latencies else "100",
+                ping_spread_ms="11.00_11.00_11.00_11.00_0.00" if latencies else None))
+
+    mock_sweep_servers.side_effect = sweep
+    result_holder = ResultHolder()
+    sweep_inventory(servers, CheckResult, sentinel.interrog, result_holder, ErrorHandler(),
+                    SweepOptions(reach_first=True, ping_count=4))
+    mock_reach_many.assert_called_once_with(["1.1.1.1", "2.2.2.2"])
+    # Only those found up are sampled:
+    mock_ping_many.assert_called_once_with(["1.1.1.1"], 4, 1.0)
+    assert result_holder.results == [
+        CheckResult("t", "1.1.1.1", "12", "14", ping_loss_pct="25", ping_spread_ms="10.00_12.00_13.80_14.00_1.63",
+                    ping_method="icmp"),
+        CheckResult("t", "2.2.2.2", ping_loss_pct="100")]
+
+
+@patch("server_mon.tcp_ping_many", autospec=True, side_effect=lambda targets, *args, **kwargs: {
+    ip: Latencies([20.0], method="tcp") for ip in targets})
+@patch("server_mon.ping_many", autospec=True, return_value={"1.1.1.1": [10.0], "2.2.2.2": Latencies(sent=4)})
+def test_ping_inventory_tcp_fallback(mock_ping_many, mock_tcp_ping_many):
+    servers = [{"ip": "1.1.1.1"}, {"ip": "2.2.2.2", "tcp_ports": [8443]}]
+    pings = ping_inventory(servers, SweepOptions(tcp_probe="fallback"))
+    assert pings == {"1.1.1.1": [10.0], "2.2.2.2": [20.0]}
+    assert pings["2.2.2.2"].method == "tcp"
+    # Only the node not answering pings has its handshakes timed:
+    mock_tcp_ping_many.assert_called_once_with({"2.2.2.2": [8443]}, 4, 1.0)
+
+
+@patch("server_mon.tcp_ping_many", autospec=True, return_value={"1.1.1.1": [20.0]})
+@patch("server_mon.reach_many", autospec=True)
+@patch("server_mon.ping_many", autospec=True)
+def test_ping_inventory_tcp_primary(mock_ping_many, mock_reach_many, mock_tcp_ping_many):
+    servers = [{"ip": "1.1.1.1"}]
+    assert ping_inventory(servers, SweepOptions(tcp_probe="primary")) == {"1.1.1.1": [20.0]}
+    mock_tcp_ping_many.assert_called_once_with({"1.1.1.1": (22, 443)}, 4, 1.0)
+    ping_inventory(servers, SweepOptions(tcp_probe="primary"), reach=True)
+    mock_tcp_ping_many.assert_called_with({"1.1.1.1": (22, 443)}, 1, timeout_s=1.0)
+    mock_ping_many.assert_not_called()
+    mock_reach_many.assert_not_called()
+
+
+@patch("server_mon.ping_many", autospec=True)
+@patch("server_mon.reach_many", autospec=True, return_value={"1.1.1.1": [11.0]})
+@patch("server_mon.sweep_servers", autospec=True)
+def test_sweep_inventory_reach_without_sampling(mock_sweep_servers, mock_reach_many, mock_ping_many):
+    mock_sweep_servers.side_effect = lambda servers, check_result, interrog_routine, result_holder, *args: \
+        result_holder.append(CheckResult("t", "1.1.1.1", "11", "11", ping_loss_pct="0",
+                                         ping_spread_ms="11.00_11.00_11.00_11.00_0.00"))
+    result_holder = ResultHolder()
+    sweep_inventory([{"ip": "1.1.1.1"}], CheckResult, sentinel.interrog, result_holder, ErrorHandler(),
+                    SweepOptions(reach_first=True), sample=False)
+    mock_ping_many.assert_not_called()
+    # One reply tells nothing of loss or jitter:
+    assert result_holder.results == [CheckResult("t", "1.1.1.1", "11", "11")]
+
+
+@patch("server_mon.ping_many", autospec=True, side_effect=lambda ips, count, interval_s: {ip: [] for ip in ips})
+@patch("server_mon.load_results_by_ip", autospec=True, return_value={"1.1.1.1": []})
+@patch("server_mon.prioritise", autospec=True)
+@patch("server_mon.sweep_servers", autospec=True)
+def test_sweep_inventory_priority_wave(mock_sweep_servers, mock_prioritise, mock_load_results_by_ip,
+                                      mock_ping_many):
+    servers = [{"ip": "1.1.1.1"}, {"ip": "2.2.2.2"}, {"ip": "3.3.3.3"}]
+    mock_prioritise.return_value = servers[::-1]
+
+    def fail_first(servers, check_result, interrog_routine, result_holder, err_handler, workers, budget, pings):
+        if servers[0]["ip"] == "3.3.3.3":
+            err_handler.current_ip = "3.3.3.3"
+            err_handler.append("down")
+
+    mock_sweep_servers.side_effect = fail_first
+    alert = MagicMock()
+    result_holder = ResultHolder(datetime.datetime(2022, 1, 5))
+    err_handler = ErrorHandler()
+    sweep_inventory(servers, CheckResult, sentinel.interrog, result_holder, err_handler,
+                    SweepOptions(priority_wave=2), alert=alert)
+    mock_load_results_by_ip.assert_called_once_with("2201", CheckResult)
+    mock_prioritise.assert_called_once_with(servers, "2201", {"1.1.1.1": []})
+    assert [c.args[0] for c in mock_sweep_servers.call_args_list] == [servers[:0:-1], servers[:1]]
+    alert.assert_called_once()
+    assert alert.call_args.args[0].errors == {"3.3.3.3": ["down"]}
+    assert err_handler.errors == {"3.3.3.3": ["down"]}
+
+
+@patch("server_mon.ping_many", autospec=True, side_effect=lambda ips, count, interval_s: {ip: [] for ip in ips})
+@patch("server_mon.load_results_by_ip", autospec=True, return_value={})
+@patch("server_mon.sweep_servers", autospec=True)
+def test_sweep_inventory_priority_wave_alert_fails(mock_sweep_servers, mock_load_results_by_ip, mock_ping_many):
+    servers = [{"ip": "1.1.1.1"}, {"ip": "2.2.2.2"}]
+
+    def fail(servers, check_result, interrog_routine, result_holder, err_handler, workers, budget, pings):
+        err_handler.append("down")
+
+    mock_sweep_servers.side_effect = fail
+    smtp_error = OSError("smtp unreachable")
+    err_handler = ErrorHandler()
+    sweep_inventory(servers, CheckResult, sentinel.interrog, ResultHolder(datetime.datetime(2022, 1, 5)),
+                    err_handler, SweepOptions(priority_wave=1), alert=MagicMock(side_effect=smtp_error))
+    # The rest are still swept:
+    assert mock_sweep_servers.call_count == 2
+    assert err_handler.errors == {None: ["down", smtp_error, "down"]}
+
+
+@patch("server_mon.ErrorHandler.email_traces", autospec=True)
+def test_alert_early(mock_email_traces):
+    wave_errors = ErrorHandler()
+    alert_early(mk_daemon_args(), CheckResult, wave_errors)
+    mock_email_traces.assert_called_once_with(
+        wave_errors, sentinel.email_addy, sentinel.password, "priority node")
+
+
+def mk_daemon_args(**overrides):
+    return argparse.Namespace(**{**dict(
+        nodes_file=sentinel.nodes_file, email_addy=sentinel.email_addy, password=sentinel.password,
+        send_on_success=False, workers=1, stage_limits=None, shards=1, node_budget=None,
+        sweep_deadline=None, adaptive=False, trip_after=None, priority_wave=None, ping_count=4, ping_interval=1.0, reach_first=False, sample_every=1,
+        tcp_probe=None, tcp_ports="22,443", daemon=True, interval=900.0, jitter=60.0), **overrides})
+
+
+@patch("server_mon.MonitorDaemon", autospec=True)
+@patch("server_mon.parse_args_for_monitoring", autospec=True, return_value=mk_daemon_args(email_to=None))
+def test_process_args_daemon(mock_parse_args, mock_daemon):
+    process_args(sentinel.args_list, CheckResult)
+    mock_daemon.assert_called_once_with(mock_parse_args.return_value, CheckResult)
+    mock_daemon.return_value.run.assert_called_once_with()
+
+
+@patch("server_mon.report_sweep", autospec=True)
+@patch("server_mon.sweep_inventory", autospec=True)
+@patch("server_mon.monitor_runners_ipv4", autospec=True)
+@patch("server_mon.load_nodes", autospec=True, return_value={"servers": sentinel.servers})
+@patch("server_mon.time.sleep", autospec=True)
+@patch("server_mon.random.random", return_value=0.5)
+@patch("server_mon.NodesFileWatcher", autospec=True)
+def test_monitor_daemon(mock_watcher, mock_random, mock_sleep, mock_load_nodes, mock_ipv4_monitor,
+                        mock_sweep_inventory, mock_report_sweep):
+    mock_watcher.return_value.has_changed.return_value = False
+    args = mk_daemon_args()
+    daemon = MonitorDaemon(args, CheckResult, sentinel.interrog)
+    daemon.run(3)
+    # Nodes are read, and our public IP fetched, once, however many sweeps:
+    mock_load_nodes.assert_called_once_with(sentinel.nodes_file)
+    mock_watcher.assert_called_once_with(sentinel.nodes_file)
+    assert mock_watcher.return_value.has_changed.call_count == 3
+    mock_ipv4_monitor.assert_called_once_with()
+    assert mock_sweep_inventory.call_count == 3
+    result_holders = [c.args[3] for c in mock_sweep_inventory.call_args_list]
+    # Each sweep has its own results, and so month file:
+    assert len(set(map(id, result_holders))) == 3
+    mock_sweep_inventory.assert_called_with(
+        sentinel.servers, CheckResult, sentinel.interrog, result_holders[-1],
+        mock_report_sweep.call_args.args[3], SweepOptions(), None, None, ANY, True)
+    assert mock_report_sweep.call_count == 3
+    for sleep_call in mock_sleep.call_args_list:
+        assert 900 < sleep_call.args[0] <= 930
+
+
+@patch("server_mon.report_sweep", autospec=True)
+@patch("server_mon.sweep_inventory", autospec=True)
+@patch("server_mon.monitor_runners_ipv4", autospec=True)
+@patch("server_mon.load_nodes", autospec=True, return_value={"servers": sentinel.servers})
+@patch("server_mon.time.sleep", autospec=True)
+@patch("server_mon.NodesFileWatcher", autospec=True)
+def test_monitor_daemon_samples_every(mock_watcher, mock_sleep, mock_load_nodes, mock_ipv4_monitor,
+                                      mock_sweep_inventory, mock_report_sweep):
+    mock_watcher.return_value.has_changed.return_value = False
+    MonitorDaemon(mk_daemon_args(reach_first=True, sample_every=2), CheckResult, sentinel.interrog).run(3)
+    assert [c.args[-1] for c in mock_sweep_inventory.call_args_list] == [True, False, True]
+
+
+@patch("server_mon.report_sweep", autospec=True)
+@patch("server_mon.sweep_inventory", autospec=True)
+@patch("server_mon.monitor_runners_ipv4", autospec=True)
+@patch("server_mon.load_nodes", autospec=True, return_value={"servers": []})
+@patch("server_mon.time.sleep", autospec=True)
+@patch("server_mon.NodesFileWatcher", autospec=True)
+@patch("ssh_pool.SSHPool", autospec=True)
+def test_monitor_daemon_keeps_ssh(mock_pool, mock_watcher, mock_sleep, mock_load_nodes, mock_ipv4_monitor,
+                                  mock_sweep_inventory, mock_report_sweep):
+    mock_watcher.return_value.has_changed.return_value = False
+    daemon = MonitorDaemon(mk_daemon_args(), CheckResult)
+    # Kept for twice the longest wait between sweeps:
+    mock_pool.assert_called_once_with(1920.0)
+    mock_pool.return_value.pid = os.getpid()
+    installed = []
+    mock_sweep_inventory.side_effect = lambda *args: installed.append(ssh_pool.installed())
+    daemon.run(2)
+    assert installed == [mock_pool.return_value] * 2
+    assert mock_pool.return_value.evict_idle.call_count == 2
+    mock_pool.return_value.close.assert_called_once_with()
+    assert ssh_pool.installed() is None
+
+
+@patch("server_mon.report_sweep", autospec=True)
+@patch("server_mon.sweep_inventory", autospec=True, side_effect=[RuntimeError("transient"), None])
+@patch("server_mon.monitor_runners_ipv4", autospec=True)
+@patch("server_mon.load_nodes", autospec=True, return_value={"servers": []})
+@patch("server_mon.time.sleep", autospec=True)
+@patch("server_mon.NodesFileWatcher", autospec=True)
+def test_monitor_daemon_survives_failed_sweep(mock_watcher, mock_sleep, mock_load_nodes, mock_ipv4_monitor,
+                                              mock_sweep_inventory, mock_report_sweep):
+    mock_watcher.return_value.has_changed.return_value = False
+    MonitorDaemon(mk_daemon_args(), CheckResult).run(2)
+    assert mock_sweep_inventory.call_count == 2
+    mock_report_sweep.assert_called_once()
+
+
+def test_import_defers_heavy_dependencies():
+    """
+    Emailing the month's results imports server_mon, but needn't import what
+    probing nodes does. -X importtime lists every module imported, and its
+    cost, should this regress.
+    """
+    repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    report = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import server_mon"],
+        cwd=repo_root, capture_output=True, text=True, check=True).stderr
+    imported = {line.split("|")[-1].strip() for line in report.splitlines()
+                if line.startswith("import time:")}
+    for heavy in ["paramiko", "requests", "urllib3", "cryptography", "paramiko_client"]:
+        assert heavy not in imported, report
+
+
+@patch("server_mon.report_sweep", autospec=True)
+@patch("server_mon.sweep_inventory", autospec=True)
+@patch("server_mon.monitor_runners_ipv4", autospec=True)
+@patch("server_mon.CircuitBreaker.load", autospec=True, side_effect=lambda trip_after: CircuitBreaker({}, trip_after))
+@patch("server_mon.AdaptiveScheduler.load", autospec=True, return_value=AdaptiveScheduler({}))
+def test_monitor_daemon_reloads_nodes(mock_scheduler_load, mock_breaker_load, mock_ipv4_monitor,
+                                      mock_sweep_inventory, mock_report_sweep, tmp_path):
+    nodes_file = tmp_path / "nodes.json"
+    servers = [{"ip": "1.1.1.1"}, {"ip": "2.2.2.2", "creds": []}, {"ip": "3.3.3.3"}]
+    nodes_file.write_text(json.dumps({"servers": servers}))
+    daemon = MonitorDaemon(mk_daemon_args(nodes_file=str(nodes_file), adaptive=True, trip_after=3), CheckResult)
+    for ipv4 in ["1.1.1.1", "2.2.2.2", "3.3.3.3"]:
+        daemon.scheduler.state[ipv4] = sentinel.schedule
+        daemon.breaker.state[ipv4] = sentinel.circuit
+    daemon.ssh_pool = Mock(spec=SSHPool)
+    daemon.sweep()
+    assert mock_sweep_inventory.call_args.args[0] == servers
+    # Replaced, as many editors save, rather than written in place:
+    edited = [{"ip": "1.1.1.1"}, {"ip": "2.2.2.2", "creds": [{"username": "u"}]}, {"ip": "4.4.4.4"}]
+    replacement = tmp_path / "nodes.json.new"
+    replacement.write_text(json.dumps({"servers": edited}))
+    os.replace(replacement, nodes_file)
+    daemon.sweep()
+    assert mock_sweep_inventory.call_args.args[0] == edited
+    # Only the removed node is forgotten. The edited one keeps its backoff and circuit:
+    assert daemon.scheduler.state == {"1.1.1.1": sentinel.schedule, "2.2.2.2": sentinel.schedule}
+    assert daemon.breaker.state == {"1.1.1.1": sentinel.circuit, "2.2.2.2": sentinel.circuit}
+    assert sorted(c.args[0] for c in daemon.ssh_pool.discard.call_args_list) == ["2.2.2.2", "3.3.3.3"]
+
+
+@patch("server_mon.report_sweep", autospec=True)
+@patch("server_mon.sweep_inventory", autospec=True)
+@patch("server_mon.monitor_runners_ipv4", autospec=True)
+def test_monitor_daemon_keeps_nodes_on_bad_edit(mock_ipv4_monitor, mock_sweep_inventory, mock_report_sweep,
+                                                tmp_path):
+    nodes_file = tmp_path / "nodes.json"
+    servers = [{"ip": "1.1.1.1"}]
+    nodes_file.write_text(json.dumps({"servers": servers}))
+    daemon = MonitorDaemon(mk_daemon_args(nodes_file=str(nodes_file)), CheckResult)
+    nodes_file.write_text('{"servers": [')
+    daemon.sweep()
+    assert mock_sweep_inventory.call_args.args[0] == servers
+    # Lacking servers, then briefly missing, as a save by rename might leave it:
+    nodes_file.write_text(json.dumps({"nodes": []}))
+    daemon.sweep()
+    assert mock_sweep_inventory.call_args.args[0] == servers
+    nodes_file.unlink()
+    daemon.sweep()
+    assert mock_sweep_inventory.call_args.args[0] == servers
+    nodes_file.write_text(json.dumps({"servers": []}))
+    os.utime(nodes_file, ns=(0, 0))
+    daemon.sweep()
+    assert mock_sweep_inventory.call_args.args[0] == []
@@ -1,47 +1,68 @@
 import datetime
-import subprocess
-from unittest.mock import patch, sentinel, Mock, mock_open, call
+from unittest.mock import patch, Mock, mock_open, call
 
 from indie_gen_funcs import RESULTS_DIR
-from server_pinger import time_pings, ping_all_day, PingResult, save_days_pings
-
-PING_OUTPUT = \
-    b'\nPING 8.8.8.8 (8.8.8.8) 56(84) bytes of data.\n64 bytes from 8.8.8.8: icmp_seq=1 ttl=119 time=7.51 ms\n64 ' \
-    b'bytes from 8.8.8.8: icmp_seq=2 ttl=119 time=7.63 ms\n64 bytes from 8.8.8.8: icmp_seq=3 ttl=119 time=7.68 ms\n64 ' \
-    b'bytes from 8.8.8.8: icmp_seq=4 ttl=119 time=7.46 ms\n\n--- 8.8.8.8 ping statistics ---\n4 packets transmitted, ' \
-    b'4 received, 0% packet loss, time 3006ms\nrtt min/avg/max/mdev = 7.463/7.570/7.679/0.088 ms\n '
-
-
-@patch("server_pinger.ping", return_value=Mock(
-    subprocess.CompletedProcess,
-    returncode=0,
-    stdout=PING_OUTPUT))
-def test_time_pings(mock_ping):
-    ave_latency_ms, max_latency_ms = time_pings(sentinel.ip_addy)
-    assert ave_latency_ms == 8
-    assert max_latency_ms == 8
-    mock_ping.assert_called_once_with(sentinel.ip_addy)
+from ping_functions import Latencies
+from server_pinger import ping_all_day, PingResult, save_days_pings, summarise_pings, CycleClock
 
 
 EXPECTED_PINGS = [
-    PingResult(local_time='000113 13:30:00', ipv4='mock_ip1', ave_latency_ms=15, max_latency_ms=19),
-    PingResult(local_time='000113 13:30:00', ipv4='mock_ip2', ave_latency_ms=15, max_latency_ms=19),
-    PingResult(local_time='000114 13:30:00', ipv4='mock_ip1', ave_latency_ms=15, max_latency_ms=19),
-    PingResult(local_time='000114 13:30:00', ipv4='mock_ip2', ave_latency_ms=15, max_latency_ms=19),
+    PingResult(local_time='000113 13:30:00', ipv4='mock_ip1', ave_latency_ms='15', max_latency_ms='19.2',
+               loss_pct='0', spread_ms='11.20_14.60_18.74_19.20_3.28'),
+    PingResult(local_time='000113 13:30:00', ipv4='mock_ip2', ave_latency_ms='15', max_latency_ms='18.6',
+               loss_pct='50', spread_ms='11.40_15.00_18.24_18.60_3.60'),
+    PingResult(local_time='000114 13:30:00', ipv4='mock_ip1', ave_latency_ms='15', max_latency_ms='19.2',
+               loss_pct='0', spread_ms='11.20_14.60_18.74_19.20_3.28'),
+    PingResult(local_time='000114 13:30:00', ipv4='mock_ip2', ave_latency_ms='15', max_latency_ms='18.6',
+               loss_pct='50', spread_ms='11.40_15.00_18.24_18.60_3.60'),
 ]
 
 
 @patch("server_pinger.save_days_pings", autospec=True, return_value=())
-@patch("server_pinger.time_pings", autospec=True, return_value=(15, 19))
-@patch("server_pinger.time", autospec=True)
+@patch("server_pinger.ping_many", autospec=True, return_value={
+    "mock_ip1": Latencies([14.6, 19.2, 11.2], 3), "mock_ip2": Latencies([11.4, 18.6], 4)})
 @patch("server_pinger.datetime", spec=datetime)
-def test_ping_all_day(mock_datetime, mock_time, mock_time_pings, save_days_pings):
+def test_ping_all_day(mock_datetime, mock_ping_many, save_days_pings):
     mock_datetime.utcnow = Mock(
-        side_effect=[datetime.datetime(2000, 1, 13, 13, 30, 00)] * 5 +
-                    [datetime.datetime(2000, 1, 14, 13, 30, 00)] * 5
+        side_effect=[datetime.datetime(2000, 1, 13, 13, 30, 00)] * 4 +
+                    [datetime.datetime(2000, 1, 14, 13, 30, 00)] * 2
     )
-    ping_all_day(["mock_ip1", "mock_ip2"])
-    save_days_pings.assert_called_once_with(EXPECTED_PINGS, '000113')
+    clock = Mock(CycleClock)
+    ping_all_day(["mock_ip1\n", "mock_ip2\n"], clock)
+    # The whole inventory is pinged together, once per cycle:
+    assert mock_ping_many.call_args_list == [call(["mock_ip1", "mock_ip2"])] * 2
+    # Each cycle is saved as soon as it's done, to the file of its own day:
+    assert save_days_pings.call_args_list == [
+        call(EXPECTED_PINGS[:2], '000113'), call(EXPECTED_PINGS[2:], '000114')]
+    assert clock.sleep_until_due.call_count == clock.advance.call_count == 2
+
+
+def test_summarise_pings():
+    # A LAN node's sub-millisecond latencies aren't rounded away:
+    assert summarise_pings([0.183, 0.215]) == ("0.199", "0.215")
+    assert summarise_pings([]) == (None, None)
+
+
+@patch("server_pinger.random.random", return_value=0.5)
+def test_cycle_clock_counts_from_due(mock_random):
+    clock = CycleClock(1000.0)
+    # Pinging took 5 minutes, which doesn't delay the next cycle:
+    assert clock.advance(1300.0) == 1000.0 + 3600
+
+
+@patch("server_pinger.random.random", return_value=0.0)
+def test_cycle_clock_overrun(mock_random):
+    clock = CycleClock(1000.0)
+    # Overrunning the next two cycles starts the next at once, skipping the other:
+    assert clock.advance(1000.0 + 4000) == 1000.0 + 4000
+    assert clock.advance(1000.0 + 4100) == 1000.0 + 4000 + 1800
+
+
+@patch("server_pinger.time.time", return_value=2000.0)
+@patch("server_pinger.time.sleep", autospec=True)
+def test_cycle_clock_never_sleeps_negative(mock_sleep, mock_time):
+    CycleClock(1000.0).sleep_until_due()
+    mock_sleep.assert_called_once_with(0.0)
 
 
 def test_save_days_pings():
@@ -50,8 +71,8 @@ def test_save_days_pings():
         mocked_open.assert_called_once_with("{}/pings_{}.csv".format(RESULTS_DIR, '000113'), "a+")
         # Note that calls continue into the next day if pinging delays them that much.
         mocked_open.return_value.write.assert_has_calls([
-            call('000113 13:30:00,mock_ip1,15,19\n'),
-            call('000113 13:30:00,mock_ip2,15,19\n'),
-            call('000114 13:30:00,mock_ip1,15,19\n'),
-            call('000114 13:30:00,mock_ip2,15,19\n')
+            call('000113 13:30:00,mock_ip1,15,19.2,0,11.20_14.60_18.74_19.20_3.28\n'),
+            call('000113 13:30:00,mock_ip2,15,18.6,50,11.40_15.00_18.24_18.60_3.60\n'),
+            call('000114 13:30:00,mock_ip1,15,19.2,0,11.20_14.60_18.74_19.20_3.28\n'),
+            call('000114 13:30:00,mock_ip2,15,18.6,50,11.40_15.00_18.24_18.60_3.60\n')
         ])
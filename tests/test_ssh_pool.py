@@ -0,0 +1,119 @@
+from unittest.mock import Mock, patch
+
+import pytest
+
+import ssh_pool
+from ssh_pool import SSHPool
+
+CREDS = [{"username": "u", "password": "p"}]
+
+
+def mk_client(active=True):
+    client = Mock()
+    client.get_transport.return_value.is_active.return_value = active
+    return client
+
+
+@pytest.fixture
+def pool():
+    return SSHPool(idle_s=100.0)
+
+
+def test_take_none_kept(pool):
+    assert pool.take("1.1.1.1", CREDS) is None
+
+
+def test_give_then_take(pool):
+    client = mk_client()
+    pool.give("1.1.1.1", CREDS, client)
+    client.get_transport.return_value.set_keepalive.assert_called_once_with(SSHPool.KEEPALIVE_S)
+    assert pool.take("1.1.1.1", CREDS) is client
+    # For the taker's sole use, till given back:
+    assert pool.take("1.1.1.1", CREDS) is None
+    client.close.assert_not_called()
+
+
+def test_give_inactive(pool):
+    client = mk_client(active=False)
+    pool.give("1.1.1.1", CREDS, client)
+    client.close.assert_called_once_with()
+    assert pool.kept == {}
+
+
+def test_give_replaces(pool):
+    old, new = mk_client(), mk_client()
+    pool.give("1.1.1.1", CREDS, old)
+    pool.give("1.1.1.1", CREDS, new)
+    old.close.assert_called_once_with()
+    assert pool.take("1.1.1.1", CREDS) is new
+
+
+def test_give_evicts_least_recently_used():
+    pool = SSHPool(idle_s=100.0, max_kept=2)
+    clients = [mk_client() for _ in range(3)]
+    pool.give("1.1.1.1", CREDS, clients[0])
+    pool.give("2.2.2.2", CREDS, clients[1])
+    # Used again, so no longer the least recent:
+    pool.give("1.1.1.1", CREDS, pool.take("1.1.1.1", CREDS))
+    pool.give("3.3.3.3", CREDS, clients[2])
+    assert list(pool.kept) == ["1.1.1.1", "3.3.3.3"]
+    clients[1].close.assert_called_once_with()
+    clients[0].close.assert_not_called()
+
+
+@patch("ssh_pool.kept_connections_limit", return_value=7)
+def test_max_kept_by_open_files(mock_kept_connections_limit):
+    assert SSHPool(idle_s=100.0).max_kept == 7
+
+
+def test_take_died(pool):
+    client = mk_client()
+    pool.give("1.1.1.1", CREDS, client)
+    client.get_transport.return_value.is_active.return_value = False
+    assert pool.take("1.1.1.1", CREDS) is None
+    client.close.assert_called_once_with()
+
+
+def test_take_creds_edited(pool):
+    client = mk_client()
+    pool.give("1.1.1.1", CREDS, client)
+    assert pool.take("1.1.1.1", [{"username": "v"}]) is None
+    client.close.assert_called_once_with()
+
+
+@patch("ssh_pool.time.monotonic", autospec=True, side_effect=[0.0, 50.0])
+def test_evict_idle(mock_monotonic, pool):
+    stale, fresh = mk_client(), mk_client()
+    pool.give("1.1.1.1", CREDS, stale)
+    pool.give("2.2.2.2", CREDS, fresh)
+    pool.evict_idle(now=120.0)
+    stale.close.assert_called_once_with()
+    fresh.close.assert_not_called()
+    assert list(pool.kept) == ["2.2.2.2"]
+
+
+def test_discard_and_close(pool):
+    clients = {ipv4: mk_client() for ipv4 in ["1.1.1.1", "2.2.2.2", "3.3.3.3"]}
+    for ipv4, client in clients.items():
+        pool.give(ipv4, CREDS, client)
+    pool.discard("1.1.1.1")
+    pool.discard("4.4.4.4")
+    clients["1.1.1.1"].close.assert_called_once_with()
+    clients["2.2.2.2"].close.assert_not_called()
+    pool.close()
+    for client in clients.values():
+        client.close.assert_called_once_with()
+    assert pool.kept == {}
+
+
+def test_installed(pool):
+    assert ssh_pool.installed() is None
+    ssh_pool.install(pool)
+    try:
+        assert ssh_pool.installed() is pool
+        # As in a shard process, forked from the daemon:
+        with patch("ssh_pool.os.getpid", return_value=pool.pid + 1):
+            assert ssh_pool.installed() is None
+    finally:
+        ssh_pool.install(None)
+    assert ssh_pool.installed() is None
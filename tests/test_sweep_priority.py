@@ -0,0 +1,40 @@
+from check_result import CheckResult
+from indie_gen_funcs import result_timestamp
+from sweep_priority import prioritise, score, STALE_S, WINDOW
+
+YYMM = "2201"
+
+
+NOW = result_timestamp(YYMM, CheckResult("01 10:00:00", "1.1.1.1"))
+
+
+def test_score_unknown_node_first():
+    assert score(YYMM, [], NOW) == float("inf")
+
+
+def test_score_steady_node_just_probed(mk_result):
+    assert score(YYMM, [mk_result("1.1.1.1")] * 3, NOW) == 0.0
+
+
+def test_score_components(mk_result):
+    # Half failed, the rest varying by a third of their mean, and a day stale:
+    results = [mk_result("1.1.1.1", None), mk_result("1.1.1.1", "20"),
+               mk_result("1.1.1.1", None), mk_result("1.1.1.1", "40")]
+    assert score(YYMM, results, NOW + STALE_S) == 2.0 * 0.5 + 1 / 3 + 1.0
+    assert score(YYMM, results, NOW + 10 * STALE_S) == 2.0 * 0.5 + 1 / 3 + 1.0
+
+
+def test_score_only_recent_rows(mk_result):
+    results = [mk_result("1.1.1.1", None)] * 5 + [mk_result("1.1.1.1")] * WINDOW
+    assert score(YYMM, results, NOW) == 0.0
+
+
+def test_prioritise(mk_result):
+    servers = [{"ip": "1.1.1.1"}, {"ip": "2.2.2.2"}, {"ip": "3.3.3.3"}, {"ip": "4.4.4.4"}]
+    results_by_ip = {
+        "1.1.1.1": [mk_result("1.1.1.1")],
+        "2.2.2.2": [mk_result("2.2.2.2", None)],
+        "4.4.4.4": [mk_result("4.4.4.4")],
+    }
+    assert [s["ip"] for s in prioritise(servers, YYMM, results_by_ip, NOW)] == [
+        "3.3.3.3", "2.2.2.2", "1.1.1.1", "4.4.4.4"]
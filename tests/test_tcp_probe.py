@@ -0,0 +1,55 @@
+import socket
+import time
+
+import pytest
+
+from tcp_probe import ConnectSession, parse_ports, tcp_ping_many
+
+
+@pytest.fixture
+def listening_port():
+    with socket.socket() as server:
+        server.bind(("127.0.0.1", 0))
+        server.listen(16)
+        yield server.getsockname()[1]
+
+
+def closed_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_parse_ports():
+    assert parse_ports("22,443") == (22, 443)
+    assert parse_ports("8022") == (8022,)
+
+
+def test_tcp_ping_many(listening_port):
+    started = time.monotonic()
+    latencies = tcp_ping_many({
+        "127.0.0.1": [listening_port],
+        # A refused connection is as good an answer:
+        "127.0.0.2": [closed_port()],
+        "no.such.host.invalid": [22],
+    }, 3, 0.01, 1.0)
+    assert time.monotonic() - started < 1
+    assert [len(latencies[host]) for host in latencies] == [3, 3, 0]
+    assert all(0 < latency < 1000 for latency in latencies["127.0.0.1"])
+    assert {(host_latencies.sent, host_latencies.method) for host_latencies in latencies.values()} == {(3, "tcp")}
+
+
+def test_connect_session_races_ports(listening_port):
+    session = ConnectSession({"127.0.0.1": [closed_port(), listening_port]}, 1, 0.0, 1.0)
+    session.run()
+    assert len(session.latencies()["127.0.0.1"]) == 1
+    assert session.connecting == {}
+
+
+def test_connect_session_max_open(listening_port):
+    session = ConnectSession({"127.0.0.1": [listening_port], "127.0.0.2": [listening_port]},
+                             2, 0.0, 1.0, max_open=0)
+    # Nothing fits, so nothing is started, nor waited for:
+    session.start_due()
+    assert session.next_probe == 0
+    assert session.wake_in() is None
@@ -0,0 +1,21 @@
+from unittest.mock import patch
+
+from time_budget import TimeBudget
+
+
+def test_starting_now_unbounded():
+    assert TimeBudget.starting_now(None, None) is None
+
+
+@patch("time_budget.time.monotonic", return_value=1000.0)
+def test_starting_now(mock_monotonic):
+    assert TimeBudget.starting_now(30.0, None) == TimeBudget(30.0, None)
+    assert TimeBudget.starting_now(None, 600.0) == TimeBudget(None, 1600.0)
+    assert TimeBudget.starting_now(30.0, 600.0) == TimeBudget(30.0, 1600.0)
+
+
+def test_node_deadline():
+    assert TimeBudget(30.0, None).node_deadline(1000.0) == 1030.0
+    assert TimeBudget(None, 1600.0).node_deadline(1000.0) == 1600.0
+    assert TimeBudget(30.0, 1600.0).node_deadline(1000.0) == 1030.0
+    assert TimeBudget(30.0, 1600.0).node_deadline(1590.0) == 1600.0
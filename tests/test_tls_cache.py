@@ -0,0 +1,79 @@
+import json
+from unittest.mock import patch
+
+import tls_cache
+from tls_cache import TlsCache, tls_host, shared_cache, RECHECK_S, CHANGED
+
+
+def test_tls_host():
+    assert tls_host("https://example.com/index.html") == "example.com:443"
+    assert tls_host("https://user@example.com:8443") == "example.com:8443"
+    assert tls_host("http://example.com") is None
+
+
+def test_record_unverified(tmp_path):
+    state_file = str(tmp_path / "tls_state.json")
+    tls_cache = TlsCache.load(state_file)
+    assert not tls_cache.skips_verifying("a:443")
+    assert tls_cache.record("a:443", "f1", verified=False, now=1000.0) is None
+    assert tls_cache.is_unverified("a:443")
+    assert tls_cache.skips_verifying("a:443", now=1000.0 + RECHECK_S - 1)
+    assert not tls_cache.skips_verifying("a:443", now=1000.0 + RECHECK_S)
+    assert TlsCache.load(state_file).state == {
+        "a:443": {"verified": False, "checked": 1000.0, "fingerprint": "f1"}}
+    assert tls_cache.record("a:443", "f1", now=2000.0) is None
+    assert tls_cache.record("a:443", "f2", now=3000.0) == CHANGED.format("a:443", "f1", "f2")
+    assert tls_cache.state["a:443"] == {"verified": False, "checked": 1000.0, "fingerprint": "f2"}
+
+
+def test_record_verified(tmp_path):
+    state_file = tmp_path / "tls_state.json"
+    tls_cache = TlsCache.load(str(state_file))
+    assert tls_cache.record("a:443", "f1", verified=True) is None
+    assert not tls_cache.is_unverified("a:443")
+    # Verified certs are renewed often, so aren't pinned:
+    assert tls_cache.record("a:443", "f2", verified=True) is None
+    # Nor reported once verification first fails:
+    assert tls_cache.record("a:443", "f3", verified=False, now=10.0) is None
+    assert json.loads(state_file.read_text())["a:443"]["fingerprint"] == "f3"
+
+
+def test_record_saves_only_changes(tmp_path):
+    state_file = tmp_path / "tls_state.json"
+    tls_cache = TlsCache.load(str(state_file))
+    tls_cache.record("a:443", "f1", verified=True)
+    state_file.unlink()
+    tls_cache.record("a:443", "f1", verified=True)
+    assert not state_file.exists()
+
+
+def test_load_corrupt(tmp_path):
+    state_file = tmp_path / "tls_state.json"
+    # As a crash mid-write once could:
+    state_file.write_text('{"a:443": {"verif')
+    tls_cache = TlsCache.load(str(state_file))
+    assert tls_cache.state == {}
+    tls_cache.record("b:443", "f1", verified=True)
+    assert list(json.loads(state_file.read_text())) == ["b:443"]
+    assert [path.name for path in tmp_path.iterdir()] == ["tls_state.json"]
+
+
+def test_save_keeps_other_processes_records(tmp_path):
+    state_file = str(tmp_path / "tls_state.json")
+    shard_1 = TlsCache.load(state_file)
+    shard_2 = TlsCache.load(state_file)
+    shard_1.record("a:443", "f1", verified=False, now=10.0)
+    shard_2.record("b:443", "f2", verified=True)
+    shard_1.record("a:443", "f3", verified=True)
+    assert TlsCache.load(state_file).state == {
+        "a:443": {"verified": True, "checked": 10.0, "fingerprint": "f3"},
+        "b:443": {"verified": True, "checked": 0.0, "fingerprint": "f2"}}
+
+
+@patch("tls_cache.TlsCache.load", autospec=True, side_effect=lambda: TlsCache({}))
+def test_shared_cache_per_process(mock_load):
+    with patch.object(tls_cache, "_shared", None), patch.object(tls_cache, "_shared_pid", None):
+        cache = shared_cache()
+        assert shared_cache() is cache
+        with patch("tls_cache.os.getpid", return_value=-1):
+            assert shared_cache() is not cache
@@ -0,0 +1,43 @@
+"""
+Bounds on how long probing may take, per node and for the sweep as a whole,
+so that a degraded node can't stall the sweep, nor a degraded inventory
+overrun the next.
+"""
+from __future__ import annotations
+
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+
+@dataclass(frozen=True)
+class TimeBudget:
+    """
+    Times are from time.monotonic(), which is system-wide, so a budget may be
+    handed to worker processes.
+
+    :param node_s: wall-clock seconds each node may take.
+    :param deadline: when the whole sweep should have finished by.
+    """
+    node_s: Optional[float] = None
+    deadline: Optional[float] = None
+
+    OVERRUN = "{} ran out of time, so only what was gathered by then is recorded."
+
+    @classmethod
+    def starting_now(cls, node_s: Optional[float], sweep_s: Optional[float])\
+            -> Optional[TimeBudget]:
+        """
+        :return: the budget for a sweep beginning now, or None if unbounded.
+        """
+        if node_s is None and sweep_s is None:
+            return None
+        deadline = None if sweep_s is None else time.monotonic() + sweep_s
+        return cls(node_s, deadline)
+
+    def node_deadline(self, started: float) -> float:
+        """When a node first probed at `started` must be finished by."""
+        deadlines = [self.deadline]
+        if self.node_s is not None:
+            deadlines.append(started + self.node_s)
+        return min(d for d in deadlines if d is not None)
@@ -0,0 +1,134 @@
+"""
+Remembers, for each home_page host, whether its certificate verified, and
+which certificate it was.
+
+A host whose certificate failed to verify, as a self-signed one does, is then
+requested unverified, rather than verified, failing, and requested again,
+every sweep. Its certificate is pinned instead, so a different one is still
+reported. Once a day it is given another chance to verify, in case it has
+since been given a certificate that will.
+
+Each shard process keeps its own cache, and only saves the hosts it has
+recorded over whatever the file holds by then, so that shards don't undo
+each other's records.
+"""
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional, Set
+from urllib.parse import urlsplit
+
+from indie_gen_funcs import RESULTS_DIR
+
+STATE_FILE = "{}/tls_state.json".format(RESULTS_DIR)
+RECHECK_S = 24 * 3600.0
+CHANGED = "TLS certificate of {} changed, from SHA-256 {} to {}"
+
+_lock = threading.Lock()
+_shared = None
+_shared_pid = None
+
+
+class TlsCache:
+    """
+    Keeps, under each host, as "host:port", whether its certificate verified
+    when last checked, when it last failed to, and its fingerprint.
+    """
+
+    def __init__(self, state: Dict[str, dict], state_file: str = STATE_FILE):
+        self.state = state
+        self.state_file = state_file
+        self.lock = threading.Lock()
+        # Those this process has recorded, and so saves:
+        self.recorded: Set[str] = set()
+
+    @classmethod
+    def load(cls, state_file: str = STATE_FILE) -> TlsCache:
+        return cls(read_state(state_file), state_file)
+
+    def save(self):
+        """
+        Writes the hosts this process recorded over those now in the file.
+        The file is written aside then moved into place, so that a crash
+        can't leave it truncated.
+        """
+        self.state = {**read_state(self.state_file),
+                      **{host: self.state[host] for host in self.recorded}}
+        Path(self.state_file).parent.mkdir(parents=True, exist_ok=True)
+        written = "{}.{}.tmp".format(self.state_file, os.getpid())
+        with open(written, "w", encoding="utf8") as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(written, self.state_file)
+
+    def is_unverified(self, host: str) -> bool:
+        """:return: whether the host is known, and known not to verify."""
+        return host in self.state and not self.state[host]["verified"]
+
+    def skips_verifying(self, host: str, now: Optional[float] = None) -> bool:
+        """:return: whether the host failed to verify, and isn't due another go."""
+        now = time.time() if now is None else now
+        return self.is_unverified(host) and \
+            now < self.state[host]["checked"] + RECHECK_S
+
+    def record(self, host: str, fingerprint: Optional[str],
+               verified: Optional[bool] = None,
+               now: Optional[float] = None) -> Optional[str]:
+        """
+        Saves any change to what is known of the host.
+
+        :param verified: whether its certificate verified, or None if it
+            wasn't checked.
+        :return: a report of its certificate having changed, if it wasn't
+            verified.
+        """
+        now = time.time() if now is None else now
+        with self.lock:
+            host_state = self.state.get(host, {"verified": False, "checked": 0.0})
+            report = None
+            if not host_state["verified"] and verified is not True and \
+                    host_state.get("fingerprint") not in (None, fingerprint):
+                report = CHANGED.format(host, host_state["fingerprint"], fingerprint)
+            new_state = dict(host_state, fingerprint=fingerprint)
+            if verified is not None:
+                new_state["verified"] = verified
+            if verified is False:
+                new_state["checked"] = now
+            if new_state != self.state.get(host):
+                self.state[host] = new_state
+                self.recorded.add(host)
+                self.save()
+        return report
+
+
+def read_state(state_file: str) -> Dict[str, dict]:
+    """:return: the state saved, or none, should the file be missing or corrupt."""
+    try:
+        with open(state_file, encoding="utf8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def tls_host(url: str) -> Optional[str]:
+    """:return: the "host:port" of an https URL, or None for any other."""
+    parts = urlsplit(url)
+    if parts.scheme != "https":
+        return None
+    return "{}:{}".format(parts.hostname, parts.port or 443)
+
+
+def shared_cache() -> TlsCache:
+    """
+    :return: the process's cache, loaded on first use. A forked child loads
+        its own, rather than save its parent's records as its own.
+    """
+    global _shared, _shared_pid
+    with _lock:
+        if _shared is None or _shared_pid != os.getpid():
+            _shared = TlsCache.load()
+            _shared_pid = os.getpid()
+        return _shared